@@ -0,0 +1,681 @@
+from error_correction import remove_errors
+from graph import DeBruijnGraph
+from instrument import Recorder
+from kmers import KmerHist, count_kmers, decode, decode_all, decode_last, encode, packed_windows, sequence_codes
+from pipeline import K_RANGE, Assembly
+from sweep import mark
+from itertools import chain, count
+from array import array
+import numpy as np
+import time
+import os
+
+# value of a key missing from all runs, for the reductions of columns
+MISSING = {np.add: 0, np.minimum: np.iinfo(np.int64).max, np.maximum: -1}
+
+
+class SortedRuns:
+    """ Table of packed keys and their values kept as a few sorted runs
+        instead of one array, so adding a batch does not rewrite the
+        table. A key may be in many runs, its value in every column is
+        the reduction of its values in them by the ufunc of the column
+        (np.add, np.minimum or np.maximum). A new run is merged with the
+        last one while that is at most twice as long, so there are
+        O(log n) runs and every entry is merged O(log n) times. Runs are
+        saved into files of their own, which are never changed. """
+
+    def __init__(self, columns):
+        """ Columns maps names of the value columns to their ufuncs. """
+
+        self.columns = columns
+        self.runs = []
+        self.files = []  # file name of every run, None until it is saved
+
+    def add(self, keys, **values):
+        """ Add sorted, distinct keys with their values as a new run. """
+
+        self.runs.append(dict(values, keys=keys))
+        self.files.append(None)
+        while len(self.runs) > 1 and len(self.runs[-2]['keys']) <= 2 * len(self.runs[-1]['keys']):
+            last = self.runs.pop()
+            self.files[-2:] = [None]
+            self.runs[-1] = self.reduce([self.runs[-1], last])
+
+    def reduce(self, runs):
+        """ Return one run with the entries of the given runs. """
+
+        keys = np.concatenate([np.zeros(0, dtype=np.uint64)] + [run['keys'] for run in runs])
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if len(keys) else order
+        merged = {'keys': keys[starts]}
+        for name, ufunc in self.columns.items():
+            values = np.concatenate([np.zeros(0, dtype=np.int64)] + [run[name] for run in runs])[order]
+            merged[name] = ufunc.reduceat(values, starts) if len(keys) else values
+        return merged
+
+    def merged(self):
+        """ Merge all runs into one and return it. """
+
+        if len(self.runs) != 1:
+            self.runs = [self.reduce(self.runs)]
+            self.files = [None]
+        return self.runs[0]
+
+    def lookup(self, keys):
+        """ Return the dict of values of the packed keys in every column
+            (see MISSING for keys which are absent) and the mask of keys
+            which are present. """
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = np.zeros(len(keys), dtype=bool)
+        values = {name: np.full(len(keys), MISSING[ufunc], dtype=np.int64) for name, ufunc in self.columns.items()}
+        for run in self.runs:
+            if not len(run['keys']):
+                continue
+            idx = np.searchsorted(run['keys'], keys)
+            idx[idx == len(run['keys'])] = 0
+            hit = run['keys'][idx] == keys
+            found |= hit
+            for name, ufunc in self.columns.items():
+                values[name][hit] = ufunc(values[name][hit], run[name][idx[hit]])
+        return values, found
+
+    def keys_in(self, name, low, high):
+        """ Return sorted packed keys whose value in the column name (of
+            np.add, with values above 0) is above low and at most high.
+            Such a key has a value at most high in every run, so only
+            these keys are looked up. """
+
+        keys = np.unique(np.concatenate([np.zeros(0, dtype=np.uint64)] +
+                                        [run['keys'][run[name] <= high] for run in self.runs]))
+        values = self.lookup(keys)[0][name]
+        return keys[(values > low) & (values <= high)]
+
+    def save(self, directory, prefix):
+        """ Write runs which are not saved yet into the directory, as
+            <prefix><number>.<column>.npy files. Return names of the files
+            of all runs. """
+
+        # numbers of files on disk are not reused, they may be mapped by the saved state
+        used = [int(name[len(prefix):].split('.')[0]) for name in os.listdir(directory)
+                if name.startswith(prefix) and name.endswith('.npy')]
+        number = max(used + [-1])
+        for i, run in enumerate(self.runs):
+            if self.files[i] is None:
+                number += 1
+                self.files[i] = '%s%d' % (prefix, number)
+                for name, values in run.items():
+                    np.save(os.path.join(directory, '%s.%s.npy' % (self.files[i], name)), values)
+        return list(self.files)
+
+    def load(self, directory, files):
+        """ Map the runs saved in the files of the directory into memory. """
+
+        self.files = list(files)
+        self.runs = [{name: np.load(os.path.join(directory, '%s.%s.npy' % (f, name)), mmap_mode='r')
+                      for name in chain(['keys'], self.columns)} for f in files]
+
+
+class RunHist(KmerHist):
+    """ KmerHist of the counts of an AccumulatedAssembly, which are kept
+        in SortedRuns and looked up run by run, with the count histogram
+        kept apart. It serves the correction of reads. """
+
+    def __init__(self, k, runs, spectrum):
+        super().__init__(k, None, None)
+        self.runs = runs
+        self._spectrum = spectrum
+
+    def __len__(self):
+        return int(self._spectrum[1:].sum())
+
+    def lookup(self, codes):
+        return self.runs.lookup(codes)[0]['counts']
+
+    def get(self, kmer, default=0):
+        if isinstance(kmer, str):
+            kmer = encode(kmer) if len(kmer) == self.k else None
+            if kmer is None:
+                return default
+        return int(self.lookup([kmer])[0]) or default
+
+    def spectrum(self):
+        return self._spectrum
+
+
+class Unitig:
+    """ Nodes of an AccumulatedAssembly (members, as ids) joined by edges
+        which are the only out-edge of their source and the only in-edge
+        of their target, with weights of these edges, and the Node
+        objects it is searched as: one merged node, or a node for every
+        member of a cycle, which is not merged, as compact does not merge
+        cycles without a head. Weights of a cycle end with the weight of
+        the edge from its last member to the first one. """
+
+    __slots__ = ('members', 'weights', 'cycle', 'nodes')
+
+    def __init__(self, members, weights, cycle=False):
+        self.members = members
+        self.weights = weights
+        self.cycle = cycle
+        self.nodes = []
+
+
+class AccumulatedAssembly:
+    """ Incremental assembly for one k of reads which arrive in batches.
+        It keeps the k-mer counts of all reads and the uncompacted graph
+        of the corrected reads, a table of edges (packed k-mers and their
+        counts), both as SortedRuns, so adding a batch does not rewrite
+        them. A batch is counted and corrected with the counts of all
+        reads, the threshold is computed from the count histogram, which
+        is updated with the counts of the batch.
+
+        The merged graph is kept between batches as unitigs: maximal
+        paths of edges which are the only out-edge of their source and
+        the only in-edge of their target, in the graph left after sides
+        of rare k-mers are removed (as CSRGraph.remove_rare_kmers does)
+        and edges not heavier than the threshold are cut. A batch changes
+        only the nodes around its k-mers and edges, and, when the
+        threshold changes, around the k-mers and edges whose count lies
+        between the old and the new threshold. Removal is done again in
+        the groups of these nodes (see remove_rare), unitigs through the
+        nodes whose edges may have changed are split there and joined
+        again (see relink). Contigs are searched in all merged nodes, as
+        DeBruijnGraph.search_contigs does, which takes time of the order
+        of the merged graph, not of the reads.
+
+        The result is that of merging all nodes at once (see rebuild).
+        It differs from CSRGraph of the same corrected reads where
+        compact, which walks from heads, leaves a unitig split or does
+        not reach it, and in the order of the nodes, which only breaks
+        ties. Reads corrected earlier are not corrected again with the
+        grown counts. Only forward strand counting is supported. """
+
+    def __init__(self, k, name='reads', output=None, recorder=None, workers=1, **options):
+        """ Batches are corrected by workers processes, options are
+            passed to the contig search (search, max_paths). """
+
+        self.k = k
+        self.workers = workers
+        self.name = name
+        self.output = output
+        self.recorder = recorder or Recorder()
+        self.options = options
+        self.mask = np.uint64((1 << 2 * (k - 1)) - 1)
+        self.counts = SortedRuns({'counts': np.add})  # k-mer counts of all reads
+        self.edges = SortedRuns({'weight': np.add})  # k-mers of the corrected reads
+        self.ids = SortedRuns({'id': np.maximum})  # packed k-1-mers of nodes and their ids
+        self.spectrum = np.zeros(1, dtype=np.int64)  # count histogram of k-mers of all reads
+        self.codes = array('Q')  # packed k-1-mer of every node id
+        self.removed = bytearray()  # 1 for nodes removed as sides of rare k-mers
+        self.unitig = array('q')  # key of the unitig of every node, -1 if it has no edge left
+        self.unitigs = {}  # key -> Unitig
+        self.keys = count()
+        self.ends = {}  # Node object -> ids of its first and last member
+        self.contigs = []  # (score, sequence) of the contigs of all reads
+        self.thresh = None
+        self.bases = 0
+        self.reads = 0
+
+    def hist(self):
+        """ Return RunHist of the counts of all reads. """
+
+        return RunHist(self.k, self.counts, self.spectrum)
+
+    def add(self, reads):
+        """ Add the reads (list or ReadStore) and assemble all reads added
+            so far. Return sequences of the contigs, from the best scored
+            (length times mean weight). """
+
+        k = self.k
+        two = np.uint64(2)
+        with self.recorder.stage('counting', k) as record:
+            batch = count_kmers(reads, k)
+            self.count(batch.kmers, batch.counts)
+            thresh = self.hist().threshold()
+            if record is not None:
+                record.update(kmers=len(batch), total=len(self.hist()))
+        with self.recorder.stage('correction', k) as record:
+            corrected = remove_errors(reads, k, self.hist(), self.workers)
+            if record is not None:
+                record.update(reads=len(corrected), thresh=int(thresh))
+        with self.recorder.stage('edges', k) as record:
+            windows, valid = packed_windows(sequence_codes(corrected), k)
+            kmers, counts = np.unique(windows[valid], return_counts=True)
+            self.edges.add(kmers, weight=counts)
+            self.register(np.unique(np.concatenate((kmers >> two, kmers & self.mask))))
+            self.bases += reads.total_length() if hasattr(reads, 'total_length') else sum(len(r) for r in reads)
+            self.reads += len(reads)
+            if record is not None:
+                record.update(edges=len(kmers), nodes=len(self.codes))
+        with self.recorder.stage('merge', k) as record:
+            rebuild = self.thresh is None
+            sides = [side for codes in (batch.kmers, kmers) for side in (codes >> two, codes & self.mask)]
+            if not rebuild and thresh != self.thresh:
+                sides.append(self.band(self.thresh, thresh))
+            old, self.thresh = self.thresh, thresh
+            dirty = self.merge(None if rebuild else np.unique(np.concatenate(sides)))
+            if record is not None:
+                record.update(rebuild=rebuild, changed=old is not None and old != thresh, thresh=int(thresh),
+                              dirty=dirty, merged=len(self.ends))
+        with self.recorder.stage('search', k) as record:
+            self.search()
+            if record is not None:
+                record.update(merged=len(self.ends), contigs=len(self.contigs))
+        return self.sequences()
+
+    def count(self, kmers, counts):
+        """ Add counts of the sorted, distinct packed k-mers of a batch
+            to the counts and to the count histogram. """
+
+        old = self.counts.lookup(kmers)[0]['counts']
+        new = old + counts
+        if len(new) and new.max() >= len(self.spectrum):
+            missing = np.zeros(new.max() + 1 - len(self.spectrum), dtype=np.int64)
+            self.spectrum = np.concatenate((self.spectrum, missing))
+        np.subtract.at(self.spectrum, old[old > 0], 1)
+        np.add.at(self.spectrum, new, 1)
+        self.counts.add(kmers, counts=counts)
+
+    def register(self, km1mers):
+        """ Give ids to the sorted, distinct packed k-1-mers which are
+            not nodes yet. """
+
+        new = km1mers[~self.ids.lookup(km1mers)[1]]
+        ids = np.arange(len(self.codes), len(self.codes) + len(new), dtype=np.int64)
+        self.ids.add(new, id=ids)
+        self.codes.frombytes(new.astype(np.uint64).tobytes())
+        self.removed.extend(bytes(len(new)))
+        self.unitig.frombytes(np.full(len(new), -1, dtype=np.int64).tobytes())
+
+    def band(self, old, new):
+        """ Return sides of the k-mers which become rare or stop being
+            rare, and of the edges which are cut or stop being cut, when
+            the threshold changes from old to new. """
+
+        low, high = sorted((old, new))
+        kmers = np.concatenate((self.counts.keys_in('counts', low, high),
+                                self.edges.keys_in('weight', max(low, 1), max(high, 1))))
+        return np.concatenate((kmers >> np.uint64(2), kmers & self.mask))
+
+    def around(self, km1mers):
+        """ Return the matrix of packed k-mers which the k-1-mers are the
+            left (first 4 columns) and the right side of. """
+
+        km1mers = np.asarray(km1mers, dtype=np.uint64)[:, None]
+        bases = np.arange(4, dtype=np.uint64)
+        return np.concatenate(((km1mers << np.uint64(2)) | bases, (bases << np.uint64(2 * (self.k - 1))) | km1mers),
+                              axis=1)
+
+    def adjacency(self, ids):
+        """ Return ids of the children (first 4 columns) and parents of
+            the nodes and weights of the edges to them, 0 where there is
+            no edge (the id is -1 then). """
+
+        kmers = self.around(np.frombuffer(self.codes, dtype=np.uint64)[ids])
+        weights = self.edges.lookup(kmers.ravel())[0]['weight'].reshape(kmers.shape)
+        neighbours = np.full(kmers.shape, -1, dtype=np.int64)
+        present = weights > 0
+        km1mers = np.concatenate((kmers[:, :4] & self.mask, kmers[:, 4:] >> np.uint64(2)), axis=1)
+        neighbours[present] = self.ids.lookup(km1mers[present])[0]['id']
+        return neighbours, weights
+
+    def neighbours(self, ids):
+        """ Return sorted ids of the nodes and of their neighbours. """
+
+        neighbours, weights = self.adjacency(ids)
+        return np.union1d(ids, neighbours[weights > 0])
+
+    def clean(self, ids):
+        """ Return adjacency of the nodes (see adjacency) after sides of
+            rare k-mers are removed and edges are cut: weights of edges
+            of removed nodes and of edges not heavier than the threshold
+            are 0. """
+
+        neighbours, weights = self.adjacency(ids)
+        removed = np.frombuffer(self.removed, dtype=np.uint8)
+        dead = (weights <= max(self.thresh, 1)) | (removed[ids] > 0)[:, None] | (removed[neighbours] > 0)
+        weights[dead] = 0
+        neighbours[dead] = -1
+        return neighbours, weights
+
+    def rare_sides(self, ids):
+        """ Return masks of the nodes which are left and right sides of
+            rare k-mers (seen at most thresh times). """
+
+        if self.thresh < 1:
+            return np.zeros(len(ids), dtype=bool), np.zeros(len(ids), dtype=bool)
+        kmers = self.around(np.frombuffer(self.codes, dtype=np.uint64)[ids])
+        counts = self.counts.lookup(kmers.ravel())[0]['counts'].reshape(kmers.shape)
+        rare = (counts > 0) & (counts <= self.thresh)
+        return rare[:, :4].any(axis=1), rare[:, 4:].any(axis=1)
+
+    def remove_rare(self, seeds):
+        """ Remove nodes which are sides of rare k-mers as
+            CSRGraph.remove_rare_kmers does: left sides in the order of
+            their k-1-mers if they have a parent left, then right sides if
+            they have a child left. Whether a node is removed depends only
+            on its group, the nodes joined to it by edges between sides of
+            rare k-mers, so the groups of the seeds (ids) are found and
+            removed again. Return sorted ids of the seeds and the groups. """
+
+        sides = {}  # id -> whether it is a left and a right side
+        pending = np.unique(seeds)
+        while len(pending):
+            left, right = self.rare_sides(pending)
+            sides.update(zip(pending.tolist(), zip(left.tolist(), right.tolist())))
+            neighbours, weights = self.adjacency(pending[left | right])
+            pending = np.unique(neighbours[weights > 0])
+            pending = pending[np.array([i not in sides for i in pending.tolist()], dtype=bool)]
+
+        rare = np.array([i for i, (left, right) in sides.items() if left or right], dtype=np.int64)
+        rare = rare[np.argsort(np.frombuffer(self.codes, dtype=np.uint64)[rare], kind='stable')]
+        neighbours, weights = self.adjacency(rare)
+        present = weights > 0
+        index = {i: j for j, i in enumerate(rare.tolist())}
+        children = [[index[i] for i in row[mask] if i in index] for row, mask in zip(neighbours[:, :4], present[:, :4])]
+        parents = [[index[i] for i in row[mask] if i in index] for row, mask in zip(neighbours[:, 4:], present[:, 4:])]
+        outdeg = present[:, :4].sum(axis=1).tolist()
+        indeg = present[:, 4:].sum(axis=1).tolist()
+        alive = [True] * len(rare)
+        for side, degree in ((0, indeg), (1, outdeg)):
+            for j, i in enumerate(rare.tolist()):
+                if sides[i][side] and alive[j] and degree[j] > 0:
+                    alive[j] = False
+                    for c in children[j]:
+                        if alive[c]:
+                            indeg[c] -= 1
+                    for p in parents[j]:
+                        if alive[p]:
+                            outdeg[p] -= 1
+
+        ids = np.array(sorted(sides), dtype=np.int64)
+        removed = np.frombuffer(self.removed, dtype=np.uint8)
+        removed[ids] = 0
+        removed[rare[~np.array(alive, dtype=bool)]] = 1
+        return ids
+
+    def merge(self, km1mers=None):
+        """ Remove sides of rare k-mers and merge nodes again around the
+            given packed k-1-mers, or all nodes from scratch if they are
+            None. Return the number of nodes merged again. """
+
+        n = len(self.codes)
+        if km1mers is None:
+            self.removed = bytearray(n)
+            self.unitig = array('q', np.full(n, -1, dtype=np.int64).tobytes())
+            self.unitigs = {}
+            self.ends = {}
+            dirty = self.remove_rare(np.arange(n, dtype=np.int64))
+        else:
+            values, found = self.ids.lookup(km1mers)
+            dirty = self.neighbours(self.remove_rare(self.neighbours(values['id'][found])))
+        self.relink(dirty)
+        return len(dirty)
+
+    def relink(self, dirty):
+        """ Merge nodes again around the dirty ones (sorted ids), which
+            may have been removed or got other edges. Their unitigs are
+            split into runs of members which are not dirty, edges between
+            these runs and the dirty nodes are merged if they are the only
+            out-edge of their source and the only in-edge of their target,
+            which is decided only by the degrees of the dirty nodes and of
+            their neighbours. A unitig of a neighbour joined to a dirty
+            node is split too (into one run). """
+
+        neighbours, weights = self.clean(dirty)
+        live = weights > 0
+        outdeg, indeg = live[:, :4].sum(axis=1), live[:, 4:].sum(axis=1)
+        rows = np.arange(len(dirty))
+        child = np.where(outdeg == 1, neighbours[rows, live[:, :4].argmax(axis=1)], -1)
+        parent = np.where(indeg == 1, neighbours[rows, 4 + live[:, 4:].argmax(axis=1)], -1)
+        weight = weights[rows, live[:, :4].argmax(axis=1)], weights[rows, 4 + live[:, 4:].argmax(axis=1)]
+        others = np.setdiff1d(np.concatenate((child, parent)), dirty)
+        others = others[others >= 0]
+        degree = dict(zip(dirty.tolist(), zip(outdeg.tolist(), indeg.tolist())))
+        other = self.clean(others)[1] > 0
+        degree.update(zip(others.tolist(), zip(other[:, :4].sum(axis=1).tolist(), other[:, 4:].sum(axis=1).tolist())))
+
+        links = {}  # merged edges: source -> (target, weight)
+        for i, c, p, wc, wp in zip(dirty.tolist(), child.tolist(), parent.tolist(), weight[0].tolist(),
+                                   weight[1].tolist()):
+            if c >= 0 and c != i and degree[c][1] == 1:
+                links[i] = (c, wc)
+            if p >= 0 and p != i and degree[p][0] == 1:
+                links[p] = (i, wp)
+
+        # runs of the unitigs split by the dirty nodes, and the dirty nodes left in the graph
+        mark = np.zeros(len(self.codes), dtype=bool)
+        mark[dirty] = True
+        unitig = np.frombuffer(self.unitig, dtype=np.int64)
+        ends = np.array([i for link in links.items() for i in (link[0], link[1][0])], dtype=np.int64)
+        keys = set(unitig[dirty].tolist()) | set(unitig[ends[~mark[ends]]].tolist())
+        keys.discard(-1)
+        unitig[dirty] = -1
+        runs = {}  # first member -> members and weights of a run
+        dropped = []
+        for key in keys:
+            old = self.unitigs.pop(key)
+            dropped.extend(old.nodes)
+            members, weights, cut = old.members, old.weights, mark[old.members]
+            if old.cycle:
+                shift = int(cut.argmax()) + 1
+                members, weights, cut = np.roll(members, -shift), np.roll(weights, -shift)[:-1], np.roll(cut, -shift)
+            bounds = np.flatnonzero(np.diff(np.concatenate(([1], cut, [1])).astype(np.int8)))
+            for a, b in zip(bounds[::2].tolist(), bounds[1::2].tolist()):
+                runs[int(members[a])] = (members[a:b], weights[a:b - 1])
+        single = np.zeros(0, dtype=np.int64)
+        for i in dirty[outdeg + indeg > 0].tolist():
+            runs[i] = (np.array([i], dtype=np.int64), single)
+
+        # runs are joined along the merged edges into paths, the ones left into cycles
+        last = {int(members[-1]): first for first, (members, _) in runs.items()}
+        after = {last[i]: link for i, link in links.items()}  # first member of a run -> next run and weight
+        targets = {target for target, _ in after.values()}
+        left = set(targets)
+        unitigs = []
+        for first in runs:
+            if first in targets:
+                continue
+            members, weights = [runs[first][0]], [runs[first][1]]
+            while first in after:
+                first, weight = after[first]
+                left.discard(first)
+                members.append(runs[first][0])
+                weights.extend((np.array([weight], dtype=np.int64), runs[first][1]))
+            unitigs.append(Unitig(np.concatenate(members), np.concatenate(weights)))
+        while left:
+            start = first = left.pop()
+            members, weights = [], []
+            while True:
+                left.discard(first)
+                members.append(runs[first][0])
+                weights.append(runs[first][1])
+                first, weight = after[first]
+                weights.append(np.array([weight], dtype=np.int64))
+                if first == start:
+                    break
+            unitigs.append(Unitig(np.concatenate(members), np.concatenate(weights), cycle=True))
+
+        for node in dropped:
+            del self.ends[node]
+        for key, u in zip(self.keys, unitigs):
+            self.unitigs[key] = u
+            unitig[u.members] = key
+        del unitig
+        nodes = self.materialize(unitigs)
+        dropped = set(dropped)
+        touched = {n for node in dropped for n in chain(node.children, node.parents) if n not in dropped}
+        touched.update(self.attach(nodes))
+        self.attach(touched.difference(nodes))
+
+    def materialize(self, unitigs):
+        """ Create Node objects of the unitigs, without their edges (see
+            attach), and return them. """
+
+        codes = np.frombuffer(self.codes, dtype=np.uint64)
+        nodes = []
+        for u in unitigs:
+            members = codes[u.members]
+            if u.cycle:
+                u.nodes = [DeBruijnGraph.Node(km1mer) for km1mer in decode_all(members, self.k - 1)]
+                self.ends.update((node, (i, i)) for node, i in zip(u.nodes, u.members.tolist()))
+            else:
+                node = DeBruijnGraph.Node(decode(members[0], self.k - 1) + decode_last(members[1:]))
+                node.weights = u.weights.tolist()
+                node.total = sum(node.weights)
+                u.nodes = [node]
+                self.ends[node] = (int(u.members[0]), int(u.members[-1]))
+            nodes.extend(u.nodes)
+        return nodes
+
+    def node(self, i):
+        """ Return the Node object the first or the last member of which
+            is the node i. """
+
+        u = self.unitigs[self.unitig[i]]
+        if u.cycle:
+            return u.nodes[int(np.flatnonzero(u.members == i)[0])]
+        return u.nodes[0]
+
+    def attach(self, nodes):
+        """ Set children and parents of the Node objects from the edges
+            of their last and first members, in the order of the bases
+            added to them. Return the neighbours of the nodes. """
+
+        nodes = list(nodes)
+        if not nodes:
+            return set()
+        children, weights = self.clean(np.array([self.ends[n][1] for n in nodes], dtype=np.int64))
+        parents, pweights = self.clean(np.array([self.ends[n][0] for n in nodes], dtype=np.int64))
+        found = set()
+        for node, row, w, prow, pw in zip(nodes, children[:, :4].tolist(), weights[:, :4].tolist(),
+                                          parents[:, 4:].tolist(), pweights[:, 4:].tolist()):
+            node.children = {self.node(i): x for i, x in zip(row, w) if x}
+            node.parents = {self.node(i): x for i, x in zip(prow, pw) if x}
+            found.update(node.children)
+            found.update(node.parents)
+        return found
+
+    def search(self):
+        """ Search contigs of all merged nodes as DeBruijnGraph does, the
+            nodes are in the order of their first k-1-mers. """
+
+        nodes = list(self.ends)
+        firsts = np.array([self.ends[n][0] for n in nodes], dtype=np.int64)
+        order = np.argsort(np.frombuffer(self.codes, dtype=np.uint64)[firsts], kind='stable')
+        graph = DeBruijnGraph.__new__(DeBruijnGraph)
+        graph.setup(self.k, self.thresh, self.name, self.output, **self.options)
+        graph.nodes = {nodes[i].km1mer: nodes[i] for i in order.tolist()}
+        graph.search_contigs()
+        self.contigs = [(c.length * c.weight, c.seq) for c in graph.contigs]
+
+    def rebuild(self):
+        """ Remove sides of rare k-mers and merge all nodes from scratch,
+            runs are merged first, and search contigs again. """
+
+        self.counts.merged()
+        self.edges.merged()
+        self.merge()
+        self.search()
+
+    def sequences(self):
+        """ Return sequences of the contigs, from the best scored, ties
+            are broken by the sequences. """
+
+        return [seq for score, seq in sorted(self.contigs, key=lambda c: (-c[0], c[1]))]
+
+    @staticmethod
+    def path(directory, k):
+        """ Return the directory of the state for k. """
+
+        return os.path.join(directory, 'k%d' % k)
+
+    def save(self, directory):
+        """ Save the state into the directory: runs which are not saved
+            yet, and the count histogram, nodes, unitigs and contigs,
+            which are replaced at once. Files of runs merged since are
+            removed. """
+
+        path = self.path(directory, self.k)
+        os.makedirs(path, exist_ok=True)
+        files = {table: getattr(self, table).save(path, table) for table in ('counts', 'edges', 'ids')}
+        unitigs = list(self.unitigs.values())
+        state = os.path.join(path, 'state.npz')
+        with open(state + '.tmp', 'wb') as f:
+            np.savez(f, spectrum=self.spectrum, codes=np.array(self.codes, dtype=np.uint64),
+                     removed=np.frombuffer(self.removed, dtype=np.uint8),
+                     members=np.concatenate([np.zeros(0, dtype=np.int64)] + [u.members for u in unitigs]),
+                     weights=np.concatenate([np.zeros(0, dtype=np.int64)] + [u.weights for u in unitigs]),
+                     lengths=np.array([len(u.members) for u in unitigs], dtype=np.int64),
+                     cycles=np.array([u.cycle for u in unitigs], dtype=bool),
+                     scores=np.array([c[0] for c in self.contigs], dtype=np.float64),
+                     sequences=np.frombuffer('\n'.join(c[1] for c in self.contigs).encode(), dtype=np.uint8),
+                     totals=np.array([-1 if self.thresh is None else self.thresh, self.bases, self.reads],
+                                     dtype=np.int64),
+                     **{'%s_files' % table: np.array(names, dtype=str) for table, names in files.items()})
+        os.replace(state + '.tmp', state)
+        kept = {f for names in files.values() for f in names}
+        for name in os.listdir(path):
+            if name.endswith('.npy') and name.split('.')[0] not in kept:
+                os.remove(os.path.join(path, name))
+
+    @classmethod
+    def load(cls, directory, k, name='reads', output=None, recorder=None, workers=1, **options):
+        """ Return the assembly for k saved in the directory, or a new
+            one if there is none. Arguments are those of __init__. Runs
+            are mapped into memory, Node objects of the unitigs are made
+            again. """
+
+        assembly = cls(k, name, output, recorder, workers, **options)
+        path = cls.path(directory, k)
+        state = os.path.join(path, 'state.npz')
+        if not os.path.exists(state):
+            return assembly
+        with np.load(state) as arrays:
+            for table in ('counts', 'edges', 'ids'):
+                getattr(assembly, table).load(path, arrays['%s_files' % table].tolist())
+            assembly.spectrum = arrays['spectrum']
+            assembly.codes = array('Q', arrays['codes'].tobytes())
+            assembly.removed = bytearray(arrays['removed'].tobytes())
+            thresh, assembly.bases, assembly.reads = arrays['totals'].tolist()
+            assembly.thresh = None if thresh < 0 else thresh
+            sequences = arrays['sequences'].tobytes().decode().split('\n') if len(arrays['scores']) else []
+            assembly.contigs = list(zip(arrays['scores'].tolist(), sequences))
+            lengths, cycles = arrays['lengths'], arrays['cycles']
+            members = np.split(arrays['members'], np.cumsum(lengths)[:-1]) if len(lengths) else []
+            weights = np.split(arrays['weights'], np.cumsum(lengths - 1 + cycles)[:-1]) if len(lengths) else []
+
+        unitig = np.full(len(assembly.codes), -1, dtype=np.int64)
+        for key, m, w, cycle in zip(assembly.keys, members, weights, cycles.tolist()):
+            assembly.unitigs[key] = Unitig(m, w, cycle)
+            unitig[m] = key
+        assembly.unitig = array('q', unitig.tobytes())
+        assembly.attach(assembly.materialize(assembly.unitigs.values()))
+        return assembly
+
+
+def assemble_accumulated(reads, directory, k_range=K_RANGE, name='reads', output=None, recorder=None, jobs=1,
+                         verbose=False):
+    """ Add the reads to the incremental assemblies of every k from
+        k_range kept in the directory (new ones are started) and save
+        them back, reads are corrected by jobs processes. Return
+        Assembly of the k with the best mark for all reads added so
+        far, as pipeline.assemble does. """
+
+    os.makedirs(directory, exist_ok=True)
+    best = Assembly(0, [], 0, [])
+    for k in k_range:
+        start = time.time()
+        assembly = AccumulatedAssembly.load(directory, k, name, output, recorder, jobs)
+        contigs = assembly.add(reads)
+        assembly.save(directory)
+        m = mark(contigs, assembly.bases / 5)
+        best.stats.append({'k': k, 'contigs': len(contigs), 'mark': m, 'time': time.time() - start})
+        if verbose:
+            print('Found %d contigs for k = %d in %d reads, mark = %.3f (%.2f s)'
+                  % (len(contigs), k, assembly.reads, m, time.time() - start))
+        if m > best.mark or (m == best.mark and k > best.k):
+            best = Assembly(k, contigs, m, best.stats)
+    return best
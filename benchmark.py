@@ -0,0 +1,222 @@
+from fasta import load_reads
+from kmers import canonical_codes, packed_windows, sequence_codes
+import numpy as np
+import subprocess
+import tempfile
+import argparse
+import shutil
+import shlex
+import json
+import time
+import sys
+import os
+
+# stages of main.py (names from its trace) checked for regressions
+STAGES = ['counting', 'correction', 'build', 'merge', 'search']
+
+# length of k-mers matching contigs to the reference
+MATCH_K = 25
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+
+def random_genome(size, rng, repeat_fraction=0.0, repeat_length=500, families=2):
+    """ Return 2-bit codes of a random genome of the given size. About
+        repeat_fraction of it is covered by exact copies of repeats of
+        repeat_length bases, from the given number of repeat families,
+        put into random places which do not overlap. """
+
+    genome = rng.randint(0, 4, size).astype(np.uint8)
+    slots = size // repeat_length
+    copies = min(int(size * repeat_fraction / repeat_length), slots)
+    if copies:
+        repeats = rng.randint(0, 4, (families, repeat_length)).astype(np.uint8)
+        for i, slot in enumerate(rng.choice(slots, copies, replace=False)):
+            genome[slot * repeat_length:(slot + 1) * repeat_length] = repeats[i % families]
+    return genome
+
+
+def simulate_reads(genome, rng, read_length=80, coverage=10, error_rate=0.01, both_strands=False):
+    """ Return 2-bit codes of single-end reads (a matrix, one read in a row)
+        sampled uniformly from the genome codes to the given coverage.
+        Every base is substituted by another one with error_rate, reads
+        are reverse complemented with probability 1/2 if both_strands. """
+
+    n = int(len(genome) * coverage / read_length)
+    starts = rng.randint(0, len(genome) - read_length + 1, n)
+    reads = genome[starts[:, None] + np.arange(read_length)]
+    errors = rng.random_sample(reads.shape) < error_rate
+    reads[errors] = (reads[errors] + rng.randint(1, 4, int(errors.sum()))) % 4
+    if both_strands:
+        turned = rng.random_sample(n) < 0.5
+        reads[turned] = 3 - reads[turned, ::-1]
+    return reads
+
+
+def write_fasta(path, codes, prefix):
+    """ Write rows of 2-bit codes into a fasta file as records prefix_<i>. """
+
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)[codes]
+    with open(path, 'w') as f:
+        for i, row in enumerate(letters):
+            f.write('>%s_%d\n%s\n' % (prefix, i, row.tobytes().decode()))
+
+
+def n50(lengths):
+    """ Length L such that contigs at least L long hold half of all bases. """
+
+    lengths = sorted(lengths, reverse=True)
+    half = sum(lengths) / 2
+    total = 0
+    for length in lengths:
+        total += length
+        if total >= half:
+            return length
+    return 0
+
+
+def reference_coverage(contigs, reference, k=MATCH_K):
+    """ Fraction of reference bases covered by a k-mer (of either strand)
+        found in the contigs. """
+
+    found, _ = packed_windows(sequence_codes(contigs), k)
+    found = np.unique(canonical_codes(found, k))
+    windows, valid = packed_windows(sequence_codes(reference), k)
+    hit = valid & np.isin(canonical_codes(windows, k), found)
+    covered = np.zeros(len(windows) + k, dtype=np.int64)
+    np.add.at(covered, np.flatnonzero(hit), 1)
+    np.add.at(covered, np.flatnonzero(hit) + k, -1)
+    return float((np.cumsum(covered)[:len(windows) + k - 1] > 0).sum() / len(reference))
+
+
+def run_pipeline(reads_path, output, trace, options=()):
+    """ Run main.py on the reads with a trace and return its wall time. """
+
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    start = time.time()
+    subprocess.run([sys.executable, main, reads_path, output, '-t', trace] + list(options), check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.time() - start
+
+
+def read_trace(trace):
+    """ Return total time of every stage and the highest peak RSS of the trace. """
+
+    stages = {}
+    peak = 0
+    with open(trace) as f:
+        for line in f:
+            record = json.loads(line)
+            stages[record['stage']] = stages.get(record['stage'], 0) + record['time']
+            peak = max(peak, record['peak_rss'] or 0)
+    return stages, peak
+
+
+def bench(size, params, options=(), directory=None):
+    """ Generate a genome of the given size and reads of it (params are
+        those of random_genome and simulate_reads, and seed), assemble
+        them with main.py and return the measurements. """
+
+    rng = np.random.RandomState(params['seed'] + size)
+    genome = random_genome(size, rng, params['repeat_fraction'], params['repeat_length'], params['families'])
+    reads = simulate_reads(genome, rng, params['read_length'], params['coverage'], params['error_rate'],
+                           params['both_strands'])
+    workdir = tempfile.mkdtemp(prefix='bench', dir=directory)
+    try:
+        paths = {name: os.path.join(workdir, name) for name in ('reads.fasta', 'contigs.fasta', 'trace.jsonl')}
+        write_fasta(paths['reads.fasta'], reads, 'read')
+        wall = run_pipeline(paths['reads.fasta'], paths['contigs.fasta'], paths['trace.jsonl'], options)
+        stages, peak = read_trace(paths['trace.jsonl'])
+        contigs = list(load_reads(paths['contigs.fasta']))
+    finally:
+        shutil.rmtree(workdir, True)
+
+    reference = np.frombuffer(b'ACGT', dtype=np.uint8)[genome].tobytes().decode()
+    return {'size': size, 'bases': int(reads.size), 'time': round(wall, 3),
+            'throughput': round(reads.size / wall), 'peak_rss': round(peak, 1),
+            'stages': {stage: round(t, 4) for stage, t in stages.items()},
+            'contigs': len(contigs), 'n50': n50([len(c) for c in contigs]),
+            'coverage': round(reference_coverage(contigs, reference), 4)}
+
+
+def compare(results, baseline, tolerance=0.25, min_time=0.05):
+    """ Return messages about regressions of results against the baseline
+        results of the same sizes: stages (and the peak memory) slower
+        (larger) by more than tolerance and min_time seconds, N50 shorter
+        by more than tolerance, reference coverage lower by over 0.01. """
+
+    old = {r['size']: r for r in baseline}
+    messages = []
+    for r in results:
+        b = old.get(r['size'])
+        if b is None:
+            continue
+        for stage in STAGES:
+            t, bt = r['stages'].get(stage, 0), b['stages'].get(stage, 0)
+            if t > bt * (1 + tolerance) and t - bt > min_time:
+                messages.append('size %d: %s took %.3f s, baseline %.3f s' % (r['size'], stage, t, bt))
+        if r['peak_rss'] > b['peak_rss'] * (1 + tolerance):
+            messages.append('size %d: peak RSS %.1f MB, baseline %.1f MB' % (r['size'], r['peak_rss'], b['peak_rss']))
+        if r['n50'] < b['n50'] * (1 - tolerance):
+            messages.append('size %d: N50 %d, baseline %d' % (r['size'], r['n50'], b['n50']))
+        if r['coverage'] < b['coverage'] - 0.01:
+            messages.append('size %d: coverage %.4f, baseline %.4f' % (r['size'], r['coverage'], b['coverage']))
+    return messages
+
+
+def report(results):
+    """ Print a table of the results. """
+
+    print('%8s %9s %8s %10s %8s %8s %6s %8s  %s' % ('genome', 'bases', 'time', 'bases/s', 'RSS MB', 'contigs', 'N50',
+                                                  'coverage', 'stages (s)'))
+    for r in results:
+        stages = ' '.join('%s=%.3f' % (stage, r['stages'].get(stage, 0)) for stage in STAGES)
+        print('%8d %9d %8.2f %10d %8.1f %8d %6d %8.4f  %s' % (r['size'], r['bases'], r['time'], r['throughput'],
+                                                             r['peak_rss'], r['contigs'], r['n50'], r['coverage'],
+                                                             stages))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the assembly on simulated genomes and reads.')
+    parser.add_argument('-g', '--sizes', default='8000,16000,32000',
+                        help='comma separated genome sizes (default 8000,16000,32000)')
+    parser.add_argument('-c', '--coverage', type=float, default=10, help='coverage of the reads (default 10)')
+    parser.add_argument('-l', '--read-length', type=int, default=80, help='length of the reads (default 80)')
+    parser.add_argument('-e', '--error-rate', type=float, default=0.01, help='substitution rate (default 0.01)')
+    parser.add_argument('-r', '--repeat-fraction', type=float, default=0.05,
+                        help='fraction of the genome covered by repeats (default 0.05)')
+    parser.add_argument('-R', '--repeat-length', type=int, default=500, help='length of repeats (default 500)')
+    parser.add_argument('-f', '--families', type=int, default=2, help='number of repeat families (default 2)')
+    parser.add_argument('-B', '--both-strands', action='store_true', help='sample reads from both strands')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the simulation (default 0)')
+    parser.add_argument('-o', '--options', default='', help='options passed to main.py, e.g. "-b csr -w 2"')
+    parser.add_argument('-b', '--baseline', default=BASELINE, help='baseline file (default benchmarks/baseline.json)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown of a stage (default 0.25)')
+    parser.add_argument('-S', '--save', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    params = {'coverage': args.coverage, 'read_length': args.read_length, 'error_rate': args.error_rate,
+              'repeat_fraction': args.repeat_fraction, 'repeat_length': args.repeat_length,
+              'families': args.families, 'both_strands': args.both_strands, 'seed': args.seed,
+              'options': args.options}
+    results = [bench(int(size), params, shlex.split(args.options)) for size in args.sizes.split(',')]
+    report(results)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=1, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print('Baseline was made with other parameters, not compared')
+        else:
+            messages = compare(results, baseline['results'], args.tolerance)
+            for message in messages:
+                print('Regression: %s' % message)
+            if messages:
+                sys.exit(1)
+            print('No regressions against %s' % args.baseline)
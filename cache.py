@@ -0,0 +1,157 @@
+from fasta import ReadStore
+from kmers import KmerHist, SketchHist
+import numpy as np
+import tempfile
+import hashlib
+import shutil
+import json
+import mmap
+import os
+
+# changed whenever entries written by an older version can't be read
+VERSION = 1
+
+
+def reads_digest(reads):
+    """ Return the hex digest of the content of the reads (list or ReadStore). """
+
+    digest = hashlib.sha1()
+    if isinstance(reads, ReadStore):
+        digest.update(reads.data)
+    else:
+        for read in reads:
+            digest.update(read.encode())
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def map_bytes(path):
+    """ Map the file into memory (empty files can't be mapped). """
+
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b''
+
+
+def dir_size(path):
+    """ Total size of the files in the directory. """
+
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class ReadCache:
+    """ Cache of build_up results in a directory: the k-mer histogram,
+        its threshold and the corrected reads for every k. Entries are
+        keyed by the content of the input reads, k and parameters of
+        counting and correction, so a changed input or option never
+        gives a stale entry. An entry is written into a temporary
+        directory and renamed, so processes writing the same cache see
+        only whole entries. Reading an entry marks it as used, and the
+        least recently used entries are evicted when the cache is opened
+        or grows over max_bytes. Arrays and reads are memory-mapped from the
+        entry, rare k-mers (wrong_kmers) come from the histogram. """
+
+    def __init__(self, directory, max_bytes, reads, params=None):
+        """ Reads are the input reads, params a dict of options which
+            change the histogram or the corrected reads. """
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.reads = reads
+        self.params = dict(params or {}, version=VERSION)
+        self.digest = reads_digest(reads)
+        # the limit may have been lowered since the entries were stored
+        self.evict()
+
+    def path(self, k):
+        """ Return the directory of the entry for k. """
+
+        key = json.dumps({'input': self.digest, 'k': k, 'params': self.params}, sort_keys=True)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def __contains__(self, k):
+        return os.path.exists(os.path.join(self.path(k), 'meta.json'))
+
+    def meta(self, k):
+        """ Return parameters of the entry for k and mark it as used,
+            or None if there is none. """
+
+        path = os.path.join(self.path(k), 'meta.json')
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def hist(self, k):
+        """ Return the cached KmerHist for k, or None. """
+
+        meta = self.meta(k)
+        if meta is None:
+            return None
+        path = self.path(k)
+        kmers = np.load(os.path.join(path, 'kmers.npy'), mmap_mode='r')
+        counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+        if meta['singletons'] is not None:
+            return SketchHist(k, kmers, counts, self.reads, meta['singletons'], canonical=meta['canonical'])
+        return KmerHist(k, kmers, counts, meta['canonical'])
+
+    def load(self, k):
+        """ Return corrected reads, KmerHist and threshold cached for k
+            (see build_up), or None. """
+
+        meta = self.meta(k)
+        if meta is None:
+            return None
+        path = self.path(k)
+        reads = ReadStore(map_bytes(os.path.join(path, 'reads')), np.load(os.path.join(path, 'offsets.npy')))
+        return reads, self.hist(k), meta['thresh']
+
+    def store(self, k, reads, khist, thresh):
+        """ Store the results of build_up for k and evict old entries. """
+
+        if not isinstance(reads, ReadStore):
+            reads = ReadStore.from_reads(reads)
+        path = tempfile.mkdtemp(prefix='.entry', dir=self.directory)
+        try:
+            np.save(os.path.join(path, 'kmers.npy'), khist.kmers)
+            np.save(os.path.join(path, 'counts.npy'), khist.counts)
+            np.save(os.path.join(path, 'offsets.npy'), reads.offsets)
+            with open(os.path.join(path, 'reads'), 'wb') as f:
+                f.write(reads.data)
+            meta = {'k': k, 'thresh': int(thresh), 'canonical': khist.canonical,
+                    'singletons': int(khist.singletons) if isinstance(khist, SketchHist) else None}
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(path, self.path(k))
+            except OSError:  # stored by another process meanwhile
+                shutil.rmtree(path, True)
+        except BaseException:
+            shutil.rmtree(path, True)
+            raise
+        self.evict(keep=self.path(k))
+
+    def evict(self, keep=None):
+        """ Remove the least recently used entries until the cache takes
+            at most max_bytes, the entry keep is never removed. """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(os.path.join(path, 'meta.json')), dir_size(path), path))
+            except OSError:  # being written or removed
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                shutil.rmtree(path, True)
+                total -= size
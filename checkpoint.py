@@ -0,0 +1,255 @@
+from kmers import ALPHABET, sequence_codes
+from collections.abc import Mapping
+import numpy as np
+import struct
+import json
+import mmap
+
+# first bytes of a checkpoint file, the last one is the format version
+MAGIC = b'DBGRAPH\x01'
+
+# arrays of a checkpoint and their types
+DTYPES = {
+    'bases': np.uint8,  # bases of all node names, 4 in a byte
+    'other': np.int64,  # positions of characters outside ACGT (and of separators)
+    'other_bytes': np.uint8,  # these characters
+    'child_ptr': np.int64,  # children of node i are children[child_ptr[i]:child_ptr[i+1]]
+    'children': np.int64,
+    'multiplicity': np.int64,  # weights of edges to the children
+    'parent_ptr': np.int64,
+    'parents': np.int64,
+    'weight_ptr': np.int64,  # weights of merged edges of node i
+    'weights': np.int64,
+}
+
+_LETTERS = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+_QUADS = [''.join(ALPHABET[b >> shift & 3] for shift in (6, 4, 2, 0)) for b in range(256)]  # bases of a byte
+
+
+def pack_names(names):
+    """ Return node names joined by newlines, packed 4 bases in a byte,
+        and positions and bytes of the characters which are not bases. """
+
+    codes = sequence_codes(names)
+    other = np.flatnonzero(codes == 4)
+    other_bytes = np.frombuffer('\n'.join(names).encode(), dtype=np.uint8)[other]
+    codes = np.concatenate((codes & 3, np.zeros(-len(codes) % 4, dtype=np.uint8))).reshape(-1, 4)
+    bases = (codes << _SHIFTS).sum(axis=1, dtype=np.uint8)
+    return {'bases': bases, 'other': other, 'other_bytes': other_bytes}
+
+
+def unpack_names(bases, other, other_bytes, length, n):
+    """ Return the n node names from the arrays of pack_names,
+        length is the length of the joined names. """
+
+    if n == 0:
+        return []
+    letters = _LETTERS[(bases[:, None] >> _SHIFTS) & 3].ravel()[:length]
+    letters[other] = other_bytes
+    return letters.tobytes().decode().split('\n')
+
+
+def save_graph(graph, path):
+    """ Write nodes and edges of the graph into a checkpoint file. It
+        starts with MAGIC and the length of a JSON header, which holds
+        parameters of the graph and the type, offset and size of every
+        array, the arrays follow, aligned to 8 bytes. Nodes are kept in
+        the order of the graph, as are children and parents of every
+        node, so the graph read back gives the same contigs. """
+
+    nodes = list(graph.nodes.values())
+    index = {node: i for i, node in enumerate(nodes)}
+    names = [node.km1mer for node in nodes]
+    arrays = pack_names(names)
+    for name, adjacency in (('child', 'children'), ('parent', 'parents')):
+        sizes = [len(getattr(node, adjacency)) for node in nodes]
+        arrays['%s_ptr' % name] = np.concatenate(([0], np.cumsum(sizes, dtype=np.int64)))
+        arrays[adjacency] = np.fromiter((index[n] for node in nodes for n in getattr(node, adjacency)),
+                                        dtype=np.int64, count=int(sum(sizes)))
+    arrays['multiplicity'] = np.fromiter((w for node in nodes for w in node.children.values()),
+                                         dtype=np.int64, count=len(arrays['children']))
+    arrays['weight_ptr'] = np.concatenate(([0], np.cumsum([len(node.weights) for node in nodes], dtype=np.int64)))
+    arrays['weights'] = np.fromiter((w for node in nodes for w in node.weights),
+                                    dtype=np.int64, count=int(arrays['weight_ptr'][-1]))
+
+    header = {'k': graph.k, 'thresh': graph.thresh, 'rare_thresh': int(graph.rare_thresh),
+              'nodes': len(nodes), 'length': sum(len(name) for name in names) + max(len(names) - 1, 0),
+              'arrays': {}}
+    offset = 0
+    for name in sorted(arrays):
+        a = arrays[name] = np.ascontiguousarray(arrays[name], dtype=DTYPES[name])
+        header['arrays'][name] = [offset, len(a)]
+        offset += -(-a.nbytes // 8) * 8
+    meta = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(meta)) // 8) * 8
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(meta)))
+        f.write(meta)
+        f.write(b'\0' * (start - f.tell()))
+        for name in sorted(arrays):
+            a = arrays[name]
+            f.write(a.tobytes())
+            f.write(b'\0' * (-a.nbytes % 8))
+
+
+class CheckpointNode:
+    """ Node of a checkpoint, it keeps only its index. Its name, edges
+        and weights are read from the arrays of the checkpoint whenever
+        they are used, so they take no memory between uses. Nodes are
+        read-only: they are searched for contigs, not changed. """
+
+    __slots__ = ('checkpoint', 'index')
+
+    def __init__(self, checkpoint, index):
+        self.checkpoint = checkpoint
+        self.index = index
+
+    def __str__(self):
+        return self.km1mer
+
+    @property
+    def km1mer(self):
+        return self.checkpoint.name(self.index)
+
+    @property
+    def children(self):
+        return Adjacency(self.checkpoint, self.index, True)
+
+    @property
+    def parents(self):
+        return Adjacency(self.checkpoint, self.index, False)
+
+    @property
+    def weights(self):
+        ptr = self.checkpoint.views['weight_ptr']
+        return self.checkpoint.views['weights'][ptr[self.index]:ptr[self.index + 1]].tolist()
+
+    @property
+    def total(self):
+        return self.checkpoint.views['totals'][self.index]
+
+
+class Adjacency(Mapping):
+    """ Children (or parents) of a checkpoint node mapped to the weights
+        of their edges, read from the arrays of the checkpoint. """
+
+    __slots__ = ('checkpoint', 'index', 'children', 'start', 'ids')
+
+    def __init__(self, checkpoint, index, children):
+        views = checkpoint.views
+        ptr = views['child_ptr' if children else 'parent_ptr']
+        self.checkpoint = checkpoint
+        self.index = index
+        self.children = children
+        self.start = ptr[index]
+        self.ids = views['children' if children else 'parents'][self.start:ptr[index + 1]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return map(self.checkpoint.node, self.ids.tolist())
+
+    def __getitem__(self, node):
+        if not isinstance(node, CheckpointNode) or node.checkpoint is not self.checkpoint:
+            raise KeyError(node)
+        if not self.children:
+            return node.children[self.checkpoint.node(self.index)]
+        ids = self.ids.tolist()
+        if node.index not in ids:
+            raise KeyError(node)
+        return self.checkpoint.views['multiplicity'][self.start + ids.index(node.index)]
+
+    def items(self):
+        return list(zip(self, self.values()))
+
+    def values(self):
+        if not self.children:
+            return [self[node] for node in self]
+        return self.checkpoint.views['multiplicity'][self.start:self.start + len(self.ids)].tolist()
+
+
+class Checkpoint(Mapping):
+    """ Checkpoint file written by save_graph, mapped into memory. Its
+        arrays are views of the mapping, so the file is read only when
+        they are used. The checkpoint maps node names to nodes, like
+        nodes of a graph, in their order. Nodes are CheckpointNode
+        objects, which read their names and edges from the arrays when
+        they are used, so a loaded graph keeps only one small object per
+        node and the arrays, which the system can page out. """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a graph checkpoint' % path)
+        size, = struct.unpack('<Q', self.map[len(MAGIC):len(MAGIC) + 8])
+        self.header = json.loads(self.map[len(MAGIC) + 8:len(MAGIC) + 8 + size].decode())
+        start = -(-(len(MAGIC) + 8 + size) // 8) * 8
+        self.arrays = {name: np.frombuffer(self.map, dtype=DTYPES[name], count=n, offset=start + offset)
+                       for name, (offset, n) in self.header['arrays'].items()}
+        self.k = self.header['k']
+        self.thresh = self.header['thresh']
+        self.rare_thresh = self.header['rare_thresh']
+
+        a = self.arrays
+        n = self.header['nodes']
+        # names start after separators, which are among the other characters
+        separator = a['other_bytes'] == ord('\n')
+        self.starts = np.concatenate(([0], a['other'][separator] + 1, [self.header['length'] + 1]))
+        # nodes whose names hold characters other than bases
+        self.special = set((np.searchsorted(self.starts, a['other'][~separator], 'right') - 1).tolist())
+        sums = np.concatenate(([0], np.cumsum(a['weights'])))
+        self.totals = sums[a['weight_ptr'][1:]] - sums[a['weight_ptr'][:-1]]  # sums of weights of nodes
+        # memoryviews are read from Python faster than the arrays
+        self.views = {name: memoryview(array) for name, array in self.arrays.items()}
+        self.views['totals'] = memoryview(self.totals)
+        self.views['starts'] = memoryview(self.starts)
+        self.objects = [None] * n
+        self.index = None  # names -> indices, made on the first lookup by name
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return (node.km1mer for node in self.values())
+
+    def __getitem__(self, name):
+        if self.index is None:
+            self.index = {name: i for i, name in enumerate(self.names())}
+        return self.node(self.index[name])
+
+    def values(self):
+        return map(self.node, range(len(self.objects)))
+
+    def node(self, i):
+        """ Return the node of the given index. """
+
+        node = self.objects[i]
+        if node is None:
+            node = self.objects[i] = CheckpointNode(self, i)
+        return node
+
+    def name(self, i):
+        """ Return the name of the node of the given index. """
+
+        start, end = self.views['starts'][i], self.views['starts'][i + 1] - 1
+        shift = start % 4
+        name = ''.join(map(_QUADS.__getitem__, self.views['bases'][start // 4:-(-end // 4)]))
+        name = name[shift:shift + end - start]
+        if i in self.special:
+            a = self.arrays
+            letters = bytearray(name.encode())
+            low, high = np.searchsorted(a['other'], (start, end))
+            for position, byte in zip(a['other'][low:high].tolist(), a['other_bytes'][low:high].tolist()):
+                letters[position - start] = byte
+            name = letters.decode()
+        return name
+
+    def names(self):
+        """ Return names of all nodes, in their order. """
+
+        a = self.arrays
+        return unpack_names(a['bases'], a['other'], a['other_bytes'], self.header['length'], self.header['nodes'])
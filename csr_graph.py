@@ -0,0 +1,318 @@
+from graph import DeBruijnGraph
+from fasta import ReadStore
+from external_kmers import count_kmers_external
+from kmers import KmerHist, SketchHist, decode_all, decode_last, encode, packed_windows, sequence_codes
+from itertools import chain, count
+from array import array
+import numpy as np
+
+
+def int_array(values):
+    """ Copy NumPy array into array module array, its items are read
+        from Python much faster and it is as compact. """
+
+    return array('q', np.asarray(values, dtype=np.int64).tobytes())
+
+
+class CSRGraph(DeBruijnGraph):
+    """ De Bruijn multigraph kept in NumPy arrays instead of Node objects.
+        Nodes are integer ids of the sorted, packed k-1-mers (km1mers),
+        edges are the distinct k-mers, with their multiplicities in
+        weight. Adjacency is stored in CSR form: out-edges of node u are
+        out_ptr[u]:out_ptr[u+1] (edges are sorted by their source) and
+        in-edges of node v are in_edges[in_ptr[v]:in_ptr[v+1]].
+        Node objects are created only for the merged graph, which is
+        searched for contigs by the methods of DeBruijnGraph. """
+
+    def __init__(self, strIter, k, wrong_kmers, thresh, name, output=None, memory=None, **kwargs):
+        """ Arguments are those of DeBruijnGraph, if memory is given the
+            k-mers of the strings are counted out of core in about that
+            many bytes of RAM (see count_kmers_external). """
+
+        self.memory = memory
+        super().__init__(strIter, k, wrong_kmers, thresh, name, output, **kwargs)
+
+    def count_edges(self, reads):
+        """ Return sorted, distinct packed k-mers of the reads, positions
+            of their first occurrences (any increasing positions will do)
+            and their counts. """
+
+        if self.memory is None:
+            windows, valid = packed_windows(sequence_codes(reads), self.k)
+            return np.unique(windows[valid], return_index=True, return_counts=True)
+        hist = count_kmers_external(reads, self.k, self.memory, first=True)
+        return np.array(hist.kmers), np.array(hist.first), hist.counts.astype(np.int64)
+
+    def build(self, strIter):
+        """ Build the arrays from all k-mers of the given strings. Nodes
+            and edges remember their first occurrence, so they are visited
+            in the same order as nodes and dict keys of DeBruijnGraph. """
+
+        if not isinstance(strIter, (list, ReadStore)):
+            strIter = list(strIter)
+        kmers, first, weight = self.count_edges(strIter)
+        self.mask = np.uint64((1 << 2 * (self.k - 1)) - 1)
+        left, right = kmers >> np.uint64(2), kmers & self.mask
+        self.km1mers = np.unique(np.concatenate((left, right)))
+        n = len(self.km1mers)
+
+        self.src = np.searchsorted(self.km1mers, left).astype(np.int32)
+        self.dst = np.searchsorted(self.km1mers, right).astype(np.int32)
+        self.weight = weight
+        self.out_ptr = np.concatenate(([0], np.cumsum(np.bincount(self.src, minlength=n))))
+        self.in_ptr = np.concatenate(([0], np.cumsum(np.bincount(self.dst, minlength=n))))
+        self.in_edges = np.argsort(self.dst, kind='stable').astype(np.int32)
+        self.outdeg = np.bincount(self.src, minlength=n).astype(np.int32)
+        self.indeg = np.bincount(self.dst, minlength=n).astype(np.int32)
+        self.alive = np.ones(n, dtype=bool)
+        self.edge_alive = np.ones(len(kmers), dtype=bool)
+
+        # left k-1-mer of the i-th k-mer comes before its right k-1-mer
+        self.edge_order = first
+        time = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(time, self.src, 2 * first)
+        np.minimum.at(time, self.dst, 2 * first + 1)
+        self.node_order = np.argsort(time, kind='stable')
+
+    def size(self):
+        if self.nodes:
+            return super().size()
+        return int(self.alive.sum()), int(self.edge_alive.sum())
+
+    def find(self, km1mers):
+        """ Return ids of the given packed k-1-mers which are nodes. """
+
+        idx = np.searchsorted(self.km1mers, km1mers)
+        idx[idx == len(self.km1mers)] = 0
+        found = self.km1mers[idx] == km1mers if len(self.km1mers) else np.zeros(len(idx), dtype=bool)
+        return idx[found]
+
+    def remove_node(self, u):
+        """ Delete the node u together with all its edges. """
+
+        for e in range(self.out_ptr[u], self.out_ptr[u + 1]):
+            if self.edge_alive[e]:
+                self.edge_alive[e] = False
+                self.outdeg[u] -= 1
+                self.indeg[self.dst[e]] -= 1
+        for e in self.in_edges[self.in_ptr[u]:self.in_ptr[u + 1]]:
+            if self.edge_alive[e]:
+                self.edge_alive[e] = False
+                self.indeg[u] -= 1
+                self.outdeg[self.src[e]] -= 1
+        self.alive[u] = False
+
+    def remove_rare_kmers(self, wrong_kmers):
+        """ Remove kmers from input list wrong_kmers (or rare
+            kmers of the given KmerHist), but only if given kmer
+            is not head (no input edges) or tail (no output edges). """
+
+        if isinstance(wrong_kmers, SketchHist):
+            left, right = wrong_kmers.rare_side_codes(self.rare_thresh, self.km1mers)
+        elif isinstance(wrong_kmers, KmerHist):
+            left, right = wrong_kmers.rare_side_codes(self.rare_thresh)
+        else:
+            left = {encode(kmer[:-1]) for kmer in wrong_kmers}
+            right = {encode(kmer[1:]) for kmer in wrong_kmers}
+            left, right = [np.array(sorted(s - {None}), dtype=np.uint64) for s in (left, right)]
+
+        removed = 0
+        for km1mers, degree in [[left, self.indeg], [right, self.outdeg]]:
+            for u in self.find(km1mers).tolist():
+                if self.alive[u] and degree[u] > 0:
+                    self.remove_node(u)
+                    removed += 1
+        return removed
+
+    def cut_graph(self):
+        """ Delete edges which weight is lower than threshold. """
+
+        cut = self.edge_alive & (self.weight <= self.thresh)
+        self.edge_alive &= ~cut
+        self.outdeg -= np.bincount(self.src[cut], minlength=len(self.alive)).astype(np.int32)
+        self.indeg -= np.bincount(self.dst[cut], minlength=len(self.alive)).astype(np.int32)
+        return int(cut.sum())
+
+    def remove_isolated(self):
+        """ Delete nodes without any edges, return their number. """
+
+        isolated = self.alive & (self.indeg == 0) & (self.outdeg == 0)
+        self.alive &= ~isolated
+        return int(isolated.sum())
+
+    def heads(self):
+        """ Return ids of nodes without parents, but with children. """
+
+        order = self.node_order[self.alive[self.node_order]]
+        return order[(self.indeg[order] == 0) & (self.outdeg[order] > 0)].tolist()
+
+    def compact(self, heads):
+        """ Merge linear nodes reachable from the given heads with the
+            same rules (and in the same order) as DeBruijnGraph.merge_step.
+            Adjacency of a node there is a dict, here it is the pair
+            (member, children): out-edges (or in-edges) of the original
+            node member, which the merged node took over. Keys of the
+            dicts are child_key and parent_key of the edges, their order
+            is given by out_key and in_key. Then Node objects are created
+            for the merged graph, their names are spelled from one buffer
+            of last bases of the merged k-1-mers. """
+
+        self.prepare_merge()
+        for h in heads:
+            self.merge(h, True)
+        self.materialize(list(self.order), {g: self.pieces(g) for g in self.ends})
+
+    def prepare_merge(self):
+        """ Set up the arrays and dicts changed by merge_step. """
+
+        n = len(self.km1mers)
+        self.out_ptr_ = int_array(self.out_ptr)
+        self.in_ptr_ = int_array(self.in_ptr)
+        self.in_edges_ = int_array(self.in_edges)
+        self.edge_alive_ = int_array(self.edge_alive)
+        self.child_key = int_array(self.dst)
+        self.parent_key = int_array(self.src)
+        self.out_key = int_array(self.edge_order)
+        self.in_key = int_array(self.edge_order)
+        self.keys = count(int(self.edge_order.max()) + 1 if len(self.edge_order) else 0)
+        self.out_port = int_array(np.arange(n))
+        self.in_port = int_array(np.arange(n))
+        self.outdeg_ = int_array(self.outdeg)
+        self.indeg_ = int_array(self.indeg)
+        self.weights = {}
+
+        self.done = set()
+        self.order = dict.fromkeys(self.node_order[self.alive[self.node_order]].tolist())
+        self.ends = {}  # first and last piece of merged nodes
+
+    def pieces(self, g):
+        """ Return the original nodes merged into the node g, in order. """
+
+        members = []
+        piece = self.ends[g][0]
+        while piece is not None:
+            members.append(piece[0])
+            piece = piece[1]
+        return members
+
+    def materialize(self, groups, pieces):
+        """ Create Node objects for the given merged nodes, in this order,
+            pieces maps merged nodes to their original nodes. """
+
+        # spelling names of merged nodes
+        members = []
+        starts = [0]
+        for g in groups:
+            if g in pieces:
+                members.extend(pieces[g])
+            else:
+                members.append(g)
+            starts.append(len(members))
+        members = self.km1mers[np.array(members, dtype=np.int64)]
+        bases = decode_last(members)
+        firsts = decode_all(members[starts[:-1]], self.k - 1)
+
+        weight = self.weight.tolist()
+        objects = {}
+        for i, g in enumerate(groups):
+            node = objects[g] = self.Node(firsts[i] + bases[starts[i] + 1:starts[i + 1]])
+            node.weights = self.weights.get(g, [])
+        nodes = {}
+        for g, node in objects.items():
+            for e in self.adjacency((self.out_port[g], True)):
+                node.children[objects[self.child_key[e]]] = weight[e]
+            for e in self.adjacency((self.in_port[g], False)):
+                node.parents[objects[self.parent_key[e]]] = weight[e]
+            nodes[node.km1mer] = node
+        self.nodes = nodes
+        self.done = {objects[g] for g in self.done if g in objects}
+        del self.order, self.ends, self.weights, self.keys, self.out_port, self.in_port
+        del self.child_key, self.parent_key, self.out_key, self.in_key
+        del self.out_ptr_, self.in_ptr_, self.in_edges_, self.edge_alive_, self.outdeg_, self.indeg_
+
+    def adjacency(self, adj):
+        """ Return live edges of adjacency (member, children) in the
+            order of keys of the corresponding dict. """
+
+        member, children = adj
+        if children:
+            edges = range(self.out_ptr_[member], self.out_ptr_[member + 1])
+            order = self.out_key
+        else:
+            edges = self.in_edges_[self.in_ptr_[member]:self.in_ptr_[member + 1]]
+            order = self.in_key
+        edges = [e for e in edges if self.edge_alive_[e]]
+        edges.sort(key=order.__getitem__)
+        return edges
+
+    def neighbours(self, adj):
+        """ Yield nodes of the given adjacency, they are listed only
+            when the first one is taken. """
+
+        keys = self.child_key if adj[1] else self.parent_key
+        for e in self.adjacency(adj):
+            yield keys[e]
+
+    def degree(self, adj):
+        """ Number of nodes in the given adjacency. It does not change
+            while merging, edges are only moved between nodes. """
+
+        return self.outdeg_[adj[0]] if adj[1] else self.indeg_[adj[0]]
+
+    def join(self, left, right):
+        """ Join pieces of the right node after pieces of the left one,
+            a piece is an original node. Return first and last piece. """
+
+        lfirst, llast = self.ends.pop(left, None) or 2 * ([left, None],)
+        rfirst, rlast = self.ends.pop(right, None) or 2 * ([right, None],)
+        llast[1] = rfirst
+        return lfirst, rlast
+
+    def merge_step(self, node, direction):
+        """ Merge the given node with its neighbour, if they are
+            connected only with each other. Return iterator of merge
+            calls which have to be done next (or None). """
+
+        if node in self.done:
+            return None
+        self.done.add(node)
+        children = (self.out_port[node], True)
+        parents = (self.in_port[node], False)
+        downstream, upstream = (children, parents) if direction else (parents, children)
+        if self.degree(upstream) > 1:
+            return chain(self.calls(self.neighbours(upstream), not direction),
+                         self.calls(self.neighbours(downstream), direction))
+        elif self.degree(downstream) == 1:
+            edge = self.adjacency(downstream)[0]
+            if direction:
+                nnode = self.child_key[edge]
+                nparents = (self.in_port[nnode], False)
+                if self.degree(nparents) != 1:
+                    others = [i for i in self.neighbours(nparents) if i != node]
+                    return chain(self.calls(others, not direction), self.calls([nnode], direction))
+                self.ends[nnode] = self.join(node, nnode)
+                self.in_port[nnode] = parents[0]
+                for e in self.adjacency(parents):
+                    self.child_key[e] = nnode
+                    self.out_key[e] = next(self.keys)
+            else:
+                nnode = self.parent_key[edge]
+                nchildren = (self.out_port[nnode], True)
+                if self.degree(nchildren) != 1:
+                    others = [i for i in self.neighbours(nchildren) if i != node]
+                    return chain(self.calls(others, not direction), self.calls([nnode], direction))
+                self.ends[nnode] = self.join(nnode, node)
+                self.out_port[nnode] = children[0]
+                for e in self.adjacency(children):
+                    self.parent_key[e] = nnode
+                    self.in_key[e] = next(self.keys)
+
+            weights = self.weights.pop(node, None) or []
+            weights.append(int(self.weight[edge]))
+            self.weights[nnode] = weights
+            del (self.order[nnode])
+            del (self.order[node])
+            self.order[nnode] = None
+            return self.calls([nnode], direction)
+        else:
+            return self.calls(self.neighbours(downstream), direction)
@@ -1,5 +1,11 @@
-from statistics import stdev, mean
-import math
+from fasta import ReadStore
+from kmers import (ALPHABET, all_neighbor_codes, canonical_codes, count_kmers, decode, decode_all, packed_windows,
+                   read_offsets, reverse_complement_read, sequence_codes)
+from parallel import can_start, start_pool, worker_state
+import numpy as np
+
+# state shared with the worker processes
+shared = worker_state('error_correction')
 
 
 def neighbors1mm(kmer, alpha):
@@ -15,47 +21,295 @@ def neighbors1mm(kmer, alpha):
 
 
 def kmerHist(reads, k):
-    """ Return k-mer histogram and average # k-mer occurrences """
-    kmerhist = {}
-    for read in reads:
-        for kmer in [read[i:i+k] for i in range(0, len(read)-(k-1))]:
-            kmerhist[kmer] = kmerhist.get(kmer, 0) + 1
-    return kmerhist, max(math.floor(mean(kmerhist.values()) - stdev(kmerhist.values())), 0)
+    """ Return k-mer histogram and threshold of k-mer occurrences.
+        Histogram is a KmerHist with 2-bit packed k-mers, threshold is
+        computed from its count histogram. """
+    kmerhist = count_kmers(reads, k)
+    return kmerhist, kmerhist.threshold()
+
+
+class Corrector:
+    """ Error correction of reads with packed k-mers. K-mers of a whole
+        batch of reads are packed and counted at once, so only reads with
+        an infrequent k-mer are walked in Python. The frequent neighbour
+        found for an infrequent k-mer is remembered, as the same wrong
+        k-mer comes up in many reads. """
+
+    def __init__(self, kmerhist, k, thresh):
+        self.kmerhist = kmerhist
+        self.k = k
+        self.thresh = thresh
+        self.mask = (1 << 2 * k) - 1
+        self.fixes = {}  # infrequent k-mer -> its frequent neighbour or None
+        self.unknown = {}  # k-mer with an unknown base -> the base filled in or None
+        self.spelled = {}  # frequent neighbour -> its bases
+
+    def find_fixes(self, codes):
+        """ Find frequent neighbours of all given packed k-mers at once. """
+
+        codes = [code for code in codes if code not in self.fixes]
+        for i in range(0, len(codes), 10000):
+            chunk = codes[i:i + 10000]
+            neighbors = all_neighbor_codes(chunk, self.k)
+            frequent = (self.kmerhist.lookup(neighbors.ravel()) > self.thresh).reshape(neighbors.shape)
+            first = neighbors[np.arange(len(chunk)), frequent.argmax(axis=1)].tolist()
+            for code, neighbor, found in zip(chunk, first, frequent.any(axis=1).tolist()):
+                self.fixes[code] = neighbor if found else None
+
+    def fix(self, code):
+        """ Return the first frequent neighbour of the packed k-mer
+            (in the order of neighbors1mm), or None. """
+
+        if code not in self.fixes:
+            self.find_fixes([code])
+        return self.fixes[code]
+
+    def fill(self, code, shift):
+        """ Return the first base (in alphabetical order) which makes the
+            packed k-mer frequent on the position with the given shift,
+            where it has an unknown base (packed as 0), or None. Other
+            neighbours of a k-mer with an unknown base keep it, so they
+            are never frequent. """
+
+        key = (code, shift)
+        if key not in self.unknown:
+            frequent = self.kmerhist.lookup([code | b << 2 * shift for b in range(4)]) > self.thresh
+            self.unknown[key] = int(frequent.argmax()) if frequent.any() else None
+        return self.unknown[key]
+
+    def spell(self, code):
+        """ Return bases of the packed k-mer as bytes. """
+
+        try:
+            return self.spelled[code]
+        except KeyError:
+            bases = self.spelled[code] = decode(code, self.k).encode()
+            return bases
+
+    def correct(self, reads):
+        """ Return the list of error-corrected versions of given reads. """
+
+        k = self.k
+        codes = sequence_codes(reads)
+        windows, valid = packed_windows(codes, k)
+        counts = self.kmerhist.lookup(windows)
+        starts = np.cumsum([0] + [len(read) + 1 for read in reads])
+        # k-mers with one unknown base are never counted, but may become
+        # frequent when it is filled in; separators of reads count as k
+        missing = (codes == 4).astype(np.int64)
+        missing[starts[1:-1] - 1] = k
+        missing = np.concatenate(([0], np.cumsum(missing)))
+        single = (missing[k:] - missing[:-k] == 1)[:len(windows)]
+        weak = np.flatnonzero((valid & (counts <= self.thresh)) | single)
+        if len(weak) == 0:
+            return list(reads)
+        # reads are split on the first infrequent k-mer of each of them
+        owners = np.searchsorted(starts, weak, side='right') - 1
+        firsts = np.flatnonzero(np.concatenate(([True], owners[1:] != owners[:-1])))
+        bounds = np.concatenate((firsts, [len(weak)]))
+        self.find_fixes(np.unique(windows[weak[valid[weak]]]).tolist())
+
+        corrected = list(reads)
+        for j in range(len(firsts)):
+            r = int(owners[firsts[j]])
+            start, end = int(starts[r]), int(starts[r]) + len(reads[r])
+            corrected[r] = self.correct_read(reads[r], codes[start:end].tolist(), windows[start:end - k + 1],
+                                             counts[start:end - k + 1], valid[start:end - k + 1],
+                                             (weak[bounds[j]:bounds[j + 1]] - start).tolist())
+        return corrected
+
+    def correct_read(self, read, bases, windows, counts, valid, weak):
+        """ Return an error-corrected version of the read. Bases are the
+            2-bit codes of the read, windows and counts its packed k-mers
+            and their counts, valid the mask of k-mers without unknown
+            bases, weak positions of infrequent k-mers and of k-mers
+            with one unknown base. Up to the last corrected base, k-mers
+            are packed and counted again, after it the given ones are
+            still right, so the walk jumps to the next infrequent one.
+            An unknown base is filled in as by correct1mm before: it is
+            the only base whose substitutions may give a frequent k-mer. """
+
+        k = self.k
+        thresh = self.thresh
+        fixed = None
+        last = -1  # last corrected position
+        w = 0  # position in weak
+        code = None  # packed k-mer at position i - 1, if it is valid
+        i = weak[0]
+        n = len(bases) - k + 1
+        while i < n:
+            if i > last:
+                while w < len(weak) and weak[w] < i:
+                    w += 1
+                if w == len(weak):
+                    break
+                i = weak[w]
+                code = int(windows[i]) if valid[i] else None
+                count = int(counts[i])
+            else:
+                b = bases[i + k - 1]
+                if code is not None and b != 4:
+                    code = ((code << 2) | b) & self.mask
+                elif 4 in bases[i:i + k]:
+                    code = None
+                else:
+                    code = 0
+                    for b in bases[i:i + k]:
+                        code = (code << 2) | b
+                if code is not None:
+                    count = self.kmerhist.get(code, 0)
+            if code is None:
+                window = bases[i:i + k]
+                if window.count(4) == 1:
+                    pos = i + window.index(4)
+                    shift = i + k - 1 - pos
+                    code = 0
+                    for b in window:
+                        code = (code << 2) | (b & 3)
+                    b = self.fill(code, shift)
+                    if b is not None:
+                        bases[pos] = b
+                        last = max(last, pos)
+                        if fixed is None:
+                            fixed = bytearray(read.encode())
+                        fixed[pos] = ord(ALPHABET[b])
+                        code |= b << 2 * shift
+                    else:
+                        code = None
+                i += 1
+                continue
+            if count <= thresh:
+                neighbor = self.fix(code)
+                if neighbor is not None:
+                    # the neighbour differs from the k-mer on one base
+                    shift = ((code ^ neighbor).bit_length() - 1) // 2
+                    pos = i + k - 1 - shift
+                    bases[pos] = (neighbor >> 2 * shift) & 3
+                    last = max(last, pos)
+                    if fixed is None:
+                        fixed = bytearray(read.encode())
+                    fixed[i:i + k] = self.spell(neighbor)
+                    code = neighbor
+            i += 1
+        return read if fixed is None else fixed.decode()
 
 
 def correct1mm(read, k, kmerhist, alpha, thresh):
     """ Return an error-corrected version of read.  k = k-mer length.
-        kmerhist is kmer count map.  alpha is alphabet.  thresh is
+        kmerhist is KmerHist of packed kmers.  alpha is alphabet (packed
+        kmers are always over ACGT).  thresh is
         count threshold above which k-mer is considered correct. """
-    # Iterate over k-mers in read
-    for i in range(0, len(read)-(k-1)):
-        kmer = read[i:i+k]
-        # If k-mer is infrequent...
-        if kmerhist.get(kmer, 0) <= thresh:
-            # Look for a frequent neighbor
-            for newkmer in neighbors1mm(kmer, alpha):
-                if kmerhist.get(newkmer, 0) > thresh:
-                    # Found a frequent neighbor; replace old kmer
-                    # with neighbor
-                    read = read[:i] + newkmer + read[i+k:]
-                    break
-    # Return possibly-corrected read
-    return read
+    return Corrector(kmerhist, k, thresh).correct([read])[0]
 
 
 def rare_kmers(khist, thresh):
     """ Finding rare kmers, which should be omitted. """
-    wrong_kmers = []
-    for k in khist.keys():
-        if khist[k] <= thresh:
-            wrong_kmers.append(k)
-    return wrong_kmers
-
-
-def remove_errors(reads, k, khist):
-    """ Removing errors from all given reads. """
-    corrected_reads = []
-    for read in reads:
-        corrected = correct1mm(read, k, khist, 'ACGT', 1)
-        corrected_reads.append(corrected)
-    return corrected_reads
+    return decode_all(khist.rare(thresh), khist.k)
+
+
+def init_worker(reads, corrector):
+    """ Store the reads and the corrector in the worker process. """
+
+    shared['reads'] = reads
+    shared['corrector'] = corrector
+
+
+def correct_batch(bounds):
+    """ Correct the shared reads with indices from the given range. """
+
+    reads = shared['reads']
+    return shared['corrector'].correct([reads[i] for i in range(*bounds)])
+
+
+def remove_errors(reads, k, khist, workers=1, batch_size=10000):
+    """ Removing errors from all given reads, in batches of batch_size
+        reads, which are corrected in a pool of workers if workers > 1
+        (but not in daemonic processes, which can't start their own).
+        Reads from a ReadStore are corrected into a new ReadStore, batch
+        by batch, without a list of all corrected reads. """
+    batches = [(i, min(i + batch_size, len(reads))) for i in range(0, len(reads), batch_size)]
+    corrector = Corrector(khist, k, 1)
+    if can_start(min(workers, len(batches))):
+        with start_pool(min(workers, len(batches)), init_worker, (reads, corrector)) as pool:
+            return collect_reads((read for batch in pool.imap(correct_batch, batches) for read in batch), reads)
+    init_worker(reads, corrector)
+    return collect_reads((read for bounds in batches for read in correct_batch(bounds)), reads)
+
+
+def collect_reads(corrected, reads):
+    """ Return the corrected reads as a ReadStore if the reads are one,
+        otherwise as a list. """
+
+    if isinstance(reads, ReadStore):
+        return ReadStore.from_reads(corrected)
+    return list(corrected)
+
+
+def orient_reads(reads, khist):
+    """ Turn reads of both strands to one strand, using k-mers of the
+        canonical KmerHist seen at least twice. Two reads sharing such a
+        k-mer have the same orientation if the k-mer is in both of them
+        in the same form (or in both reverse complemented). These links
+        join reads in a union-find with the parity of every read to its
+        root, links shared by most k-mers first, and a link contradicting
+        the ones already made (a reverse complement repeat) is skipped.
+        Every group is turned to the orientation of most of its reads.
+        The graph built from turned reads has nodes of one strand with
+        coverage of both. Reads from a ReadStore are turned into a new one. """
+
+    k = khist.k
+    windows, valid = packed_windows(sequence_codes(reads), k)
+    positions = np.flatnonzero(valid)
+    windows = windows[valid]
+    idx, found = khist.index(windows)
+    found[found] = khist.counts[idx[found]] > 1  # k-mers seen once may be errors
+    positions, windows, idx = positions[found], windows[found], idx[found]
+    forward = windows == canonical_codes(windows, k)
+    owners = np.searchsorted(read_offsets(reads), positions, side='right') - 1
+
+    # every read with a k-mer is linked to the first read with it
+    order = np.lexsort((owners, idx))
+    idx, owners, forward = idx[order], owners[order], forward[order]
+    starts = np.concatenate(([True], idx[1:] != idx[:-1])) if len(idx) else np.zeros(0, dtype=bool)
+    firsts = np.flatnonzero(starts)[np.cumsum(starts) - 1]
+    linked = owners != owners[firsts]
+    n = len(reads)
+    links = (owners[firsts][linked] * n + owners[linked]) * 2 + (forward[linked] != forward[firsts][linked])
+    links, support = np.unique(links, return_counts=True)
+
+    parent = list(range(n))
+    parity = [0] * n  # orientation relative to the parent
+    size = [1] * n
+
+    def find(x):
+        path = []
+        while parent[x] != x:
+            path.append(x)
+            x = parent[x]
+        p = 0
+        for y in reversed(path):
+            p ^= parity[y]
+            parity[y] = p
+            parent[y] = x
+        return x
+
+    for link in links[np.argsort(-support, kind='stable')].tolist():
+        a, b, turned = link // 2 // n, link // 2 % n, link & 1
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+        if size[ra] < size[rb]:
+            ra, rb, a, b = rb, ra, b, a
+        parity[rb] = parity[a] ^ parity[b] ^ turned  # roots have parity 0
+        parent[rb] = ra
+        size[ra] += size[rb]
+
+    roots = [find(i) for i in range(n)]
+    turned = [0] * n  # number of reads of the group turned against its root
+    for i, root in enumerate(roots):
+        turned[root] += parity[i]
+    oriented = [reverse_complement_read(read) if parity[i] ^ (2 * turned[roots[i]] > size[roots[i]]) else read
+                for i, read in enumerate(reads)]
+    if isinstance(reads, ReadStore):
+        return ReadStore.from_reads(oriented)
+    return oriented
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
 Created on Mon Dec 18 11:58:16 2017
@@ -6,86 +6,179 @@ Created on Mon Dec 18 11:58:16 2017
 @author: norbert
 """
 
-import pysam
-import sys
+from bisect import bisect_left
 from math import log
+import re
+import sys
 
 minlen = 300
 
-samfile = pysam.AlignmentFile(sys.stdin)
-reftotlen = sum(samfile.lengths)
-rdstotlen = 0
-
-reads = []
-fragments = []
-for read in samfile.fetch(until_eof=True):
-    if read.is_unmapped:
-        rdstotlen += read.query_length
-    else:
-        if not read.is_secondary:
-            rdstotlen += read.infer_read_length()
-        if read.reference_length>=minlen:
-             reads.append(read)
-             fragments.append((read.reference_start, read.reference_end))
-samfile.close()
-
-contig_overlaps = []
-for i, frag1 in enumerate(fragments):
-    for frag2 in fragments[i+1:]:
-        s,e = max(frag1[0], frag2[0]),min(frag1[1], frag2[1])
-        if s<e:
-            contig_overlaps.append((s,e))
-contig_overlaps.sort()
-
-redundant = []
-ls,le = -1,-1
-for cs,ce in contig_overlaps:
-    if cs<=le:
-        le = max(le, ce)
-    else:
-        if le>=0:
-            redundant.append((ls,le))
-        ls,le = cs,ce
-if le>=0:
-    redundant.append((ls,le))
-
-almtotlen = 0
-almmmcount = 0
-almcount = 0
-for read in reads:
-    s,e = read.reference_start, read.reference_end
-    alms = s
-    alpairs = read.get_aligned_pairs(True, True)
-    for rs, re in redundant + [(e,e)]:
-        if alms<rs:
-            alme = min(e, rs)
-            if alme-alms >= minlen:
-                almtotlen += alme-alms
-                almcount+=1
-                i = alms-s
-                while alpairs[i][1] is None or alpairs[i][1]<alms:
-                    i += 1
-                while i<len(alpairs) and (alpairs[i][1] is None or alpairs[i][1]<alme):
-                    if alpairs[i][1] is None or alpairs[i][2] is None or alpairs[i][2].islower():
-                        almmmcount += 1
-                    i += 1
-        if re<e:
-            alms = max(alms, re)
-        else:
-            break
-
-almtotlen = float(almtotlen)
-refcoverage = almtotlen/reftotlen if almtotlen else 0
-rdscoverage = almtotlen/rdstotlen if almtotlen else 0
-ident_score = max(0.5, 1-10*almmmcount/almtotlen) if almtotlen else 0
-count_score = 1/log(4+almcount, 5) if almtotlen else 0
-
-score = refcoverage*rdscoverage*ident_score*count_score
-
-print "Pokrycie referencji:", refcoverage
-print "Pokrycie odczytów:"  , rdscoverage
-#print "Błędy uliniowień:"   , almmmcount/almtotlen if almtotlen else 0
-print "Ocena identyczności:", ident_score
-#print "Liczba uliniowień:"  , almcount
-print "Ocena rozdrobnienia:", count_score
-print "Łączna ocena:"       , score
+# CIGAR operations consuming the reference, the query (with hard clips) or aligning bases
+REF_OPS = set('MDN=X')
+READ_OPS = set('MIS=XH')
+PAIR_OPS = set('M=X')
+
+CIGAR = re.compile(r'(\d+)([MIDNSHP=X])')
+MD = re.compile(r'(\d+)|\^[A-Za-z]+|([A-Za-z])')
+
+
+class Alignment:
+    """ Alignment of a contig kept only by what scoring needs: reference
+        start and end, and the mismatches of its aligned pairs (pairs of
+        a query and a reference base, as get_aligned_pairs with
+        matches_only gives them) as their pair indices and reference
+        positions, both increasing. """
+
+    __slots__ = ('start', 'end', 'indices', 'positions')
+
+    def __init__(self, start, end, indices, positions):
+        self.start = start
+        self.end = end
+        self.indices = indices
+        self.positions = positions
+
+    def mismatches(self, s, e):
+        """ Number of mismatches at reference positions s:e, counted from
+            the pair s - start on, as the pair walk of the original script
+            did (pairs before it are skipped even if deletions shift them
+            into the range). """
+
+        lower = max(bisect_left(self.positions, s), bisect_left(self.indices, s - self.start))
+        return max(bisect_left(self.positions, e) - lower, 0)
+
+
+def mismatch_pairs(start, cigar, md):
+    """ Return pair indices and reference positions of mismatches given
+        by the MD tag of the alignment with the CIGAR operations. """
+
+    indices = []
+    pair = 0
+    for count, base in MD.findall(md):
+        if count:
+            pair += int(count)
+        elif base:
+            indices.append(pair)
+            pair += 1
+    positions = []
+    if indices:
+        # reference position of every pair, block by block
+        blocks = []
+        first, ref = 0, start
+        for n, op in cigar:
+            if op in PAIR_OPS:
+                blocks.append((first, ref))
+                first += n
+            if op in REF_OPS:
+                ref += n
+        b = 0
+        for i in indices:
+            while b + 1 < len(blocks) and blocks[b + 1][0] <= i:
+                b += 1
+            positions.append(blocks[b][1] + i - blocks[b][0])
+    return indices, positions
+
+
+def read_sam(lines):
+    """ Read SAM lines in one pass. Return total length of the reference
+        sequences, total length of the reads (unmapped ones and primary
+        alignments) and Alignments at least minlen long. """
+
+    reftotlen = 0
+    rdstotlen = 0
+    alignments = []
+    for line in lines:
+        if line.startswith('@'):
+            if line.startswith('@SQ'):
+                for field in line.rstrip('\n').split('\t')[1:]:
+                    if field.startswith('LN:'):
+                        reftotlen += int(field[3:])
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 11:
+            continue
+        flag = int(fields[1])
+        if flag & 4:
+            rdstotlen += len(fields[9]) if fields[9] != '*' else 0
+            continue
+        cigar = [(int(n), op) for n, op in CIGAR.findall(fields[5])]
+        if not flag & 256:
+            rdstotlen += sum(n for n, op in cigar if op in READ_OPS)
+        start = int(fields[3]) - 1
+        end = start + sum(n for n, op in cigar if op in REF_OPS)
+        if end - start >= minlen:
+            md = next((f[5:] for f in fields[11:] if f.startswith('MD:Z:')), None)
+            if md is None:
+                raise ValueError('alignment without MD tag: %s' % fields[0])
+            alignments.append(Alignment(start, end, *mismatch_pairs(start, cigar, md)))
+    return reftotlen, rdstotlen, alignments
+
+
+def redundant_regions(fragments):
+    """ Return sorted, disjoint regions covered by at least two of the
+        fragments (start, end): the union of their pairwise overlaps.
+        Ends and starts are swept in order, all at one position at once. """
+
+    events = sorted([(s, 1) for s, e in fragments] + [(e, -1) for s, e in fragments])
+    redundant = []
+    depth = 0
+    start = None
+    i = 0
+    while i < len(events):
+        pos = events[i][0]
+        while i < len(events) and events[i][0] == pos:
+            depth += events[i][1]
+            i += 1
+        if depth >= 2 and start is None:
+            start = pos
+        elif depth < 2 and start is not None:
+            redundant.append((start, pos))
+            start = None
+    return redundant
+
+
+def score(lines):
+    """ Score contigs from their SAM alignments to the reference. Parts of
+        alignments outside redundant regions, at least minlen long, are
+        counted. Return refcoverage, rdscoverage, ident_score, count_score
+        and their product. """
+
+    reftotlen, rdstotlen, alignments = read_sam(lines)
+    redundant = redundant_regions([(a.start, a.end) for a in alignments])
+    ends = [rend for rstart, rend in redundant]
+
+    almtotlen = 0
+    almmmcount = 0
+    almcount = 0
+    for a in alignments:
+        s, e = a.start, a.end
+        alms = s
+        # regions ending up to s don't cut the alignment, the alignment end closes the last part
+        i = bisect_left(ends, s + 1)
+        while True:
+            rstart, rend = redundant[i] if i < len(redundant) else (e, e)
+            if alms < rstart:
+                alme = min(e, rstart)
+                if alme - alms >= minlen:
+                    almtotlen += alme - alms
+                    almcount += 1
+                    almmmcount += a.mismatches(alms, alme)
+            if rend >= e:
+                break
+            alms = max(alms, rend)
+            i += 1
+
+    almtotlen = float(almtotlen)
+    refcoverage = almtotlen/reftotlen if almtotlen else 0
+    rdscoverage = almtotlen/rdstotlen if almtotlen else 0
+    ident_score = max(0.5, 1-10*almmmcount/almtotlen) if almtotlen else 0
+    count_score = 1/log(4+almcount, 5) if almtotlen else 0
+    return refcoverage, rdscoverage, ident_score, count_score, refcoverage*rdscoverage*ident_score*count_score
+
+
+if __name__ == '__main__':
+    refcoverage, rdscoverage, ident_score, count_score, total = score(sys.stdin)
+    print("Pokrycie referencji:", refcoverage)
+    print("Pokrycie odczytów:", rdscoverage)
+    print("Ocena identyczności:", ident_score)
+    print("Ocena rozdrobnienia:", count_score)
+    print("Łączna ocena:", total)
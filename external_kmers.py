@@ -0,0 +1,124 @@
+from kmers import KmerHist, canonical_codes, code_batches, packed_windows, reduce_counts
+import numpy as np
+import tempfile
+import weakref
+import shutil
+import os
+
+# types of the columns of sorted runs and of the merged table
+DTYPES = {'kmers': np.uint64, 'counts': np.uint32, 'first': np.int64}
+
+# rough RAM needed for a base of a batch of reads and for a merged k-mer
+BYTES_PER_BASE = 48
+BYTES_PER_KMER = 64
+
+
+def map_array(path, dtype, n):
+    """ Memory-map n items of dtype from the file (empty files can't be mapped). """
+
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+
+
+class DiskHist(KmerHist):
+    """ KmerHist with arrays memory-mapped from the table written by
+        count_kmers_external into directory, which is removed together
+        with the histogram. If first occurrences were counted, first is
+        the position of every k-mer among all valid k-mers of the reads. """
+
+    def __init__(self, k, directory, n, fields, canonical=False):
+        arrays = {field: map_array(os.path.join(directory, field), DTYPES[field], n) for field in fields}
+        super().__init__(k, arrays['kmers'], arrays['counts'], canonical)
+        self.first = arrays.get('first')
+        self.directory = directory
+        weakref.finalize(self, shutil.rmtree, directory, True)
+
+
+def write_run(path, arrays):
+    """ Write the columns of a sorted run into files path.<field>. """
+
+    for field, values in arrays.items():
+        values.astype(DTYPES[field]).tofile('%s.%s' % (path, field))
+
+
+def merge_runs(directory, runs, fields, memory):
+    """ Merge sorted runs (pairs of path and length) into the table of
+        the directory: counts of equal k-mers are added, their first
+        occurrences are the smallest ones. Every step takes at most chunk
+        k-mers of every run, up to the smallest k-mer not taken from any
+        of them, so the memory is bounded. Return the number of k-mers. """
+
+    if len(runs) == 1:
+        for field in fields:
+            os.rename('%s.%s' % (runs[0][0], field), os.path.join(directory, field))
+        return runs[0][1]
+
+    chunk = max(memory // (BYTES_PER_KMER * max(len(runs), 1)), 1024)
+    arrays = [{field: map_array('%s.%s' % (path, field), DTYPES[field], n) for field in fields} for path, n in runs]
+    pos = [0] * len(runs)
+    outs = {field: open(os.path.join(directory, field), 'wb') for field in fields}
+    total = 0
+    while True:
+        live = [i for i in range(len(runs)) if pos[i] < runs[i][1]]
+        if not live:
+            break
+        bounds = [arrays[i]['kmers'][pos[i] + chunk] for i in live if pos[i] + chunk < runs[i][1]]
+        high = min(bounds) if bounds else None
+        parts = {field: [] for field in fields}
+        for i in live:
+            kmers = arrays[i]['kmers']
+            end = runs[i][1] if high is None else pos[i] + int(np.searchsorted(kmers[pos[i]:], high))
+            for field in fields:
+                parts[field].append(np.asarray(arrays[i][field][pos[i]:end]))
+            pos[i] = end
+
+        merged = dict(zip(['kmers', 'counts', 'first'], reduce_counts(
+            np.concatenate(parts['kmers']), np.concatenate(parts['counts']).astype(np.int64),
+            np.concatenate(parts['first']) if 'first' in fields else None)))
+        for field in fields:
+            outs[field].write(merged[field].astype(DTYPES[field]).tobytes())
+        total += len(merged['kmers'])
+    for f in outs.values():
+        f.close()
+    for path, n in runs:
+        for field in fields:
+            os.remove('%s.%s' % (path, field))
+    return total
+
+
+def count_kmers_external(reads, k, memory, directory=None, first=False, canonical=False):
+    """ Count k-mers of the reads in about memory bytes of RAM. The reads
+        are packed in batches, k-mers of every batch are counted and
+        spilled as a sorted run into a temporary directory (made in the
+        given directory or in the default one). The runs are merged into
+        one table, which is queried through memory-mapping. With first,
+        the first occurrence of every k-mer is kept as well. With canonical,
+        canonical k-mers are counted. Return DiskHist. """
+
+    directory = tempfile.mkdtemp(prefix='kmers', dir=directory)
+    fields = ['kmers', 'counts', 'first'] if first else ['kmers', 'counts']
+    try:
+        runs = []
+        offset = 0
+        for codes in code_batches(reads, max(memory // BYTES_PER_BASE, 1 << 16)):
+            windows, valid = packed_windows(codes, k)
+            windows = windows[valid]
+            if canonical:
+                windows = canonical_codes(windows, k)
+            kmers, index, counts = np.unique(windows, return_index=True, return_counts=True)
+            arrays = {'kmers': kmers, 'counts': counts}
+            if first:
+                arrays['first'] = index + offset
+            offset += len(windows)
+            path = os.path.join(directory, 'run%d' % len(runs))
+            write_run(path, arrays)
+            runs.append((path, len(kmers)))
+        if not runs:
+            write_run(os.path.join(directory, 'run0'), {field: np.zeros(0) for field in fields})
+            runs.append((os.path.join(directory, 'run0'), 0))
+        n = merge_runs(directory, runs, fields, memory)
+    except BaseException:
+        shutil.rmtree(directory, True)
+        raise
+    return DiskHist(k, directory, n, fields, canonical)
@@ -0,0 +1,138 @@
+from array import array
+import numpy as np
+import mmap
+import gzip
+
+
+class ReadStore:
+    """ Reads kept in one bytes buffer instead of many str objects.
+        Every read in data is followed by a newline, offsets holds the
+        start of every read and the end of the buffer. """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_reads(cls, reads):
+        """ Build the store from an iterable of read strings. """
+
+        data = bytearray()
+        offsets = array('q', [0])
+        for read in reads:
+            data += read.encode()
+            data += b'\n'
+            offsets.append(len(data))
+        return cls(bytes(data), np.array(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_records(cls, records):
+        """ Build the store from a list of reads given as bytes. """
+
+        lengths = np.array([len(record) + 1 for record in records], dtype=np.int64)
+        data = b'\n'.join(records) + b'\n' if records else b''
+        return cls(data, np.concatenate(([0], np.cumsum(lengths))))
+
+    @classmethod
+    def join(cls, stores):
+        """ Build one store of the reads of all the given stores. """
+
+        stores = list(stores)
+        starts = np.cumsum([0] + [len(store.data) for store in stores])
+        offsets = [store.offsets[:-1] + start for store, start in zip(stores, starts)]
+        return cls(b''.join(store.data for store in stores), np.concatenate(offsets + [starts[-1:]]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i+1]-1].decode()
+
+    def __iter__(self):
+        data = self.data
+        offsets = self.offsets.tolist()
+        for i in range(len(offsets) - 1):
+            yield data[offsets[i]:offsets[i+1]-1].decode()
+
+    def total_length(self):
+        """ Sum of lengths of all reads. """
+
+        return len(self.data) - len(self)
+
+
+def open_fasta(path, use_mmap=False):
+    """ Open fasta file for reading in binary mode. Gzipped files are
+        recognized by their magic number, other files can be mapped
+        into memory instead of being read through a buffer. """
+
+    f = open(path, 'rb')
+    if f.read(2) == b'\x1f\x8b':
+        f.close()
+        return gzip.open(path, 'rb')
+    f.seek(0)
+    if use_mmap:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file can't be mapped
+            return f
+        f.close()
+        return m
+    return f
+
+
+def fasta_records(path, chunk_size=1 << 20, use_mmap=False):
+    """ Yield sequences (bytes) of all records from the fasta file (also
+        gzipped), reading it in chunks of chunk_size bytes. Sequence of
+        one record may be split into many lines. """
+
+    f = open_fasta(path, use_mmap)
+    seq = None
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if chunk:
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+        else:
+            lines = [rest]
+        for line in lines:
+            if line.startswith(b'>'):
+                if seq is not None:
+                    yield b''.join(seq)
+                seq = []
+            elif seq is not None:
+                seq.append(line.strip())
+        if not chunk:
+            break
+    if seq is not None:
+        yield b''.join(seq)
+    f.close()
+
+
+def fasta_reads(path, chunk_size=1 << 20, use_mmap=False):
+    """ Yield sequences of all records from the fasta file as strings,
+        see fasta_records. """
+
+    for record in fasta_records(path, chunk_size, use_mmap):
+        yield record.decode()
+
+
+def fasta_batches(path, batch_size=1 << 16, chunk_size=1 << 20, use_mmap=False):
+    """ Yield ReadStores of at most batch_size consecutive reads of the
+        fasta file, see fasta_records. """
+
+    batch = []
+    for record in fasta_records(path, chunk_size, use_mmap):
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield ReadStore.from_records(batch)
+            batch = []
+    if batch:
+        yield ReadStore.from_records(batch)
+
+
+def load_reads(path, chunk_size=1 << 20, use_mmap=False):
+    """ Load all reads from the fasta file into a ReadStore, joined from
+        its batches. """
+
+    return ReadStore.join(fasta_batches(path, chunk_size=chunk_size, use_mmap=use_mmap))
@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+import os
+
+
+class TemporaryDirectoryTest(unittest.TestCase):
+    """ Test case with a temporary directory, which is removed after
+        every test. """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        """ Return the path of the file name in the directory. """
+
+        return os.path.join(self.directory.name, name)
+
+
+def random_genome(rng, length):
+    """ Return a random sequence of the given length. """
+
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def sample_reads(rng, genome, count, length, rate=0, errors=None):
+    """ Return count reads of the given length from random positions of
+        the genome. Every base is replaced, with the given rate, by a
+        random one of errors (by default by another base). """
+
+    reads = []
+    for _ in range(count):
+        start = rng.randrange(len(genome) - length)
+        read = list(genome[start:start + length])
+        for i in range(length if rate else 0):
+            if rng.random() < rate:
+                read[i] = rng.choice(errors or 'ACGT'.replace(read[i], ''))
+        reads.append(''.join(read))
+    return reads
+
+
+def substituted_reads(rng, genome, count, length):
+    """ Return count reads of the given length from random positions of
+        the genome, with one random base of every read set to a random
+        one (which may be the same). """
+
+    reads = []
+    for _ in range(count):
+        start = rng.randrange(len(genome) - length)
+        read = list(genome[start:start + length])
+        read[rng.randrange(length)] = rng.choice('ACGT')
+        reads.append(''.join(read))
+    return reads
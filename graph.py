@@ -1,5 +1,27 @@
 from statistics import mean
-import copy
+from kmers import KmerHist, SketchHist
+from checkpoint import Checkpoint, save_graph
+from instrument import Recorder
+from itertools import chain, count
+from collections import deque
+import numpy as np
+import heapq
+
+# minimal length of a contig
+MIN_CONTIG = 300
+# score of paths which are too short, used by the contig search
+INFEASIBLE = -2 ** 62
+# nodes visited by the search for the other branch of a bubble
+DETOUR_VISITS = 100
+
+
+def contigs_to_file(contigs, output):
+    """ Write contig sequences into fasta file. """
+
+    o = open(output, 'w')
+    for i, contig in enumerate(contigs):
+        o.write('>contig%d\n%s\n' % (i, contig))
+    o.close()
 
 
 class DeBruijnGraph:
@@ -24,6 +46,7 @@ class DeBruijnGraph:
             self.children = {}
             self.parents = {}
             self.weights = []
+            self.total = 0  # sum of weights, set after merging
         
         def __str__(self):
             return self.km1mer
@@ -31,73 +54,126 @@ class DeBruijnGraph:
     class Contig:
         """ Contig object is the set of nodes which create the contig
             sequence. Attribute weight is the average of all weights
-            of nodes in the path. """
+            of nodes in the path and length the length of the sequence,
+            both are computed from totals of the nodes. The sequence is
+            spelled only when it is read, so scoring of candidate paths
+            does not build strings. """
 
         def __init__(self, path):
             self.path = path
             self.weight = 0
-            self.seq = ''
+            self.length = 0
+            self.k = None
+            self._seq = None
 
         def __str__(self):
             return self.seq
 
+        @property
+        def seq(self):
+            if self._seq is None:
+                overlap = self.k - 2
+                self._seq = self.path[0].km1mer + ''.join(n.km1mer[overlap:] for n in self.path[1:])
+            return self._seq
+
         def set_params(self, k):
-            w = self.path[0].weights
-            self.seq = self.path[0].km1mer
-            for n in self.path[1:]:
-                self.seq += n.km1mer[k - 2:]
-                w += n.weights
-            if not w:
-                w = [0]
-            self.weight = mean(w)
-
-    def __init__(self, strIter, k, wrong_kmers, thresh, name, output=None, verbose=False):
+            self.k = k
+            self._seq = None
+            self.length = sum(len(n.km1mer) for n in self.path) - (k - 2) * (len(self.path) - 1)
+            total = sum(n.total for n in self.path)
+            count = sum(len(n.weights) for n in self.path)
+            self.weight = total / count if count else 0
+
+    class Overlay:
+        """ View of the graph nodes from which nodes can be removed
+            without changing the graph: removed nodes are kept in a set,
+            numbers of parents and children of the others in dicts,
+            which keep the order of the nodes. """
+
+        def __init__(self, nodes):
+            self.removed = set()
+            self.nparents = {n: len(n.parents) for n in nodes.values()}
+            self.nchildren = {n: len(n.children) for n in self.nparents}
+
+        def __len__(self):
+            return len(self.nparents)
+
+        def values(self):
+            return self.nparents.keys()
+
+        def children(self, node):
+            return [n for n in node.children if n not in self.removed]
+
+        def parents(self, node):
+            return [n for n in node.parents if n not in self.removed]
+
+        def remove(self, node):
+            """ Remove the node and its edges from the view. """
+
+            self.removed.add(node)
+            del (self.nparents[node])
+            del (self.nchildren[node])
+            for n in node.children:
+                if n in self.nparents:
+                    self.nparents[n] -= 1
+            for n in node.parents:
+                if n in self.nchildren:
+                    self.nchildren[n] -= 1
+
+    def __init__(self, strIter, k, wrong_kmers, thresh, name, output=None, verbose=False, search='dp',
+                 max_paths=10000, checkpoint=None, recorder=None, simplify=None):
         """ Build de Bruijn multigraph given string iterator and k-mer
-            length k """
-
-        self.name = name
-        self.verbose = verbose
-        if output is not None:
-            self.output = output
-        else:
-            self.output = '%s_contigs.fasta' % name
-        self.thresh = max(thresh, 1)
-        self.k = k
-        self.nodes = {}  # maps k-1-mers to Node objects
-        for st in strIter:
-            for kmer, km1L, km1R in self.chop(st, k):
-                if km1L in self.nodes:
-                    nodeL = self.nodes[km1L]
-                else:
-                    nodeL = self.nodes[km1L] = self.Node(km1L)
-                if km1R in self.nodes:
-                    nodeR = self.nodes[km1R]
-                else:
-                    nodeR = self.nodes[km1R] = self.Node(km1R)
-
-                nodeL.children[nodeR] = nodeL.children.setdefault(nodeR, 0) + 1
-                nodeR.parents[nodeL] = nodeR.parents.setdefault(nodeL, 0) + 1
+            length k. Rare k-mers are given either as a list (wrong_kmers)
+            or as a KmerHist, which is queried with thresh. The best
+            contig of every head is found by dynamic programming (search
+            'dp') or by listing at most max_paths paths ('enumerate').
+            If simplify is a dict of limits (see simplify), tips and
+            bubbles of the merged graph are removed. If checkpoint is
+            given, the merged graph is saved into that file before
+            contigs are searched (see save). Stages are measured by the
+            given Recorder. """
+
+        self.setup(k, thresh, name, output, verbose, search, max_paths, recorder)
+        with self.recorder.stage('build', k) as record:
+            self.build(strIter)
+            self.measure(record)
 
         # removing wrong kmers, only if they aren't head or tail
-        removed = self.remove_rare_kmers(wrong_kmers)
+        with self.recorder.stage('rare', k) as record:
+            removed = self.remove_rare_kmers(wrong_kmers)
+            self.measure(record, removed=removed)
         # cutting edges with weight below thresh
-        cutedges = self.cut_graph()
+        with self.recorder.stage('cut', k) as record:
+            cutedges = self.cut_graph()
+            self.measure(record, cut=cutedges)
         # removing not connected nodes
-        notconnected = 0
-        for n in list(self.nodes.values()).copy():
-            if len(n.children) == 0 and len(n.parents) == 0:
-                del (self.nodes[n.km1mer])
-                notconnected += 1
+        with self.recorder.stage('isolated', k) as record:
+            notconnected = self.remove_isolated()
+            self.measure(record, removed=notconnected)
         # establishing head-nodes
-        self.head = [n for n in self.nodes.values() if len(n.parents) == 0 and len(n.children) > 0]
+        self.head = self.heads()
         # merging linear nodes
-        self.done = []
-        for h in self.head:
-            self.merge(h, True)
+        with self.recorder.stage('merge', k) as record:
+            self.compact(self.head)
+            for n in self.nodes.values():
+                n.total = sum(n.weights)
+            self.measure(record, heads=len(self.head))
+        # clipping tips and popping bubbles
+        simplified = None
+        if simplify is not None:
+            with self.recorder.stage('simplify', k) as record:
+                simplified = self.simplify(**simplify)
+                self.measure(record, **simplified)
+        if checkpoint is not None:
+            with self.recorder.stage('checkpoint', k):
+                self.save(checkpoint)
 
         if self.verbose:
             print('Threshold = %d' % thresh)
-            print('Number of wrong kmers = %d' % len(wrong_kmers))
+            if isinstance(wrong_kmers, KmerHist):
+                print('Number of wrong kmers = %d' % len(wrong_kmers.rare(thresh)))
+            else:
+                print('Number of wrong kmers = %d' % len(wrong_kmers))
             print('Number of removed rare kmers = %d' % removed)
             print('Number of cut edges = %d' % cutedges)
             print('Number of removed, not-connected nodes = %d' % notconnected)
@@ -106,6 +182,50 @@ class DeBruijnGraph:
             for n in self.nodes.values():
                 print('%s\t%d\t%d\t%s' % (n.km1mer, len(n.parents), len(n.children), n in self.done))
             print('Number of nodes after merging: %d' % len(self.nodes))
+            if simplified is not None:
+                print('Clipped tips = %d, popped bubbles = %d, branches %d -> %d' % (
+                    simplified['tips'], simplified['bubbles'], simplified['branches_before'],
+                    simplified['branches_after']))
+
+        with self.recorder.stage('search', k) as record:
+            self.search_contigs()
+            self.measure(record, heads=len(self.head), solo=len(self.solo), searches=self.searches,
+                         contigs=len(self.contigs))
+
+    def setup(self, k, thresh, name, output=None, verbose=False, search='dp', max_paths=10000, recorder=None):
+        """ Set parameters of the graph, see __init__. """
+
+        self.name = name
+        self.verbose = verbose
+        if output is not None:
+            self.output = output
+        else:
+            self.output = '%s_contigs.fasta' % name
+        self.thresh = max(thresh, 1)
+        self.rare_thresh = thresh
+        self.k = k
+        self.search = search
+        self.max_paths = max_paths
+        self.view = None  # Overlay searched for contigs
+        self.nodes = {}  # maps k-1-mers to Node objects
+        self.recorder = recorder or Recorder()
+
+    def size(self):
+        """ Return the number of nodes and edges. """
+
+        return len(self.nodes), sum(len(n.children) for n in self.nodes.values())
+
+    def measure(self, record, **counts):
+        """ Put the counts and the size of the graph into the record of a
+            stage, unless the recorder is disabled (record is None). """
+
+        if record is not None:
+            record.update(counts)
+            record['nodes'], record['edges'] = self.size()
+
+    def search_contigs(self):
+        """ Find contigs of the merged graph: solo nodes long enough
+            and the best contigs of the rest (see cut_contigs). """
 
         # establishing heads after merging
         self.head = [n for n in self.nodes.values() if len(n.parents) == 0 and len(n.children) > 0]
@@ -113,14 +233,14 @@ class DeBruijnGraph:
         self.solo = [n for n in self.nodes.values() if len(n.parents) == 0 and len(n.children) == 0]
 
         # looking for contigs based on not-connected, merged nodes
-        nodes = copy.deepcopy(self.nodes)
+        nodes = self.Overlay(self.nodes)
         self.contigs = []
         for n in self.solo:
-            if len(n.km1mer) >= 300:
+            if len(n.km1mer) >= MIN_CONTIG:
                 contig = self.Contig([n])
                 contig.set_params(self.k)
                 self.contigs.append(contig)
-                del (nodes[n.km1mer])
+                nodes.remove(n)
 
         if self.verbose:
             print('Real heads after merging = %d' % len(self.head))
@@ -137,12 +257,44 @@ class DeBruijnGraph:
         for c in self.contigs:
             for cc in c.path:
                 n.add(cc)
-        self.used = len(n)/len(self.nodes)
+        self.used = len(n)/len(self.nodes) if self.nodes else 0
 
         if self.contigs and self.verbose:
             print('Number of contigs = %d' % len(self.contigs))
             print('Mean number of nodes in one contig = %.2f' % mean([len(l.path) for l in self.contigs]))
 
+    def build(self, strIter):
+        """ Add nodes and edges of all k-mers from the given strings. """
+
+        for st in strIter:
+            for kmer, km1L, km1R in self.chop(st, self.k):
+                if km1L in self.nodes:
+                    nodeL = self.nodes[km1L]
+                else:
+                    nodeL = self.nodes[km1L] = self.Node(km1L)
+                if km1R in self.nodes:
+                    nodeR = self.nodes[km1R]
+                else:
+                    nodeR = self.nodes[km1R] = self.Node(km1R)
+
+                nodeL.children[nodeR] = nodeL.children.setdefault(nodeR, 0) + 1
+                nodeR.parents[nodeL] = nodeR.parents.setdefault(nodeL, 0) + 1
+
+    def remove_isolated(self):
+        """ Delete nodes without any edges, return their number. """
+
+        notconnected = 0
+        for n in list(self.nodes.values()).copy():
+            if len(n.children) == 0 and len(n.parents) == 0:
+                del (self.nodes[n.km1mer])
+                notconnected += 1
+        return notconnected
+
+    def heads(self):
+        """ Return nodes without parents, but with children. """
+
+        return [n for n in self.nodes.values() if len(n.parents) == 0 and len(n.children) > 0]
+
     def cut_graph(self):
         """ Delete edges which weight is lower than threshold. """
 
@@ -159,15 +311,12 @@ class DeBruijnGraph:
     def contigs_to_file(self):
         """ Write found contigs into fasta file. """
 
-        o = open(self.output, 'w')
-        for i, contig in enumerate(self.contigs):
-            o.write('>contig%d\n%s\n' % (i, contig))
-        o.close()
+        contigs_to_file(self.contigs, self.output)
 
     def remove_rare_kmers(self, wrong_kmers):
-        """ Remove kmers from input list wrong_kmers,
-            but only if given kmer is not head (no input
-            edges) or tail (no output edges). """
+        """ Remove kmers from input list wrong_kmers (or rare
+            kmers of the given KmerHist), but only if given kmer
+            is not head (no input edges) or tail (no output edges). """
 
         def side_kmers(kmers, side):
             nodes = set()
@@ -178,8 +327,15 @@ class DeBruijnGraph:
                     nodes.add(k[:-1])
             return nodes
 
+        if isinstance(wrong_kmers, SketchHist):
+            left, right = wrong_kmers.rare_sides(self.rare_thresh, self.nodes)
+        elif isinstance(wrong_kmers, KmerHist):
+            left, right = wrong_kmers.rare_sides(self.rare_thresh)
+        else:
+            left, right = side_kmers(wrong_kmers, 'left'), side_kmers(wrong_kmers, 'right')
+
         removed = 0
-        for lista, side in [[side_kmers(wrong_kmers, 'left'), 'left'], [side_kmers(wrong_kmers, 'right'), 'right']]:
+        for lista, side in [[left, 'left'], [right, 'right']]:
             for s in lista:
                 try:
                     node = self.nodes[s]
@@ -194,146 +350,617 @@ class DeBruijnGraph:
                     removed += 1
         return removed
 
+    def compact(self, heads):
+        """ Merge linear nodes reachable from the given heads. While
+            merging, sequences of merged nodes are kept as linked pieces
+            (so joining two nodes does not copy them) and the order of
+            nodes is kept in self.order. Names of merged nodes are
+            spelled, and self.nodes rebuilt, only at the end. """
+
+        self.done = set()
+        self.order = dict.fromkeys(self.nodes.values())
+        self.ends = {}  # first and last piece of sequence of merged nodes
+        for h in heads:
+            self.merge(h, True)
+
+        nodes = {}
+        for node in self.order:
+            if node in self.ends:
+                parts = []
+                piece = self.ends[node][0]
+                while piece is not None:
+                    parts.append(piece[0])
+                    piece = piece[1]
+                node.km1mer = ''.join(parts)
+            nodes[node.km1mer] = node
+        self.nodes = nodes
+        del self.order, self.ends
+
+    def join(self, left, right):
+        """ Join sequence of the right node to the sequence of the left
+            one, they overlap by k-2 bases. Return first and last piece. """
+
+        lfirst, llast = self.ends.pop(left, None) or 2 * ([left.km1mer, None],)
+        rfirst, rlast = self.ends.pop(right, None) or 2 * ([right.km1mer, None],)
+        rfirst[0] = rfirst[0][self.k - 2:]
+        llast[1] = rfirst
+        return lfirst, rlast
+
+    @staticmethod
+    def calls(nodes, direction):
+        """ Yield merge calls (node, direction) for all given nodes.
+            The nodes are listed only when the first call is taken. """
+
+        for n in list(nodes):
+            yield n, direction
+
     def merge(self, node, direction):
         """ Merge nodes which are connected only with each other.
             If direction is True then function goes down the graph
             (from parents to children), conversely if direction
-            is False. """
-
-        if node not in self.done:
-            self.done.append(node)
+            is False. Nodes waiting to be merged are kept on a stack
+            of call iterators instead of the call stack, and every
+            node is handled once, so it works in linear time.
+            It is used by compact, which spells merged sequences. """
+
+        stack = [iter([(node, direction)])]
+        while stack:
+            try:
+                node, direction = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            calls = self.merge_step(node, direction)
+            if calls is not None:
+                stack.append(calls)
+
+    def merge_step(self, node, direction):
+        """ Merge the given node with its neighbour, if they are
+            connected only with each other. Return iterator of merge
+            calls which have to be done next (or None). """
+
+        if node in self.done:
+            return None
+        self.done.add(node)
+        if direction:
+            downstream = node.children
+            upstream = node.parents
+        else:
+            downstream = node.parents
+            upstream = node.children
+        if len(upstream) > 1:
+            return chain(self.calls(upstream, not direction), self.calls(downstream, direction))
+        elif len(downstream) == 1:
+            nnode = next(iter(downstream.keys()))
             if direction:
-                downstream = node.children
-                upstream = node.parents
-            else:
-                downstream = node.parents
-                upstream = node.children
-            if len(upstream) > 1:
-                for n in upstream.keys():
-                    self.merge(n, not direction)
-                for n in downstream.keys():
-                    self.merge(n, direction)
-                return 0
-            elif len(downstream) == 1:
-                nnode = next(iter(downstream.keys()))
-                if direction:
-                    if len(nnode.parents) != 1:
-                        for n in [i for i in nnode.parents if i != node]:
-                            self.merge(n, not direction)
-                        self.merge(nnode, direction)
-                        return 0
-                    else:
-                        del (self.nodes[nnode.km1mer])
-                        nnode.km1mer = node.km1mer + nnode.km1mer[self.k - 2:]
-                        nnode.parents = node.parents
-                        for p in node.parents:
-                            p.children[nnode] = p.children[node]
-                            del (p.children[node])
+                if len(nnode.parents) != 1:
+                    others = [i for i in nnode.parents if i != node]
+                    return chain(self.calls(others, not direction), self.calls([nnode], direction))
                 else:
-                    if len(nnode.children) != 1:
-                        for n in [i for i in nnode.children if i != node]:
-                            self.merge(n, not direction)
-                        self.merge(nnode, direction)
-                        return 0
-                    else:
-                        del (self.nodes[nnode.km1mer])
-                        nnode.km1mer = nnode.km1mer[:-self.k + 2] + node.km1mer
-                        nnode.children = node.children
-                        for p in node.children:
-                            p.parents[nnode] = p.parents[node]
-                            del (p.parents[node])
-
-                nnode.weights = node.weights + [downstream[nnode]]
-                if nnode.km1mer in self.nodes:
-                    unode = self.nodes[nnode.km1mer]
-                    unode.weights.append(nnode.weights)
-                    for el in nnode.children:
-                        unode.children[el] = unode.children.setdefault(el, 0) + nnode.children[el]
-                    for el in nnode.parents:
-                        unode.parents[el] = unode.parents.setdefault(el, 0) + nnode.parents[el]
-                    self.merge(unode, direction)
+                    self.ends[nnode] = self.join(node, nnode)
+                    nnode.parents = node.parents
+                    for p in node.parents:
+                        p.children[nnode] = p.children[node]
+                        del (p.children[node])
+            else:
+                if len(nnode.children) != 1:
+                    others = [i for i in nnode.children if i != node]
+                    return chain(self.calls(others, not direction), self.calls([nnode], direction))
                 else:
-                    del (self.nodes[node.km1mer])
-                    self.nodes[nnode.km1mer] = nnode
-                    self.merge(nnode, direction)
+                    self.ends[nnode] = self.join(nnode, node)
+                    nnode.children = node.children
+                    for p in node.children:
+                        p.parents[nnode] = p.parents[node]
+                        del (p.parents[node])
+
+            # node is dropped, so its weights can be extended in place
+            node.weights.append(downstream[nnode])
+            nnode.weights = node.weights
+            del (self.order[nnode])
+            del (self.order[node])
+            self.order[nnode] = None
+            return self.calls([nnode], direction)
+        else:
+            return self.calls(downstream, direction)
+
+    def branches(self):
+        """ Number of children beyond the first one of every node, each
+            of them doubles paths going through the node. """
+
+        return sum(len(n.children) - 1 for n in self.nodes.values() if n.children)
+
+    def span(self, node):
+        """ Return the length of the node in bases and the number of its
+            weights, joined nodes (see unite) keep them in self.spans. """
+
+        return self.spans.get(node) or (len(node.km1mer), len(node.weights))
+
+    def coverage(self, node):
+        """ Mean weight of the edges merged into the node and of its own edges. """
+
+        edges = list(node.children.values()) + list(node.parents.values())
+        count = self.span(node)[1] + len(edges)
+        return (node.total + sum(edges)) / count if count else 0
+
+    def simplify(self, tip_length=None, tip_coverage=0.5, bubble_length=None, bubble_coverage=0.5):
+        """ Clip tips and pop bubbles of the merged graph, then join
+            nodes left connected only with each other. A tip is a node
+            without parents (or children) at most tip_length bases long
+            (2k by default), joined to a node which has other parents (or
+            children), with coverage below tip_coverage times the weight
+            of the strongest of the other edges. A bubble branch is a node
+            at most bubble_length bases long (3k by default) with one
+            parent and one child, both branching, which is reached from
+            the parent by another path too: it is searched for depth
+            first up to bubble_length bases and DETOUR_VISITS nodes, so
+            every node costs constant time. The branch is removed if its
+            coverage is below bubble_coverage times the lowest edge weight
+            of that path. Nodes keep their order, a joined node takes the
+            place of its first part. Nodes changed by joining are checked
+            again, so bubbles in a row are popped in one call. Sequences
+            and weights of joined nodes are kept as linked pieces (see
+            link) and spelled at the end. Return counts of removed tips
+            and bubbles, joined nodes and branches (see branches) before
+            and after. """
+
+        tip_length = 2 * self.k if tip_length is None else tip_length
+        bubble_length = 3 * self.k if bubble_length is None else bubble_length
+        before = self.branches()
+        order = list(self.nodes.values())
+        removed = set()
+        self.ends = {}  # first and last piece of sequence and weights of joined nodes
+        self.spans = {}
+        tips = 0
+        queue = deque(order)
+        while queue:
+            node = queue.popleft()
+            if node in removed or self.span(node)[0] > tip_length:
+                continue
+            for upstream, downstream in ((node.parents, node.children), (node.children, node.parents)):
+                if upstream or len(downstream) != 1:
+                    continue
+                neighbour, weight = next(iter(downstream.items()))
+                others = neighbour.parents if downstream is node.children else neighbour.children
+                strongest = max([w for n, w in others.items() if n is not node], default=0)
+                if neighbour is not node and self.coverage(node) < tip_coverage * strongest:
+                    self.detach(node, removed)
+                    tips += 1
+                    queue.append(self.unite(neighbour, removed))
+                break
+
+        bubbles = 0
+        queue = deque(order)
+        while queue:
+            node = queue.popleft()
+            if node in removed or len(node.children) < 2:
+                continue
+            for branch in sorted(node.children, key=self.coverage):
+                if len(node.children) < 2:
+                    break
+                if branch in removed or self.span(branch)[0] > bubble_length:
+                    continue
+                if len(branch.parents) != 1 or len(branch.children) != 1:
+                    continue
+                end = next(iter(branch.children))
+                if end is node or end is branch:
+                    continue
+                weight = self.detour(node, end, branch, bubble_length)
+                if weight is not None and self.coverage(branch) < bubble_coverage * weight:
+                    self.detach(branch, removed)
+                    bubbles += 1
+                    queue.append(self.unite(end, removed))
+            if node not in removed:
+                count = len(removed)
+                first = self.unite(node, removed)
+                if len(removed) > count:
+                    queue.append(first)
+
+        for node, (piece, last) in self.ends.items():
+            if node in removed:
+                continue
+            parts = []
+            weights = []
+            while piece is not None:
+                parts.append(piece[0])
+                weights.extend(piece[1])
+                piece = piece[2]
+            node.km1mer = ''.join(parts)
+            node.weights = weights
+        del self.ends, self.spans
+
+        joined = len(removed) - tips - bubbles
+        self.nodes = {n.km1mer: n for n in order if n not in removed}
+        return {'tips': tips, 'bubbles': bubbles, 'joined': joined, 'branches_before': before,
+                'branches_after': self.branches()}
+
+    def detour(self, start, end, branch, limit):
+        """ Return the highest lowest edge weight of paths from start to
+            end which don't go through the branch, found by a depth first
+            search bounded by limit bases and DETOUR_VISITS nodes, or None. """
+
+        best = None
+        stack = []
+        for child, weight in start.children.items():
+            if child is end:
+                best = weight
+            elif child is not branch:
+                stack.append((child, self.span(child)[0] - (self.k - 2), weight))
+        visits = 0
+        while stack and visits < DETOUR_VISITS:
+            node, length, lowest = stack.pop()
+            visits += 1
+            for child, weight in node.children.items():
+                if child is end:
+                    best = max(best or 0, min(lowest, weight))
+                elif child is not start and child is not branch:
+                    extended = length + self.span(child)[0] - (self.k - 2)
+                    if extended <= limit:
+                        stack.append((child, extended, min(lowest, weight)))
+        return best
 
-            else:
-                for ch in downstream.keys():
-                    self.merge(ch, direction)
-                return 0
+    @staticmethod
+    def detach(node, removed):
+        """ Remove the node and its edges from its neighbours. """
+
+        for n in node.children:
+            del (n.parents[node])
+        for n in node.parents:
+            del (n.children[node])
+        node.children, node.parents = {}, {}
+        removed.add(node)
+
+    def link(self, left, right, weight):
+        """ Join pieces of the right node to pieces of the left one, as
+            join does in compact, with the weight of the edge between
+            them. A piece is [sequence, weights, next]. Return first and
+            last piece. """
+
+        lfirst, llast = self.ends.pop(left, None) or 2 * ([left.km1mer, left.weights, None],)
+        rfirst, rlast = self.ends.pop(right, None) or 2 * ([right.km1mer, right.weights, None],)
+        rfirst[0] = rfirst[0][self.k - 2:]
+        llast[2] = ['', [weight], rfirst]
+        return lfirst, rlast
+
+    def unite(self, node, removed):
+        """ Join the node with its neighbours which are connected only
+            with each other (as merge does) into the first node of the
+            chain, the others are added to removed. Return that node. """
+
+        first = node
+        while len(first.parents) == 1:
+            parent = next(iter(first.parents))
+            if len(parent.children) != 1 or parent is node:
+                break
+            first = parent
+        while len(first.children) == 1:
+            child, weight = next(iter(first.children.items()))
+            if child is first or len(child.parents) != 1:
+                break
+            (lbases, lcount), (rbases, rcount) = self.span(first), self.span(child)
+            self.spans[first] = (lbases + rbases - (self.k - 2), lcount + 1 + rcount)
+            self.spans.pop(child, None)
+            self.ends[first] = self.link(first, child, weight)
+            first.total += weight + child.total
+            first.children = child.children
+            for n in child.children:
+                n.parents = {first if p is child else p: w for p, w in n.parents.items()}
+            removed.add(child)
+        return first
+
+    def dag(self, head):
+        """ Return nodes reachable from the head in topological order
+            and their children. Edges which close a cycle (going back to
+            a node on the current path of depth-first search) are left
+            out, so every path ends in a node without children. Only nodes
+            of self.view are used, if it is set. """
+
+        if self.view is None:
+            children_of = lambda node: node.children
         else:
-            return 0
-
-    def all_contigs(self, node, contig):
-        """ Return all possible contigs started from the given node. """
-
-        if node not in self.done:
-            self.done.append(node)
-            contig.append(self.nodes[node.km1mer])
-            if len(node.children) == 0:
-                self.clist.append(contig)
-                return 0
-            elif len(node.children) == 1:
-                self.all_contigs(next(iter(node.children.keys())), contig)
+            children_of = self.view.children
+        children = {head: []}
+        order = []
+        active = {head}
+        stack = [(head, iter(children_of(head)))]
+        while stack:
+            node, it = stack[-1]
+            for ch in it:
+                if ch not in children:
+                    children[node].append(ch)
+                    children[ch] = []
+                    active.add(ch)
+                    stack.append((ch, iter(children_of(ch))))
+                    break
+                elif ch not in active:
+                    children[node].append(ch)
+            else:
+                stack.pop()
+                active.discard(node)
+                order.append(node)
+        order.reverse()
+        return order, children
+
+    def best_path(self, head, order, children, S, C):
+        """ Return the path from the head, at least MIN_CONTIG long, which
+            maximizes C*sum(weights) - S*len(weights), or None. Score of
+            the best path from every node is kept for every length still
+            needed (0..MIN_CONTIG), so it takes O(MIN_CONTIG) per edge.
+            Scores of a node are dropped once all its parents used them,
+            the chosen child is kept only for nodes with more children. """
+
+        overlap = self.k - 2
+        need = max(MIN_CONTIG - overlap, 0)
+        lengths = np.arange(need + 1)
+        waiting = {}  # node -> number of its parents not handled yet
+        for node in order:
+            for ch in children[node]:
+                waiting[ch] = waiting.get(ch, 0) + 1
+        best = {}
+        choice = {}
+        for node in reversed(order):
+            added = len(node.km1mer) - overlap
+            score = C * node.total - S * len(node.weights)
+            if children[node]:
+                scores = np.array([best[ch] for ch in children[node]])[:, np.maximum(lengths - added, 0)]
+                if len(children[node]) > 1:
+                    choice[node] = scores.argmax(axis=0).astype(np.uint8 if len(children[node]) < 256 else np.int64)
+                scores = scores.max(axis=0)
+                best[node] = np.where(scores == INFEASIBLE, INFEASIBLE, scores + score)
+                for ch in children[node]:
+                    waiting[ch] -= 1
+                    if not waiting[ch]:
+                        del (best[ch])
+            else:
+                best[node] = np.where(lengths <= added, score, INFEASIBLE)
+
+        if best[head][need] == INFEASIBLE:
+            return None
+        path = [head]
+        node = head
+        while children[node]:
+            ch = children[node][choice[node][need]] if node in choice else children[node][0]
+            need = max(need - len(node.km1mer) + overlap, 0)
+            node = ch
+            path.append(node)
+        return path
+
+    def best_contig(self, head, dag=None):
+        """ Return the contig from the given head, at least MIN_CONTIG
+            long, with the maximal mean weight (or None). The mean is
+            maximized with Dinkelbach's method: the best path for the
+            current ratio S/C gives a better ratio, until it does not. """
+
+        order, children = dag or self.dag(head)
+        S, C = 0, 1
+        best = None
+        while True:
+            path = self.best_path(head, order, children, S, C)
+            if path is None:
+                break
+            s = sum(n.total for n in path)
+            c = sum(len(n.weights) for n in path)
+            if s * C <= S * c:
+                break
+            S, C, best = s, c, path
+        if best is None:
+            return None
+        contig = self.Contig(best)
+        contig.set_params(self.k)
+        return contig
+
+    def enumerate_contig(self, head, limit, dag=None):
+        """ Return the contig from the given head, at least MIN_CONTIG
+            long, with the maximal mean weight (or None), checking at most
+            limit paths of the graph given by dag. """
+
+        order, children = dag or self.dag(head)
+        best = None
+        max_weight = 0
+        found = 0
+        path = []
+        stack = []
+        node = head
+        while True:
+            if node is not None:
+                path.append(node)
+                stack.append(iter(children[node]))
+                if not children[node]:
+                    found += 1
+                    cc = self.Contig(list(path))
+                    cc.set_params(self.k)
+                    if cc.length >= MIN_CONTIG and cc.weight > max_weight:
+                        max_weight = cc.weight
+                        best = cc
+                    if found == limit:
+                        break
             else:
-                for ch in node.children.keys():
-                    self.all_contigs(ch, contig)
-        elif contig:
-            self.clist.append(contig)
-            return 0
+                stack.pop()
+                path.pop()
+                if not stack:
+                    break
+            node = next(stack[-1], None)
+        return best
 
-    def find_contigs(self, heads):
-        """ Return the best contig for every given head-node. """
+    def head_contig(self, head, dag=None):
+        """ Return the best contig for the given head-node (or None). """
 
-        contigs = {}
-        for h in heads:
-            self.done = []
-            self.clist = []
-            self.all_contigs(h, [])
-            best = None
-            max_weight = 0
-            for c in self.clist:
-                cc = self.Contig(c)
-                cc.set_params(self.k)
-                if len(cc.seq) >= 300 and cc.weight > max_weight:
-                    max_weight = cc.weight
-                    best = cc
-            if best is not None:
-                contigs[h] = best
-        return contigs
+        if self.search == 'enumerate':
+            return self.enumerate_contig(head, self.max_paths, dag)
+        return self.best_contig(head, dag)
 
     def cut_contigs(self, nodes):
-        """ Searching for the best not-overlapping contigs. """
+        """ Searching for the best not-overlapping contigs in the given
+            Overlay, the graph itself is not changed. Heads are the
+            nodes without parents, or, if none of them gives a contig (or
+            there are none), the nodes with the highest difference between
+            the number of children and parents. In every round the best
+            contig of all heads is taken and its nodes are removed.
+            The best contig of a node depends only on the nodes reachable
+            from it, so it is kept until one of them is removed. Contigs
+            of both kinds of heads are kept in heaps, the head set and the
+            groups of nodes with the same difference are kept up to date. """
+
+        self.view = nodes
+        self.position = {n: i for i, n in enumerate(nodes.values())}
+        self.candidates = {}  # node -> its best contig and reachable nodes
+        self.reached = {}  # node -> nodes whose search reached it
+        self.heaps = {}  # 'heads' or difference -> heap of contigs
+        self.balance = {}  # node -> its difference
+        self.groups = {}  # difference -> nodes
+        self.serial = count()
+        self.searches = 0  # number of contig searches, kept after the search
+        heads = {n for n in nodes.values() if nodes.nparents[n] == 0}
+        for n in nodes.values():
+            self.regroup(n)
 
         altcontigs = False
-        contigs = False
-        cc = True
-        i = 1
-        while cc != contigs:
-            cc = contigs
-            heads = [n for n in nodes.values() if len(n.parents) == 0]
-            if len(heads) == 0 or altcontigs:
-                if nodes:
-                    maks = max([len(n.children)-len(n.parents) for n in nodes.values()])
-                    heads = [n for n in nodes.values() if len(n.children)-len(n.parents) == maks]
-                else:
+        current = None
+        changed = set()  # nodes which lost their contig or changed group
+        while True:
+            if heads and not altcontigs:
+                group, members = 'heads', heads
+            elif nodes:
+                group = max(self.groups)
+                members = self.groups[group]
+            else:
+                break
+            if group != current:
+                current = group
+                todo = [n for n in members if n not in self.candidates]
+            else:
+                todo = [n for n in changed if n in members and n not in self.candidates]
+            for n in todo:
+                self.update_candidate(n)
+            best = self.pop_candidate(group)
+            if best is None:
+                if altcontigs:
                     break
-            contigs = self.find_contigs(heads)
-            if not contigs:
                 altcontigs = True
-                i += 1
                 continue
-            maks = max([len(el.seq)*el.weight for el in contigs.values()])
-            k = [kk for kk in contigs.keys() if len(contigs[kk].seq)*contigs[kk].weight == maks][0]
-            self.contigs.append(contigs[k])
-            for n in contigs[k].path:
-                nn = nodes[n.km1mer]
-                for ch in nn.children:
-                    del (nodes[ch.km1mer].parents[nn])
-                for pa in nn.parents:
-                    del (nodes[pa.km1mer].children[nn])
-                del (nodes[nn.km1mer])
-            i += 1
+
+            self.contigs.append(best)
+            removed = best.path
+            for n in removed:
+                nodes.remove(n)
+
+            changed = set()
+            for nn in removed:
+                changed.update(nn.children)
+                changed.update(nn.parents)
+                for node in self.reached.pop(nn, ()):
+                    self.drop_candidate(node)
+                    changed.add(node)
+                self.drop_candidate(nn)
+                self.groups[self.balance.pop(nn)].discard(nn)
+                heads.discard(nn)
+            changed.difference_update(removed)
+            for n in changed:
+                if n in self.balance:
+                    self.regroup(n)
+                    if nodes.nparents[n] == 0:
+                        heads.add(n)
+                    self.push_candidate(n)
+            for g in [g for g, m in self.groups.items() if not m]:
+                del (self.groups[g])
+        self.view = None
+        del self.position, self.candidates, self.reached, self.heaps, self.balance, self.groups, self.serial
+
+    def regroup(self, node):
+        """ Move the node into the group of its current difference. """
+
+        balance = self.view.nchildren[node] - self.view.nparents[node]
+        old = self.balance.get(node)
+        if old != balance:
+            if old is not None:
+                self.groups[old].discard(node)
+            self.balance[node] = balance
+            self.groups.setdefault(balance, set()).add(node)
+
+    def update_candidate(self, node):
+        """ Find the best contig of the node and remember which nodes
+            the search reached. """
+
+        self.searches += 1
+        dag = self.dag(node)
+        self.candidates[node] = (self.head_contig(node, dag), dag[0])
+        for n in dag[0]:
+            self.reached.setdefault(n, set()).add(node)
+        self.push_candidate(node)
+
+    def drop_candidate(self, node):
+        """ Forget the best contig of the node. """
+
+        contig, reached = self.candidates.pop(node, (None, ()))
+        for n in reached:
+            if n in self.reached:
+                self.reached[n].discard(node)
+
+    def push_candidate(self, node):
+        """ Put the best contig of the node into heaps of the groups the
+            node is in now. Entries become stale when the contig or
+            the groups change, they are skipped in pop_candidate. """
+
+        contig = self.candidates.get(node, (None,))[0]
+        if contig is None:
+            return
+        entry = (-contig.length * contig.weight, self.position[node], next(self.serial), contig, node)
+        heapq.heappush(self.heaps.setdefault(self.balance[node], []), entry)
+        if self.view.nparents[node] == 0:
+            heapq.heappush(self.heaps.setdefault('heads', []), entry)
+
+    def pop_candidate(self, group):
+        """ Return the best contig of the group (or None), ties are won
+            by the first node. """
+
+        heap = self.heaps.get(group, [])
+        while heap:
+            contig, node = heap[0][3:]
+            if self.candidates.get(node, (None,))[0] is contig and \
+                    (self.view.nparents[node] == 0 if group == 'heads' else self.balance[node] == group):
+                heapq.heappop(heap)
+                return contig
+            heapq.heappop(heap)
+        return None
+
+    def save(self, path):
+        """ Save the graph into a binary checkpoint file: packed names of
+            nodes, their adjacency arrays and weights (see save_graph).
+            It can be saved any time after the graph is built. """
+
+        save_graph(self, path)
+
+    @classmethod
+    def load(cls, path, name, output=None, verbose=False, search='dp', max_paths=10000, recorder=None):
+        """ Read the graph from the checkpoint file, its arrays are mapped
+            into memory (checkpoint.arrays) and its nodes read from them
+            when they are used (see Checkpoint), so the graph can be
+            searched for contigs, but not changed. Other arguments are
+            those of __init__, k and thresholds come from the file. """
+
+        checkpoint = Checkpoint(path)
+        graph = cls.__new__(cls)
+        graph.setup(checkpoint.k, checkpoint.rare_thresh, name, output, verbose, search, max_paths, recorder)
+        with graph.recorder.stage('load', graph.k) as record:
+            graph.checkpoint = checkpoint
+            graph.nodes = checkpoint
+            graph.measure(record)
+        return graph
+
+    @classmethod
+    def resume(cls, path, name, output=None, verbose=False, search='dp', max_paths=10000, recorder=None):
+        """ Load the graph from the checkpoint file, search its contigs
+            and write them into the output file. Return the graph. """
+
+        graph = cls.load(path, name, output, verbose, search, max_paths, recorder)
+        with graph.recorder.stage('search', graph.k) as record:
+            graph.search_contigs()
+            graph.measure(record, heads=len(graph.head), solo=len(graph.solo), searches=graph.searches,
+                          contigs=len(graph.contigs))
+        with graph.recorder.stage('output', graph.k, chosen=True) as record:
+            graph.contigs_to_file()
+            if record is not None:
+                record['contigs'] = len(graph.contigs)
+        return graph
 
     def to_dot(self):
         """ Write dot representation to given filehandle.  If 'weights'
@@ -356,17 +983,11 @@ class DeBruijnGraph:
         dotFh.close()
 
     def to_csv(self):
+        """ Write the edges with their weights into a tab separated table. """
 
         file = open('%s_table.csv' % self.name, 'w')
         file.write('Source\tTarget\tweight\n')
-        edges = {}
-        for g in self.G:
-            for gg in self.G[g]:
-                if g not in edges:
-                    edges[g] = [gg, 1]
-                else:
-                    edges[g][1] += 1
-
-        for k in edges.keys():
-            file.write('%s\t%s\t%d\n' % (k, edges[k][0], edges[k][1]))
+        for src in self.nodes.values():
+            for dst, v in src.children.items():
+                file.write('%s\t%s\t%d\n' % (src.km1mer, dst.km1mer, v))
         file.close()
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+RSS_UNIT = 1 << 20 if sys.platform == 'darwin' else 1 << 10
+
+
+def peak_rss():
+    """ Return the peak resident set size of this process in megabytes, or None. """
+
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RSS_UNIT
+
+
+class Recorder:
+    """ Measurements of the stages of the assembly written as JSON lines
+        into the file trace: name of the stage, k, wall time, peak RSS
+        of the process after the stage and counts added by the stage.
+        Every record is written with one append, so processes of a sweep
+        can share the file. If profile is a directory, every stage runs
+        under cProfile and its stats are dumped into that directory as
+        <stage>_k<k>_<pid>.prof. Without trace and profile the recorder
+        does nothing and stages get None instead of a record. """
+
+    def __init__(self, trace=None, profile=None):
+        self.trace = trace
+        self.profile = profile
+        if profile is not None:
+            os.makedirs(profile, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.trace is not None or self.profile is not None
+
+    @contextmanager
+    def stage(self, name, k=None, **fields):
+        """ Measure the stage run in the with block. The block gets the
+            record (a dict), into which it can put its counts. """
+
+        if not self.enabled:
+            yield None
+            return
+        record = {'stage': name, 'k': k}
+        record.update(fields)
+        profiler = cProfile.Profile() if self.profile is not None else None
+        start = time.time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['time'] = round(time.time() - start, 6)
+            record['peak_rss'] = peak_rss()
+            record['pid'] = os.getpid()
+            if profiler is not None:
+                profiler.dump_stats(os.path.join(self.profile, '%s_k%s_%d.prof' % (name, k, os.getpid())))
+            self.emit(record)
+
+    def emit(self, record):
+        """ Append the record to the trace file. """
+
+        if self.trace is None:
+            return
+        with open(self.trace, 'a') as f:
+            f.write(json.dumps(record) + '\n')
@@ -0,0 +1,560 @@
+from fasta import ReadStore
+from itertools import chain
+import numpy as np
+import warnings
+import math
+
+ALPHABET = 'ACGT'
+
+# maps every byte to its 2-bit code, anything outside ACGT to 4
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _i, _c in enumerate(ALPHABET):
+    _CODES[ord(_c)] = _i
+    _CODES[ord(_c.lower())] = _i
+_LETTERS = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+_DIGITS = str.maketrans('ACGTacgt', '01230123')
+_COMPLEMENT = str.maketrans('ACGTacgt', 'TGCAtgca')
+# reverse complement of every byte of 4 packed bases
+_REVCOMP = [int(''.join(str(3 - (b >> 2 * j) & 3) for j in range(4)), 4) for b in range(256)]
+# odd multiplier of multiply-shift hashing
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def encode(kmer):
+    """ Pack a k-mer string into an integer, two bits per base.
+        Return None if the k-mer contains a character outside ACGT. """
+
+    try:
+        return int(kmer.translate(_DIGITS), 4)
+    except ValueError:
+        return None
+
+
+def decode(code, k):
+    """ Unpack an integer into a k-mer string. """
+
+    return ''.join(ALPHABET[(int(code) >> 2 * (k - 1 - j)) & 3] for j in range(k))
+
+
+def decode_all(codes, k):
+    """ Unpack an array of integers into a list of k-mer strings. """
+
+    codes = np.asarray(codes, dtype=np.uint64)
+    if len(codes) == 0:
+        return []
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    letters = _LETTERS[(codes[:, None] >> shifts) & np.uint64(3)]
+    return [s.decode() for s in letters.view('S%d' % k).ravel()]
+
+
+def decode_last(codes):
+    """ Return the string of last bases of all given packed k-mers. """
+
+    codes = np.asarray(codes, dtype=np.uint64)
+    return _LETTERS[codes & np.uint64(3)].tobytes().decode()
+
+
+def reverse_complement(code, k):
+    """ Return the packed reverse complement of the packed k-mer. """
+
+    nbytes = (k + 3) // 4
+    result = 0
+    for _ in range(nbytes):
+        result = (result << 8) | _REVCOMP[code & 255]
+        code >>= 8
+    return result >> 2 * (4 * nbytes - k)
+
+
+def reverse_complements(codes, k):
+    """ Return packed reverse complements of all given packed k-mers.
+        Complement of a base is 3 - base, so all bits are negated, and
+        2-bit groups are reversed by swapping halves of ever larger
+        groups, the highest bits (complements of padding) are dropped. """
+
+    codes = ~np.asarray(codes, dtype=np.uint64)
+    for shift, mask in ((2, 0x3333333333333333), (4, 0x0F0F0F0F0F0F0F0F)):
+        shift, mask = np.uint64(shift), np.uint64(mask)
+        codes = ((codes >> shift) & mask) | ((codes & mask) << shift)
+    return codes.byteswap() >> np.uint64(64 - 2 * k)
+
+
+def canonical_codes(codes, k):
+    """ Return canonical forms of packed k-mers: the smaller of the
+        k-mer and its reverse complement. """
+
+    codes = np.asarray(codes, dtype=np.uint64)
+    return np.minimum(codes, reverse_complements(codes, k))
+
+
+def reverse_complement_read(read):
+    """ Return the reverse complement of the read string, bases outside
+        ACGT are kept. """
+
+    return read.translate(_COMPLEMENT)[::-1]
+
+
+def all_neighbor_codes(codes, k):
+    """ Return the matrix of packed k-mers at Hamming distance 1 from
+        the given ones, one row for every k-mer, in the order of
+        neighbors1mm: from the last position to the first one,
+        substitutions in alphabetical order. """
+
+    codes = np.asarray(codes, dtype=np.uint64)[:, None, None]
+    shifts = np.arange(0, 2 * k, 2, dtype=np.uint64)[:, None]
+    bases = np.arange(4, dtype=np.uint64)[None, :]
+    old = (codes >> shifts) & np.uint64(3)
+    neighbors = (codes & ~(np.uint64(3) << shifts)) | (bases << shifts)
+    return neighbors[np.broadcast_to(bases != old, neighbors.shape)].reshape(len(codes), 3 * k)
+
+
+def sequence_codes(reads):
+    """ Return 2-bit codes of all reads (list or ReadStore) joined into one
+        array. Reads are separated by an invalid code (4), so no window
+        crosses two reads. """
+
+    if isinstance(reads, ReadStore):
+        joined = reads.data
+    else:
+        if isinstance(reads, str):
+            reads = [reads]
+        joined = '\n'.join(reads).encode()
+    return _CODES[np.frombuffer(joined, dtype=np.uint8)]
+
+
+def packed_windows(codes, k):
+    """ Return packed integers of all k-long windows of given codes and
+        the mask of windows which contain only valid bases. The windows
+        are packed by doubling their length, so it takes log(k) passes. """
+
+    if k > 32:
+        raise ValueError('k-mers longer than 32 bases do not fit into 64 bits')
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = invalid[k:] - invalid[:-k] == 0
+
+    piece = np.where(codes == 4, 0, codes).astype(np.uint64)
+    width = 1
+    result = None
+    length = 0
+    while True:
+        if k & width:
+            if result is None:
+                result = piece.copy()
+            else:
+                result = (result[:len(piece) - length] << np.uint64(2 * width)) | piece[length:]
+            length += width
+        if width * 2 > k:
+            break
+        piece = (piece[:-width] << np.uint64(2 * width)) | piece[width:]
+        width *= 2
+    return result[:n], valid
+
+
+def read_offsets(reads):
+    """ Return positions of the reads (list or ReadStore) in their
+        sequence_codes, followed by the length of the codes plus one. """
+
+    if isinstance(reads, ReadStore):
+        return reads.offsets
+    return np.cumsum([0] + [len(read) + 1 for read in reads])
+
+
+def read_batches(reads, batch_size=1 << 22):
+    """ Yield ranges (start, end) of indices of consecutive reads, about
+        batch_size bases each. """
+
+    offsets = read_offsets(reads)
+    start = 0
+    while start < len(offsets) - 1:
+        end = int(np.searchsorted(offsets, offsets[start] + batch_size, side='right')) - 1
+        end = min(max(end, start + 1), len(offsets) - 1)
+        yield start, end
+        start = end
+
+
+def range_codes(reads, start, end):
+    """ Return 2-bit codes of reads[start:end] (see sequence_codes). """
+
+    if isinstance(reads, ReadStore):
+        data = memoryview(reads.data)[reads.offsets[start]:reads.offsets[end]]
+        return _CODES[np.frombuffer(data, dtype=np.uint8)]
+    return sequence_codes(reads[start:end])
+
+
+def code_batches(reads, batch_size=1 << 22):
+    """ Yield 2-bit codes of the reads (list or ReadStore) in batches of
+        whole reads, about batch_size bases each (see sequence_codes). """
+
+    if isinstance(reads, str):
+        reads = [reads]
+    for start, end in read_batches(reads, batch_size):
+        yield range_codes(reads, start, end)
+
+
+def minimizers(kmers, k, m):
+    """ Return minimizers of the packed k-mers: the smallest hash of
+        their m-mers. The m-mers are hashed by multiplication with an odd
+        constant, so the order is not the lexicographic one. """
+
+    kmers = np.asarray(kmers, dtype=np.uint64)
+    mask = np.uint64((1 << 2 * m) - 1)
+    result = np.full(len(kmers), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for shift in range(0, 2 * (k - m) + 1, 2):
+        np.minimum(result, ((kmers >> np.uint64(shift)) & mask) * _MIX, out=result)
+    return result
+
+
+class KmerHist:
+    """ Histogram of k-mers stored as two sorted arrays: packed
+        k-mers and their counts. It can be queried like a dict with
+        k-mer strings or with packed integers. A canonical histogram
+        stores canonical k-mers, which count both strands, and a k-mer
+        is looked up through its canonical form. """
+
+    def __init__(self, k, kmers, counts, canonical=False):
+        self.k = k
+        self.kmers = kmers
+        self.counts = counts
+        self.canonical = canonical
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def __contains__(self, kmer):
+        return self.get(kmer, 0) > 0
+
+    def __getitem__(self, kmer):
+        count = self.get(kmer, None)
+        if count is None:
+            raise KeyError(kmer)
+        return count
+
+    def index(self, codes):
+        """ Return positions of packed k-mers in the histogram and
+            the mask of k-mers which are present. """
+
+        codes = np.asarray(codes, dtype=np.uint64)
+        if self.canonical:
+            codes = canonical_codes(codes, self.k)
+        idx = np.searchsorted(self.kmers, codes)
+        idx[idx == len(self.kmers)] = 0
+        found = self.kmers[idx] == codes if len(self.kmers) else np.zeros(len(codes), dtype=bool)
+        return idx, found
+
+    def lookup(self, codes):
+        """ Return counts of all given packed k-mers (0 if absent). """
+
+        idx, found = self.index(codes)
+        if not len(self.kmers):
+            return np.zeros(len(found), dtype=np.int64)
+        return np.where(found, self.counts[idx], 0)
+
+    def get(self, kmer, default=0):
+        if isinstance(kmer, str):
+            if len(kmer) != self.k:
+                return default
+            kmer = encode(kmer)
+            if kmer is None:
+                return default
+        if self.canonical:
+            kmer = min(kmer, reverse_complement(kmer, self.k))
+        i = int(self.kmers.searchsorted(np.uint64(kmer)))
+        if i < len(self.kmers) and int(self.kmers[i]) == kmer:
+            return int(self.counts[i])
+        return default
+
+    def keys(self):
+        return iter(decode_all(self.kmers, self.k))
+
+    def values(self):
+        return iter(self.counts.tolist())
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def spectrum(self):
+        """ Return the count histogram: number of k-mers seen exactly
+            i times is on the i-th position. """
+
+        return np.bincount(self.counts)
+
+    def threshold(self):
+        """ Return floor(mean - stdev) of k-mer counts (but at least 0),
+            computed from the count histogram. """
+
+        spectrum = self.spectrum()
+        c = np.arange(len(spectrum))
+        n = int(spectrum.sum())
+        if n == 0:
+            return 0
+        s = int((c * spectrum).sum())
+        q = int((c * c * spectrum).sum())
+        sd = math.sqrt((n * q - s * s) / (n * (n - 1))) if n > 1 else 0
+        return max(math.floor(s / n - sd), 0)
+
+    def rare(self, thresh):
+        """ Return packed k-mers seen at most thresh times. """
+
+        return self.kmers[self.counts <= thresh]
+
+    def both_strands(self, codes):
+        """ Return the packed k-mers together with their reverse complements
+            if the histogram is canonical, otherwise the k-mers. """
+
+        if self.canonical:
+            return np.concatenate((codes, reverse_complements(codes, self.k)))
+        return codes
+
+    def rare_side_codes(self, thresh):
+        """ Return sorted arrays of packed left and right k-1-mers of
+            rare k-mers. """
+
+        rare = self.both_strands(self.rare(thresh))
+        mask = np.uint64((1 << 2 * (self.k - 1)) - 1)
+        return np.unique(rare >> np.uint64(2)), np.unique(rare & mask)
+
+    def rare_sides(self, thresh):
+        """ Return sets of left and right k-1-mers of rare k-mers. """
+
+        left, right = self.rare_side_codes(thresh)
+        return set(decode_all(left, self.k - 1)), set(decode_all(right, self.k - 1))
+
+
+class SketchHist(KmerHist):
+    """ Histogram of k-mers seen at least twice (see count_kmers_sketch).
+        K-mers seen once are not stored, so their count is 0 and only
+        their number is kept for the spectrum. When rare k-mers are
+        needed, the ones seen once are found again in the reads: they
+        are the k-mers of the reads missing from the histogram. """
+
+    def __init__(self, k, kmers, counts, reads, singletons, batch_size=1 << 22, canonical=False):
+        super().__init__(k, kmers, counts, canonical)
+        self.reads = reads
+        self.singletons = singletons
+        self.batch_size = batch_size
+
+    def spectrum(self):
+        spectrum = np.bincount(self.counts, minlength=2)
+        spectrum[1] += self.singletons
+        return spectrum
+
+    def single(self):
+        """ Yield arrays of packed k-mers seen once, batch by batch. """
+
+        for codes in code_batches(self.reads, self.batch_size):
+            windows, valid = packed_windows(codes, self.k)
+            windows = windows[valid]
+            if self.canonical:
+                windows = canonical_codes(windows, self.k)
+            yield windows[~self.index(windows)[1]]
+
+    def rare(self, thresh):
+        """ Return packed k-mers seen at most thresh times. The ones seen
+            once are all listed, use rare_side_codes for their sides. """
+
+        rare = super().rare(thresh)
+        if thresh < 1:
+            return rare
+        return np.unique(np.concatenate([rare] + list(self.single())))
+
+    def rare_side_codes(self, thresh, km1mers=None):
+        """ Return sides as KmerHist.rare_side_codes does, only the ones
+            among the sorted, packed km1mers if they are given, so sides
+            of k-mers seen once are not all kept. """
+
+        if km1mers is None or thresh < 1:
+            return super().rare_side_codes(thresh)
+        mask = np.uint64((1 << 2 * (self.k - 1)) - 1)
+        lefts, rights = [], []
+        for rare in chain([super().rare(thresh)], self.single()):
+            rare = self.both_strands(rare)
+            left, right = rare >> np.uint64(2), rare & mask
+            lefts.append(np.unique(left[np.isin(left, km1mers)]))
+            rights.append(np.unique(right[np.isin(right, km1mers)]))
+        return np.unique(np.concatenate(lefts)), np.unique(np.concatenate(rights))
+
+    def rare_sides(self, thresh, km1mers=None):
+        """ Return sets of left and right k-1-mers of rare k-mers, only
+            the ones among the km1mers (strings) if they are given. """
+
+        if km1mers is not None:
+            km1mers = np.unique(np.array([c for c in map(encode, km1mers) if c is not None], dtype=np.uint64))
+        left, right = self.rare_side_codes(thresh, km1mers)
+        return set(decode_all(left, self.k - 1)), set(decode_all(right, self.k - 1))
+
+
+class BloomFilter:
+    """ Set of packed k-mers kept in a bit array of the given memory
+        (in bytes, rounded down to a power of two). It may answer that
+        a k-mer is present although it was never added, with probability
+        of about fp_rate while it holds at most capacity k-mers, but never
+        the other way round. Bits of a k-mer are chosen by double hashing
+        with multiply-shift hashes. """
+
+    MULTIPLIERS = (_MIX, np.uint64(0xC2B2AE3D27D4EB4F))
+
+    def __init__(self, memory, fp_rate=0.01):
+        self.size = max(int(memory) * 8, 64).bit_length() - 1  # log2 of the number of bits
+        self.bits = np.zeros(1 << (self.size - 3), dtype=np.uint8)
+        self.hashes = max(int(round(-math.log2(fp_rate))), 1)
+        self.capacity = int((1 << self.size) * math.log(2) ** 2 / -math.log(fp_rate))
+        self.fp_rate = fp_rate
+        self.added = 0  # number of k-mers added, some may have been added twice
+
+    def positions(self, codes):
+        """ Yield bit positions of the packed k-mers, one array for every hash. """
+
+        codes = np.asarray(codes, dtype=np.uint64)
+        h1 = codes * self.MULTIPLIERS[0]
+        h2 = (codes * self.MULTIPLIERS[1]) | np.uint64(1)
+        shift = np.uint64(64 - self.size)
+        for _ in range(self.hashes):
+            yield h1 >> shift
+            h1 = h1 + h2
+
+    def add(self, codes):
+        """ Add the packed k-mers to the set. """
+
+        self.added += len(codes)
+        for pos in self.positions(codes):
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), np.left_shift(1, pos & np.uint64(7)).astype(np.uint8))
+
+    def memory_for(self, count):
+        """ Return memory in bytes (a power of two) of a filter which
+            holds count k-mers with the false positive rate of this one. """
+
+        bits = max(count * -math.log(self.fp_rate) / math.log(2) ** 2, 64)
+        return 1 << int(math.ceil(math.log2(bits))) - 3
+
+    def contains(self, codes):
+        """ Return the mask of the packed k-mers which may be present. """
+
+        present = np.ones(len(codes), dtype=bool)
+        for pos in self.positions(codes):
+            present &= ((self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7))) & 1).astype(bool)
+        return present
+
+
+def count_kmers_codes(codes, k, canonical=False):
+    """ Count all k-mers (or canonical k-mers) from the given array of 2-bit codes. """
+
+    windows, valid = packed_windows(codes, k)
+    windows = windows[valid]
+    if canonical:
+        windows = canonical_codes(windows, k)
+    kmers, counts = np.unique(windows, return_counts=True)
+    return KmerHist(k, kmers, counts, canonical)
+
+
+def count_kmers(reads, k, canonical=False):
+    """ Count all k-mers (or canonical k-mers) from the given reads. """
+
+    return count_kmers_codes(sequence_codes(reads), k, canonical)
+
+
+def count_kmers_sketch(reads, k, memory, fp_rate=0.01, batch_size=1 << 22, canonical=False):
+    """ Count k-mers of the given reads which are seen at least twice,
+        in batches of about batch_size bases. The first occurrence of a
+        k-mer is only added to a Bloom filter of memory bytes and it is
+        counted exactly once the filter has seen it, so the histogram
+        grows with the genome and not with the number of errors. A k-mer
+        seen once is counted twice with probability of about fp_rate
+        (for the filter holding at most its capacity, a warning is given
+        when it holds more). Return SketchHist. """
+
+    bloom = BloomFilter(memory, fp_rate)
+    kmers = np.zeros(0, dtype=np.uint64)
+    counts = np.zeros(0, dtype=np.int64)
+    singletons = 0
+    for codes in code_batches(reads, batch_size):
+        windows, valid = packed_windows(codes, k)
+        windows = windows[valid]
+        if canonical:
+            windows = canonical_codes(windows, k)
+        new_kmers, new_counts = np.unique(windows, return_counts=True)
+        idx = np.searchsorted(kmers, new_kmers)
+        fresh = idx == len(kmers)
+        fresh[~fresh] = kmers[idx[~fresh]] != new_kmers[~fresh]
+        fresh = np.flatnonzero(fresh)
+
+        # k-mers seen once so far go to the filter, the others are counted
+        seen = bloom.contains(new_kmers[fresh])
+        once = ~seen & (new_counts[fresh] == 1)
+        bloom.add(new_kmers[fresh[once]])
+        singletons += int(once.sum()) - int(seen.sum())
+        new_counts[fresh[seen]] += 1
+        counted = np.ones(len(new_kmers), dtype=bool)
+        counted[fresh[once]] = False
+        kmers, counts = add_counts(kmers, counts, new_kmers[counted], new_counts[counted])
+    if bloom.added > bloom.capacity:
+        warnings.warn('Bloom filter holds %d k-mers, over its capacity of %d, so more k-mers seen once are counted; '
+                      'about %d MB would hold them' % (bloom.added, bloom.capacity,
+                                                       -(-bloom.memory_for(bloom.added) >> 20)))
+    return SketchHist(k, kmers, counts, reads, singletons, batch_size, canonical)
+
+
+def reduce_counts(kmers, counts, first=None):
+    """ Add counts of equal packed k-mers, their first occurrence is the
+        smallest one. Return sorted distinct k-mers, their counts and
+        first occurrences (None if not given). """
+
+    order = np.argsort(kmers, kind='stable')
+    kmers = kmers[order]
+    starts = np.flatnonzero(np.concatenate(([True], kmers[1:] != kmers[:-1]))) if len(kmers) else order
+    counts = np.add.reduceat(counts[order], starts) if len(kmers) else counts
+    if first is not None:
+        first = np.minimum.reduceat(first[order], starts) if len(kmers) else first
+    return kmers[starts], counts, first
+
+
+def add_counts(kmers, counts, new_kmers, new_counts):
+    """ Add counts of sorted, unique new_kmers to the sorted histogram
+        arrays (kmers, counts). Return new arrays. """
+
+    idx = np.searchsorted(kmers, new_kmers)
+    found = idx < len(kmers)
+    found[found] = kmers[idx[found]] == new_kmers[found]
+    counts = counts.copy()
+    np.add.at(counts, idx[found], new_counts[found])
+    missing = ~found
+    return np.insert(kmers, idx[missing], new_kmers[missing]), np.insert(counts, idx[missing], new_counts[missing])
+
+
+def count_kmers_range(reads, ks):
+    """ Count k-mers for every k from ks walking the reads once. Only the
+        longest k-mers are packed and sorted, counts of every shorter
+        k-1-mer are derived from them: it is the sum of counts of k-mers
+        which start with it, plus the number of reads (or ACGT-only
+        stretches) which end with it. Return dict of KmerHist objects. """
+
+    ks = sorted(set(ks))
+    if not ks:
+        return {}
+    codes = sequence_codes(reads)
+    hist = count_kmers_codes(codes, ks[-1])
+    hists = {hist.k: hist}
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    # positions right after the ends of ACGT-only stretches
+    stops = np.concatenate((np.flatnonzero(codes == 4), [len(codes)]))
+    for k in range(ks[-1] - 1, ks[0] - 1, -1):
+        # prefixes of sorted k+1-mers are sorted as well
+        prefixes = hist.kmers >> np.uint64(2)
+        starts = np.flatnonzero(np.concatenate(([True], prefixes[1:] != prefixes[:-1]))) if len(prefixes) else \
+            np.zeros(0, dtype=np.int64)
+        kmers, counts = prefixes[starts], np.add.reduceat(hist.counts, starts) if len(starts) else hist.counts
+
+        # k-mers which are not followed by a valid base
+        ends = stops[stops >= k] - k
+        ends = ends[invalid[ends + k] == invalid[ends]]
+        packed = np.zeros(len(ends), dtype=np.uint64)
+        for j in range(k):
+            packed = (packed << np.uint64(2)) | codes[ends + j].astype(np.uint64)
+        tails, tail_counts = np.unique(packed, return_counts=True)
+
+        kmers, counts = add_counts(kmers, counts, tails, tail_counts)
+        hist = KmerHist(k, kmers, counts)
+        if k in ks:
+            hists[k] = hist
+    return hists
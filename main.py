@@ -1,84 +1,158 @@
-from graph import *
-from error_correction import *
-import sys
-
-
-def reads_from_file(file):
-    """
-    Saving reads from the fasta file to a list.
-    :param file: object of the open fasta file
-    :return: list of the reads
-    """
-
-    reads = []
-    for line in file:
-        if not line.startswith('>'):
-            reads.append(line.strip())
-    file.close()
-    return reads
-
-
-def build_up(reads, k):
-    """
-    Removing errors from the given reads, establishing list of tentative kmers.
-    :param reads: list of input reads
-    :param k: size of k-mers
-    :return:
-    new_reads - list of corrected reads,
-    wrong_kmers - list of tentative kmers,
-    thresh - threshold of kmers coverage
-    """
-
-    khist, thresh = kmerHist(reads, k)
-    new_reads = remove_errors(reads, k, khist)
-    wrong_kmers = rare_kmers(khist, thresh)
-
-    return new_reads, wrong_kmers, thresh
-
-
-# Change recursion limit
-sys.setrecursionlimit(8000)
-
-if len(sys.argv) == 3:
-    input = sys.argv[1]
-    output = sys.argv[2]
-elif len(sys.argv) == 2:
-    input = sys.argv[1]
-else:
-    read = 5
-    input = './reads/reads%d.fasta' % read
-
-name = input.split('/')[-1].split('.fasta')[0]
-if 'output' not in globals():
-    output = './%s_contigs.fasta' % name
-
-n = 0
-bestk = 0
-reads = reads_from_file(open(input, 'r'))
-ref = 0
-for r in reads:
-    ref += len(r)
-ref /= 5
-
-# looking for the optimal k value
-for k in range(15, 24):
-    new_reads, wrong_kmers, thresh = build_up(reads, k)
-    try:
-        graph = DeBruijnGraph(new_reads, k, wrong_kmers, thresh, name, output)
-    except RecursionError:
-        print('Recursion error for k = %d' % k)
-        continue
-    mark = sum([len(c.seq) for c in graph.contigs])/(ref*math.log(4+len(graph.contigs), 5))
-    print('Found %d contigs for k = %d, mark = %.3f' % (len(graph.contigs), k, mark))
-    if mark >= n:
-        n = mark
-        bestk = k
-        bestgraph = graph
-
-print('Best k = %d' % bestk)
-bestgraph.contigs_to_file()
-print('Contigs saved!')
-
-
-# if you want to save the best graph into dot file
-# prev_graph.to_dot()
+from fasta import load_reads
+from graph import DeBruijnGraph, contigs_to_file
+from accumulate import assemble_accumulated
+from instrument import Recorder
+from pipeline import K_RANGE, assemble, batch, read_manifest, sample_name
+from sweep import BACKENDS
+import argparse
+import time
+
+
+def positive(value):
+    """ Parse a number of at least 1, for argparse. """
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('%s is not a positive number' % value)
+    return number
+
+
+parser = argparse.ArgumentParser(description='Assembly of single-end DNA reads.')
+parser.add_argument('input', nargs='?', help='fasta file with reads')
+parser.add_argument('output', nargs='?', help='fasta file for contigs (default: ./<input name>_contigs.fasta)')
+parser.add_argument('-m', '--mmap', action='store_true', help='map the input file into memory instead of reading it')
+parser.add_argument('-w', '--workers', type=int, default=1,
+                    help='number of processes checking k values in parallel (in batch mode: assembling samples)')
+parser.add_argument('-a', '--adaptive', action='store_true',
+                    help='assemble only the k values with the highest ratio of solid k-mers')
+parser.add_argument('-c', '--candidates', type=positive, default=3, help='number of k values checked in adaptive mode')
+parser.add_argument('-e', '--early-stop', action='store_true',
+                    help='in adaptive mode stop checking k values once the mark drops more than 5%% below the best one')
+parser.add_argument('-b', '--backend', choices=sorted(BACKENDS), default='nodes',
+                    help='graph representation: Node objects, compact arrays (csr) or compact arrays built shard '
+                         'by shard by -j processes (partitioned)')
+parser.add_argument('-j', '--jobs', type=int, default=2,
+                    help='number of processes correcting reads of one k value (with -w 1) and building its graph '
+                         '(partitioned backend)')
+counting = parser.add_mutually_exclusive_group()
+counting.add_argument('-s', '--sketch', type=int, metavar='MB',
+                      help='count only k-mers seen twice, first occurrences go to a Bloom filter of MB megabytes')
+counting.add_argument('-M', '--memory', type=int, metavar='MB',
+                      help='count k-mers out of core, in sorted runs on disk, with about MB megabytes of RAM')
+parser.add_argument('-f', '--fp-rate', type=float, default=0.01, help='false positive rate of the Bloom filter')
+parser.add_argument('-C', '--canonical', action='store_true',
+                    help='count canonical k-mers, which join both strands, and turn reads to one strand')
+parser.add_argument('-g', '--checkpoint', metavar='DIR',
+                    help='save the merged graph of every k value into DIR as <input name>_k<k>.graph')
+parser.add_argument('-d', '--cache', metavar='DIR',
+                    help='cache k-mer counts and corrected reads of every k value in DIR, keyed by the input content')
+parser.add_argument('-D', '--cache-size', type=int, default=1024, metavar='MB',
+                    help='size of the cache, least recently used entries are evicted (default 1024)')
+parser.add_argument('-x', '--simplify', action='store_true',
+                    help='clip short low-coverage tips and pop bubbles of the merged graph before the contig search')
+parser.add_argument('--tip-length', type=int, metavar='N', help='longest tip clipped, in bases (default 2k)')
+parser.add_argument('--tip-coverage', type=float, default=0.5, metavar='R',
+                    help='tips covered less than R times the other branch are clipped (default 0.5)')
+parser.add_argument('--bubble-length', type=int, metavar='N',
+                    help='longest bubble branch and detour searched, in bases (default 3k)')
+parser.add_argument('--bubble-coverage', type=float, default=0.5, metavar='R',
+                    help='bubble branches covered less than R times the other path are popped (default 0.5)')
+parser.add_argument('-r', '--resume', metavar='FILE',
+                    help='search contigs of the graph saved in the checkpoint FILE instead of assembling reads, '
+                         'the only positional argument is then the output file')
+parser.add_argument('-B', '--batch', metavar='MANIFEST',
+                    help='assemble every sample of MANIFEST (lines: input fasta and optionally output) in one process, '
+                         'with -w workers, instead of the input file')
+parser.add_argument('-T', '--tasks-per-worker', type=int, metavar='N',
+                    help='in batch mode replace a worker after N samples, so it gives back memory it kept')
+parser.add_argument('-A', '--accumulate', metavar='DIR',
+                    help='incrementally add the input reads to the assembly kept in DIR (started if missing) and write '
+                         'contigs of all reads added so far, only the unitigs around the new reads are merged again')
+parser.add_argument('-t', '--trace', metavar='FILE',
+                    help='append time, peak memory and counts of every stage to FILE as JSON lines')
+parser.add_argument('-p', '--profile', metavar='DIR', help='profile every stage with cProfile, stats go to DIR')
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.accumulate:
+        ignored = [option for option, value in (('-C', args.canonical), ('-b', args.backend != 'nodes'),
+                                                ('-x', args.simplify), ('-s', args.sketch), ('-M', args.memory),
+                                                ('-a', args.adaptive), ('-w', args.workers != 1),
+                                                ('-g', args.checkpoint), ('-d', args.cache), ('-B', args.batch),
+                                                ('-r', args.resume)) if value]
+        if ignored:
+            parser.error('-A cannot be used with %s' % ', '.join(ignored))
+    if args.batch and args.resume:
+        parser.error('-B cannot be used with -r')
+    if args.resume:
+        ignored = [option for option, value in (('-x', args.simplify), ('-b', args.backend != 'nodes'),
+                                                ('-C', args.canonical), ('-a', args.adaptive),
+                                                ('-w', args.workers != 1), ('-s', args.sketch), ('-M', args.memory),
+                                                ('-d', args.cache), ('-g', args.checkpoint)) if value]
+        if ignored:
+            parser.error('-r cannot be used with %s' % ', '.join(ignored))
+    memory = args.memory << 20 if args.memory else None
+    recorder = Recorder(args.trace, args.profile)
+    options = {'adaptive': args.adaptive, 'candidates': args.candidates, 'early_stop': args.early_stop,
+               'backend': args.backend, 'memory': memory, 'jobs': args.jobs,
+               'sketch': args.sketch << 20 if args.sketch else None, 'fp_rate': args.fp_rate,
+               'canonical': args.canonical, 'checkpoints': args.checkpoint, 'cache': args.cache,
+               'cache_size': args.cache_size << 20, 'recorder': recorder}
+    if args.simplify:
+        options['simplify'] = {'tip_length': args.tip_length, 'tip_coverage': args.tip_coverage,
+                               'bubble_length': args.bubble_length, 'bubble_coverage': args.bubble_coverage}
+
+    if args.batch:
+        start = time.time()
+        done = 0
+        for summary in batch(read_manifest(args.batch), args.workers, args.tasks_per_worker, args.mmap, **options):
+            done += 1
+            if 'error' in summary:
+                print('Failed %s (%.2f s):\n%s' % (summary['input'], summary['time'], summary['error']))
+            else:
+                print('Assembled %s into %s: %d contigs for k = %d, mark = %.3f (%.2f s)' % (
+                    summary['input'], summary['output'], summary['contigs'], summary['k'], summary['mark'],
+                    summary['time']))
+        print('Assembled %d samples in %.2f s' % (done, time.time() - start))
+        return
+
+    input = args.input or './reads/reads5.fasta'
+    output = args.output
+    if args.resume:
+        input, output = args.resume, output or args.input
+    name = sample_name(input).split('.graph')[0]
+    if output is None:
+        output = './%s_contigs.fasta' % name
+
+    if args.resume:
+        start = time.time()
+        graph = DeBruijnGraph.resume(args.resume, name, output, recorder=recorder)
+        print('Found %d contigs for k = %d in %s (%.2f s)' % (len(graph.contigs), graph.k, args.resume,
+                                                             time.time() - start))
+        print('Contigs saved!')
+        return
+
+    with recorder.stage('input') as record:
+        reads = load_reads(input, use_mmap=args.mmap)
+        if record is not None:
+            record.update(reads=len(reads), bases=reads.total_length())
+
+    # looking for the optimal k value, kmers are counted for all k values at once
+    start = time.time()
+    if args.accumulate:
+        result = assemble_accumulated(reads, args.accumulate, name=name, output=output, recorder=recorder,
+                                      jobs=args.jobs, verbose=True)
+    else:
+        result = assemble(reads, name=name, output=output, workers=args.workers, verbose=True, **options)
+    print('Checked %d of %d k values in %.2f s' % (len(result.stats), len(K_RANGE), time.time() - start))
+    print('Best k = %d' % result.k)
+    with recorder.stage('output', result.k, chosen=True) as record:
+        contigs_to_file(result.contigs, output)
+        if record is not None:
+            record.update(contigs=len(result.contigs), length=sum(len(c) for c in result.contigs), mark=result.mark)
+    print('Contigs saved!')
+
+
+if __name__ == '__main__':
+    main()
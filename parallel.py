@@ -0,0 +1,29 @@
+import multiprocessing
+
+# state shared with the worker processes, set once per process by the
+# initializer of their pool; every module keeps its own part of it
+shared = {}
+
+
+def worker_state(module):
+    """ Return the part of the shared state kept by the module. """
+
+    return shared.setdefault(module, {})
+
+
+def can_start(processes):
+    """ Whether a pool of the given number of processes is worth
+        starting, daemonic processes (workers of another pool) can't
+        start their own. """
+
+    return processes > 1 and not multiprocessing.current_process().daemon
+
+
+def start_pool(processes, initializer, initargs=(), maxtasksperchild=None):
+    """ Return a pool of processes set up by the initializer. With the
+        fork start method (where it is available) the arguments are
+        inherited by the workers, not pickled. """
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return context.Pool(processes, initializer, initargs, maxtasksperchild)
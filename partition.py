@@ -0,0 +1,206 @@
+from csr_graph import CSRGraph
+from fasta import ReadStore
+from kmers import minimizers, packed_windows, range_codes, read_batches, read_offsets, reduce_counts
+from parallel import can_start, start_pool, worker_state
+import numpy as np
+
+# state shared with the worker processes
+shared = worker_state('partition')
+
+# length of m-mers whose minimizer puts a k-1-mer into a shard
+MINIMIZER = 11
+
+
+def init_worker(graph, reads):
+    """ Store the graph and the reads it is built from in the worker
+        process. """
+
+    shared['graph'] = graph
+    shared['reads'] = reads
+
+
+def split(shards, count, *columns):
+    """ Return the columns split into count lists by shards. """
+
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(count + 1))
+    columns = [column[order] for column in columns]
+    return [[column[a:b] for column in columns] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def count_batch(bounds):
+    """ Count k-mers of the shared reads from the range of indices. Split
+        them by the shard of their left k-1-mer, with first occurrences
+        and counts (out-edges of the shard), and by the shard of their
+        right k-1-mer, with first occurrences (in-edges of the shard). """
+
+    graph = shared['graph']
+    reads = shared['reads']
+    start, end = bounds
+    windows, valid = packed_windows(range_codes(reads, start, end), graph.k)
+    positions = np.flatnonzero(valid) + int(read_offsets(reads)[start])
+    kmers, index, counts = np.unique(windows[valid], return_index=True, return_counts=True)
+    first = positions[index]
+    out = split(graph.shard(kmers >> np.uint64(2)), graph.shards, kmers, first, counts)
+    into = split(graph.shard(kmers & graph.mask), graph.shards, kmers, first)
+    return list(zip(out, into))
+
+
+def reduce_shard(parts):
+    """ Add counts of one shard from all batches and number its nodes
+        (sorted k-1-mers). Return first occurrences and counts of its
+        sorted out-edges with the numbers of their sources and the
+        shards of their targets, numbers of the targets of its sorted
+        in-edges and the shards of their sources, the nodes, their
+        first occurrences (twice the position, plus one for right
+        k-1-mers), out-degrees and in-degrees. """
+
+    graph = shared['graph']
+    out, into = zip(*parts)
+    kmers, first, counts = [np.concatenate(column) for column in zip(*out)]
+    kmers, counts, first = reduce_counts(kmers, counts, first)
+    in_kmers, in_first = [np.concatenate(column) for column in zip(*into)]
+    in_kmers, _, in_first = reduce_counts(in_kmers, np.ones(len(in_kmers), dtype=np.int64), in_first)
+    nodes = np.unique(np.concatenate((kmers >> np.uint64(2), in_kmers & graph.mask)))
+    src = np.searchsorted(nodes, kmers >> np.uint64(2))
+    target = np.searchsorted(nodes, in_kmers & graph.mask)
+
+    time = np.full(len(nodes), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(time, src, 2 * first)
+    np.minimum.at(time, target, 2 * in_first + 1)
+    return (first, counts, src, graph.shard(kmers & graph.mask), target, graph.shard(in_kmers >> np.uint64(2)),
+            nodes, time, np.bincount(src, minlength=len(nodes)), np.bincount(target, minlength=len(nodes)))
+
+
+def sort_shard(edges):
+    """ Return ids of the in-edges of one shard sorted by their targets
+        (numbers in the shard), then by the ids. """
+
+    ids, target = edges
+    return ids[np.lexsort((ids, target))]
+
+
+class PartitionedGraph(CSRGraph):
+    """ CSRGraph built by a pool of worker processes. K-1-mers are split
+        into shards by their minimizers, a shard holds its nodes with
+        their out-edges and in-edges. Workers of one pool count k-mers
+        of batches of reads and split them into shards, reduce the
+        counts of every shard and number its nodes, and sort the
+        in-edges of every shard. Nodes of a shard get consecutive ids
+        (shards follow each other, within a shard they are sorted), so
+        the arrays of shards are only joined, and find looks nodes up
+        in their shards. Removing rare k-mers, cutting, merging and
+        searching for contigs run in one process as in CSRGraph: merging
+        depends on the order of the traversal from heads, so it is not
+        split. The contigs are the same. """
+
+    def __init__(self, strIter, k, wrong_kmers, thresh, name, output=None, workers=2, shards=None, **kwargs):
+        """ Arguments are those of CSRGraph, workers is the number of
+            processes and shards the number of minimizer shards (by
+            default four for every worker). """
+
+        self.workers = workers
+        self.shards = shards or 4 * workers
+        self.node_ptr = None
+        super().__init__(strIter, k, wrong_kmers, thresh, name, output, **kwargs)
+
+    def shard(self, km1mers):
+        """ Return shards of the packed k-1-mers. """
+
+        m = min(MINIMIZER, self.k - 1)
+        return ((minimizers(km1mers, self.k - 1, m) >> np.uint64(40)) % np.uint64(self.shards)).astype(np.int64)
+
+    def pool(self, reads):
+        """ Return a pool of workers sharing the graph and the reads, or
+            None when it can't be started (tasks are run in this process
+            then). """
+
+        if not can_start(self.workers):
+            init_worker(self, reads)
+            return None
+        return start_pool(self.workers, init_worker, (self, reads))
+
+    @staticmethod
+    def map(pool, function, items):
+        """ Map the function over the items in the pool (or in this
+            process when it is None). """
+
+        if pool is None:
+            return list(map(function, items))
+        return pool.map(function, items)
+
+    def build(self, strIter):
+        """ Build the arrays shard by shard in the worker processes, see
+            CSRGraph.build. K-mers counted out of core (with memory) are
+            not split, the arrays are built as in CSRGraph then. """
+
+        if not isinstance(strIter, (list, ReadStore)):
+            strIter = list(strIter)
+        if self.memory is not None:
+            return super().build(strIter)
+        self.mask = np.uint64((1 << 2 * (self.k - 1)) - 1)
+        pool = self.pool(strIter)
+        try:
+            self.build_shards(pool, strIter)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def build_shards(self, pool, strIter):
+        """ Build the arrays with the tasks run in the pool. """
+
+        total = int(read_offsets(strIter)[-1])
+        batches = list(read_batches(strIter, max(total // (4 * self.workers), 1 << 16)))
+        counted = self.map(pool, count_batch, batches)
+        shards = self.map(pool, reduce_shard, [[batch[s] for batch in counted] for s in range(self.shards)])
+        del counted
+        first, weight, src, into, target, source, nodes, time, outdeg, indeg = zip(*shards)
+        del shards
+
+        self.km1mers = np.concatenate(nodes)
+        self.node_ptr = np.concatenate(([0], np.cumsum([len(shard) for shard in nodes])))
+        self.edge_order = np.concatenate(first)
+        self.weight = np.concatenate(weight)
+        self.src = np.concatenate([ids + offset for ids, offset in zip(src, self.node_ptr)]).astype(np.int32)
+        # out-edges of shard s into shard t, sorted, are the in-edges of t from s, sorted
+        shard = np.arange(self.shards)
+        out_order = np.argsort(np.concatenate(into) * self.shards + np.repeat(shard, [len(ids) for ids in src]),
+                               kind='stable')
+        in_order = np.argsort(np.repeat(shard, [len(ids) for ids in target]) * self.shards + np.concatenate(source),
+                              kind='stable')
+        self.dst = np.empty(len(out_order), dtype=np.int32)
+        self.dst[out_order] = np.concatenate([ids + offset for ids, offset in zip(target, self.node_ptr)])[in_order]
+        edges = np.empty(len(out_order), dtype=np.int32)
+        edges[in_order] = out_order
+        in_bounds = np.cumsum([0] + [len(ids) for ids in target])
+        parts = [(edges[a:b], ids) for a, b, ids in zip(in_bounds[:-1], in_bounds[1:], target)]
+        self.in_edges = np.concatenate(self.map(pool, sort_shard, parts)).astype(np.int32)
+
+        outdeg, indeg = np.concatenate(outdeg), np.concatenate(indeg)
+        self.out_ptr = np.concatenate(([0], np.cumsum(outdeg)))
+        self.in_ptr = np.concatenate(([0], np.cumsum(indeg)))
+        self.outdeg = outdeg.astype(np.int32)
+        self.indeg = indeg.astype(np.int32)
+        self.alive = np.ones(len(self.km1mers), dtype=bool)
+        self.edge_alive = np.ones(len(self.weight), dtype=bool)
+        self.node_order = np.argsort(np.concatenate(time), kind='stable')
+
+    def locate(self, km1mers):
+        """ Return ids of the packed k-1-mers, -1 for the ones which are
+            not nodes. """
+
+        km1mers = np.asarray(km1mers, dtype=np.uint64)
+        ids = np.full(len(km1mers), -1, dtype=np.int64)
+        for s, (index, codes) in enumerate(split(self.shard(km1mers), self.shards, np.arange(len(km1mers)), km1mers)):
+            nodes = self.km1mers[self.node_ptr[s]:self.node_ptr[s + 1]]
+            idx = np.searchsorted(nodes, codes)
+            found = idx < len(nodes)
+            found[found] = nodes[idx[found]] == codes[found]
+            ids[index[found]] = idx[found] + self.node_ptr[s]
+        return ids
+
+    def find(self, km1mers):
+        if self.node_ptr is None:
+            return super().find(km1mers)
+        ids = self.locate(km1mers)
+        return ids[ids >= 0]
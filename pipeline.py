@@ -0,0 +1,166 @@
+from fasta import load_reads
+from graph import contigs_to_file
+from external_kmers import count_kmers_external
+from cache import ReadCache
+from instrument import Recorder
+from kmers import count_kmers, count_kmers_range, count_kmers_sketch
+from parallel import start_pool, worker_state
+from sweep import adaptive_sweep, solid_ratio, sweep
+from collections import namedtuple
+import traceback
+import time
+import os
+
+# k values checked by default
+K_RANGE = range(15, 24)
+
+# result of assemble: the chosen k, its contigs and mark, and stats of all checked k values
+Assembly = namedtuple('Assembly', ['k', 'contigs', 'mark', 'stats'])
+
+# state shared with the worker processes
+shared = worker_state('pipeline')
+
+
+def sample_name(path):
+    """ Name of a sample given by the path of its fasta file. """
+
+    return path.split('/')[-1].split('.fasta')[0]
+
+
+def count_hists(reads, k_range, memory=None, sketch=None, fp_rate=0.01, canonical=False, cache=None,
+                recorder=None, verbose=False):
+    """ Return KmerHist of the reads for every k from k_range: out of
+        core in about memory bytes, sketched with a Bloom filter of
+        sketch bytes, canonical, or exactly for all k at once. K values
+        found in the ReadCache are not counted. """
+
+    recorder = recorder or Recorder()
+    khists = {}
+    if cache is not None:
+        for k in k_range:
+            khist = cache.hist(k)
+            if khist is not None:
+                khists[k] = khist
+        if verbose:
+            print('Found %d of %d k values in the cache' % (len(khists), len(k_range)))
+    counted = [k for k in k_range if k not in khists]
+    with recorder.stage('counting', counted=counted) as record:
+        if memory:
+            khists.update({k: count_kmers_external(reads, k, memory, canonical=canonical) for k in counted})
+        elif sketch:
+            khists.update({k: count_kmers_sketch(reads, k, sketch, fp_rate, canonical=canonical) for k in counted})
+        elif canonical:
+            khists.update({k: count_kmers(reads, k, canonical=True) for k in counted})
+        else:
+            khists.update(count_kmers_range(reads, counted))
+        if record is not None:
+            record['kmers'] = {k: len(khists[k]) for k in counted}
+    return khists
+
+
+def assemble(reads, k_range=K_RANGE, name='reads', output=None, workers=1, adaptive=False, candidates=3,
+             early_stop=False, backend='nodes', memory=None, jobs=2, sketch=None, fp_rate=0.01, canonical=False,
+             checkpoints=None, cache=None, cache_size=1 << 30, recorder=None, simplify=None, verbose=False):
+    """ Assemble the reads (list or ReadStore) for k values from k_range
+        and return Assembly of the k with the best mark. Its stats hold
+        k, number of contigs, mark and time of every checked k value.
+        Options are those of main.py, memory and sketch are in bytes,
+        cache is a directory of ReadCache of cache_size bytes, name and
+        output are passed to the graphs, simplify is a dict of limits of
+        DeBruijnGraph.simplify (None skips it). With verbose progress is printed. """
+
+    recorder = recorder or Recorder()
+    if checkpoints:
+        os.makedirs(checkpoints, exist_ok=True)
+    if cache:
+        params = {'canonical': canonical, 'sketch': sketch, 'fp_rate': fp_rate if sketch else None}
+        cache = ReadCache(cache, cache_size, reads, params)
+    ref = reads.total_length() / 5 if hasattr(reads, 'total_length') else sum(len(r) for r in reads) / 5
+    khists = count_hists(reads, k_range, memory, sketch, fp_rate, canonical, cache, recorder, verbose)
+
+    if output is None:
+        output = './%s_contigs.fasta' % name
+    if adaptive:
+        if verbose:
+            for k in k_range:
+                print('Solid kmers ratio for k = %d: %.3f' % (k, solid_ratio(khists[k])))
+        results = adaptive_sweep(reads, khists, k_range, ref, name, output, workers, candidates, early_stop,
+                                 backend, memory, jobs, checkpoints, cache, recorder, simplify)
+    else:
+        results = sweep(reads, khists, k_range, ref, name, output, workers, backend, memory, jobs, checkpoints,
+                        cache, recorder, simplify)
+
+    best = Assembly(0, [], 0, [])
+    for k, contigs, m, t in results:
+        best.stats.append({'k': k, 'contigs': len(contigs), 'mark': m, 'time': t})
+        if verbose:
+            print('Found %d contigs for k = %d, mark = %.3f (%.2f s)' % (len(contigs), k, m, t))
+        if m > best.mark or (m == best.mark and k > best.k):
+            best = Assembly(k, contigs, m, best.stats)
+    return best
+
+
+def read_manifest(path):
+    """ Return (input, output) pairs of the manifest: one sample in a
+        line, the input fasta file and optionally the output file
+        (default ./<input name>_contigs.fasta), separated by whitespace.
+        Empty lines and lines starting with # are skipped. """
+
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            output = fields[1] if len(fields) > 1 else './%s_contigs.fasta' % sample_name(fields[0])
+            pairs.append((fields[0], output))
+    return pairs
+
+
+def init_worker(options, use_mmap=False):
+    """ Store options of assemble and of reading the input in the worker process. """
+
+    shared['options'] = options
+    shared['use_mmap'] = use_mmap
+
+
+def assemble_file(pair):
+    """ Assemble reads of the input file into the output file with the
+        shared options. Return a summary of the sample, with the error
+        instead of the result if it failed. """
+
+    input, output = pair
+    start = time.time()
+    summary = {'input': input, 'output': output}
+    try:
+        reads = load_reads(input, use_mmap=shared['use_mmap'])
+        result = assemble(reads, name=sample_name(input), output=output, **shared['options'])
+        contigs_to_file(result.contigs, output)
+        summary.update(k=result.k, contigs=len(result.contigs), length=sum(len(c) for c in result.contigs),
+                       mark=result.mark)
+    except Exception:
+        summary['error'] = traceback.format_exc(limit=3)
+    summary['time'] = time.time() - start
+    return summary
+
+
+def batch(pairs, workers=2, tasks_per_worker=None, use_mmap=False, **options):
+    """ Assemble many samples, (input, output) pairs, in a pool of workers
+        which load the modules only once. Every sample is assembled by
+        one worker, in one process (workers of a pool can't start their
+        own), with options of assemble. Memory of a worker is bounded by
+        out-of-core counting with options['memory'] bytes (or by the
+        sketch) and by replacing the worker after tasks_per_worker
+        samples, which gives back memory it kept. Yield summaries of
+        samples (see assemble_file) as they are done. Input files are
+        memory-mapped if use_mmap is set. """
+
+    options = dict(options, workers=1)
+    if workers > 1 and len(pairs) > 1:
+        with start_pool(min(workers, len(pairs)), init_worker, (options, use_mmap), tasks_per_worker) as pool:
+            for summary in pool.imap_unordered(assemble_file, pairs):
+                yield summary
+    else:
+        init_worker(options, use_mmap)
+        for pair in pairs:
+            yield assemble_file(pair)
@@ -0,0 +1,186 @@
+from graph import DeBruijnGraph
+from csr_graph import CSRGraph
+from partition import PartitionedGraph
+from error_correction import kmerHist, orient_reads, remove_errors
+from instrument import Recorder
+from parallel import start_pool, worker_state
+from functools import partial
+import math
+import os
+import time
+
+# state shared with the worker processes
+shared = worker_state('sweep')
+
+# graph classes which can be used for assembly
+BACKENDS = {'nodes': DeBruijnGraph, 'csr': CSRGraph, 'partitioned': PartitionedGraph}
+
+# relative drop of the mark below the best one which stops an adaptive sweep early,
+# neighbouring k values often differ by a percent or two before the best one
+EARLY_STOP_DROP = 0.05
+
+
+def mark(contigs, ref):
+    """ Score of the contigs found for one k value: their total length
+        relative to the expected genome size, penalized by their number. """
+
+    return sum([len(c) for c in contigs])/(ref*math.log(4+len(contigs), 5))
+
+
+def build_up(reads, k, khist=None, cache=None, recorder=None, workers=1):
+    """
+    Removing errors from the given reads, establishing list of tentative kmers.
+    :param reads: list of input reads
+    :param k: size of k-mers
+    :param khist: already counted kmers (KmerHist), if None they are counted here
+    :param cache: ReadCache of the reads, results found in it are returned at once, others are stored
+    :param recorder: Recorder measuring counting and correction
+    :param workers: number of processes correcting the reads
+    :return:
+    new_reads - list of corrected reads, turned to one strand if khist is canonical,
+    khist - histogram of kmers, kmers below thresh are tentative,
+    thresh - threshold of kmers coverage
+    """
+
+    recorder = recorder or Recorder()
+    if cache is not None:
+        with recorder.stage('cache', k) as record:
+            cached = cache.load(k)
+            if record is not None:
+                record['hit'] = cached is not None
+        if cached is not None:
+            return cached
+    if khist is None:
+        with recorder.stage('counting', k) as record:
+            khist, thresh = kmerHist(reads, k)
+            if record is not None:
+                record['kmers'] = len(khist)
+    else:
+        thresh = khist.threshold()
+    with recorder.stage('correction', k) as record:
+        new_reads = remove_errors(reads, k, khist, workers)
+        if khist.canonical:
+            new_reads = orient_reads(new_reads, khist)
+        if record is not None:
+            record.update(reads=len(new_reads), thresh=int(thresh))
+    if cache is not None:
+        cache.store(k, new_reads, khist, thresh)
+
+    return new_reads, khist, thresh
+
+
+def init_worker(reads, khists, ref, name, output, backend='nodes', memory=None, jobs=2, checkpoints=None,
+                cache=None, recorder=None, simplify=None):
+    """ Store the reads and k-mer histograms in the worker process. With
+        the fork start method they are inherited, not pickled. If memory
+        is given, array backends count k-mers of the reads out of core.
+        Reads are corrected by jobs processes (unless the worker is
+        daemonic), the partitioned backend builds every graph with them.
+        If checkpoints is given, merged graphs are saved into it, results
+        of build_up are looked up in and stored into the cache. Stages
+        are measured by the recorder. Simplify holds limits of tip
+        clipping and bubble popping of the graphs (see DeBruijnGraph.simplify). """
+
+    shared['reads'] = reads
+    shared['khists'] = khists
+    shared['ref'] = ref
+    shared['name'] = name
+    shared['output'] = output
+    shared['checkpoints'] = checkpoints
+    shared['cache'] = cache
+    shared['recorder'] = recorder
+    shared['jobs'] = jobs
+    options = {}
+    if memory is not None and backend != 'nodes':
+        options['memory'] = memory
+    if backend == 'partitioned':
+        options['workers'] = jobs
+    if recorder is not None:
+        options['recorder'] = recorder
+    if simplify is not None:
+        options['simplify'] = simplify
+    shared['graph'] = partial(BACKENDS[backend], **options)
+
+
+def checkpoint_path(directory, name, k):
+    """ Return the path of the checkpoint of the graph for k. """
+
+    return os.path.join(directory, '%s_k%d.graph' % (name, k))
+
+
+def assemble_k(k):
+    """ Correct the shared reads and assemble them for the given k.
+        Return k, sequences of contigs, their mark and time spent. """
+
+    start = time.time()
+    new_reads, khist, thresh = build_up(shared['reads'], k, shared['khists'][k], shared['cache'], shared['recorder'],
+                                        shared['jobs'])
+    options = {}
+    if shared['checkpoints'] is not None:
+        options['checkpoint'] = checkpoint_path(shared['checkpoints'], shared['name'], k)
+    graph = shared['graph'](new_reads, k, khist, thresh, shared['name'], shared['output'], **options)
+    contigs = [c.seq for c in graph.contigs]
+    return k, contigs, mark(contigs, shared['ref']), time.time() - start
+
+
+def sweep(reads, khists, krange, ref, name, output, workers=1, backend='nodes', memory=None, jobs=2,
+          checkpoints=None, cache=None, recorder=None, simplify=None):
+    """ Assemble the reads for every k from krange. Every k is
+        independent, so with workers > 1 they are assembled in a
+        process pool. Results are yielded in the order of krange.
+        Graphs are built with the class given by the backend name,
+        memory is the RAM budget for counting their k-mers out of core
+        and jobs the number of processes correcting the reads and
+        building graphs of the partitioned backend.
+        Merged graphs are saved into the checkpoints directory, if given,
+        corrected reads are taken from the ReadCache, if given, stages
+        are measured by the Recorder, if given. Graphs are simplified
+        with the given limits, if any. """
+
+    krange = list(krange)
+    if not krange:
+        return
+    if workers > 1:
+        with start_pool(min(workers, len(krange)), init_worker,
+                        (reads, khists, ref, name, output, backend, memory, jobs, checkpoints, cache,
+                         recorder, simplify)) as pool:
+            for result in pool.imap(assemble_k, krange):
+                yield result
+    else:
+        init_worker(reads, khists, ref, name, output, backend, memory, jobs, checkpoints, cache, recorder, simplify)
+        for k in krange:
+            yield assemble_k(k)
+
+
+def solid_ratio(khist):
+    """ Fraction of distinct k-mers seen more often than the threshold
+        used for cutting the graph. The more k-mers are solid, the
+        less of the graph is lost to errors for this k. """
+
+    spectrum = khist.spectrum()
+    total = spectrum.sum()
+    return float(spectrum[max(khist.threshold(), 1) + 1:].sum() / total) if total else 0.0
+
+
+def rank_k(khists, krange):
+    """ Return k values from krange sorted from the most promising,
+        according to their solid k-mers ratio. """
+
+    return sorted(krange, key=lambda k: -solid_ratio(khists[k]))
+
+
+def adaptive_sweep(reads, khists, krange, ref, name, output, workers=1, candidates=3, early_stop=False,
+                   backend='nodes', memory=None, jobs=2, checkpoints=None, cache=None, recorder=None, simplify=None):
+    """ Assemble the reads only for the most promising k values from
+        krange, checked from the best ranked one. If early_stop is True
+        the sweep stops as soon as the mark drops clearly (by more than
+        EARLY_STOP_DROP) below the best one so far. """
+
+    best = None
+    for result in sweep(reads, khists, rank_k(khists, krange)[:candidates], ref, name, output, workers,
+                        backend, memory, jobs, checkpoints, cache, recorder, simplify):
+        yield result
+        m = result[2]
+        if early_stop and best is not None and m < best * (1 - EARLY_STOP_DROP):
+            break
+        best = m if best is None else max(best, m)
@@ -0,0 +1,64 @@
+from accumulate import AccumulatedAssembly
+from instrument import Recorder
+from fixtures import TemporaryDirectoryTest, random_genome, sample_reads
+import unittest
+import random
+import json
+import copy
+
+
+class AccumulatedAssemblyTest(TemporaryDirectoryTest):
+    """ Contigs of the unitigs updated after every batch must be the
+        contigs of all nodes merged again from all the edges. """
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(0)
+        self.fragments = [random_genome(rng, 400) for _ in range(8)]
+        self.reads = [read for fragment in self.fragments for read in sample_reads(rng, fragment, 300, 60, 0.005)]
+        rng.shuffle(self.reads)
+        # later batches come from one fragment each
+        self.batches = [sample_reads(rng, self.fragments[i % 8], 10, 60, 0.005) for i in range(16)]
+        self.trace = self.path('trace.jsonl')
+
+    def check(self, assembly, batches):
+        for batch in batches:
+            contigs = assembly.add(batch)
+            rebuilt = copy.deepcopy(assembly)
+            rebuilt.rebuild()
+            self.assertEqual(contigs, rebuilt.sequences())
+        with open(self.trace) as f:
+            return [r for r in map(json.loads, f) if r['stage'] == 'merge']
+
+    def test_batches(self):
+        assembly = AccumulatedAssembly(17, recorder=Recorder(self.trace))
+        records = self.check(assembly, [self.reads] + self.batches)
+        self.assertEqual(len(assembly.contigs), 8)
+        self.assertEqual(len(records), 1 + len(self.batches))
+        # a batch merges again only nodes around the fragment it comes from
+        updates = [r for r in records if not r['rebuild']]
+        self.assertTrue(updates)
+        self.assertTrue(all(r['dirty'] < len(assembly.codes) / 4 for r in updates))
+
+    def test_threshold_changes(self):
+        # error-free reads at every other position give a high threshold,
+        # which falls as reads with errors are added
+        tiles = [fragment[i:i + 60] for fragment in self.fragments for i in range(0, 341, 2)]
+        assembly = AccumulatedAssembly(17, recorder=Recorder(self.trace))
+        records = self.check(assembly, [tiles] + self.batches[:6] + [self.reads])
+        self.assertGreater(records[0]['thresh'], 0)
+        self.assertGreater(sum(r['changed'] for r in records), 2)
+        self.assertEqual(len(assembly.contigs), 8)
+
+    def test_save_load(self):
+        assembly = AccumulatedAssembly(17)
+        assembly.add(self.reads)
+        assembly.save(self.directory.name)
+        loaded = AccumulatedAssembly.load(self.directory.name, 17)
+        self.assertEqual(loaded.sequences(), assembly.sequences())
+        for batch in self.batches[:4]:
+            self.assertEqual(loaded.add(batch), assembly.add(batch))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+from cache import ReadCache, dir_size
+from kmers import count_kmers
+from fixtures import TemporaryDirectoryTest, random_genome
+import unittest
+import random
+import os
+
+
+class ReadCacheTest(TemporaryDirectoryTest):
+    """ Entries read back as stored, the least recently used ones are
+        evicted once the cache grows over its size. """
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(3)
+        self.reads = [random_genome(rng, 60) for _ in range(200)]
+        self.cache = ReadCache(self.directory.name, 1 << 30, self.reads, {'canonical': False})
+
+    def store(self, k, used):
+        """ Store an entry for k and set the time it was last used. """
+
+        khist = count_kmers(self.reads, k)
+        self.cache.store(k, self.reads, khist, khist.threshold())
+        os.utime(os.path.join(self.cache.path(k), 'meta.json'), (used, used))
+
+    def test_round_trip(self):
+        khist = count_kmers(self.reads, 15)
+        self.cache.store(15, self.reads, khist, 3)
+        reads, cached, thresh = self.cache.load(15)
+        self.assertEqual([reads[i] for i in range(len(reads))], self.reads)
+        self.assertEqual((cached.kmers.tolist(), cached.counts.tolist(), thresh),
+                         (khist.kmers.tolist(), khist.counts.tolist(), 3))
+        self.assertIsNone(self.cache.load(16))
+
+    def test_eviction(self):
+        self.store(15, 1000)
+        self.store(16, 2000)
+        # reading 15 makes 16 the least recently used entry
+        self.assertIsNotNone(self.cache.load(15))
+        self.cache.max_bytes = dir_size(self.cache.path(15)) + dir_size(self.cache.path(16)) + 1000
+        self.store(17, 3000)
+        self.assertEqual([k in self.cache for k in (15, 16, 17)], [True, False, True])
+
+        # a cache opened with a lower limit evicts at once, 15 was used last
+        cache = ReadCache(self.directory.name, dir_size(self.cache.path(15)), self.reads, {'canonical': False})
+        self.assertEqual([k in cache for k in (15, 16, 17)], [True, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+from graph import DeBruijnGraph
+from csr_graph import CSRGraph
+from kmers import count_kmers
+from fixtures import TemporaryDirectoryTest, random_genome, substituted_reads
+import unittest
+import random
+
+
+class CheckpointTest(TemporaryDirectoryTest):
+    """ A graph saved into a checkpoint and resumed from it must give the
+        contigs of the graph it was saved from. """
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(2)
+        self.reads = substituted_reads(rng, random_genome(rng, 3000), 1000, 80)
+
+    def check(self, graph_class):
+        path = self.path('reads_k19.graph')
+        output = self.path('contigs.fasta')
+        khist = count_kmers(self.reads, 19)
+        graph = graph_class(self.reads, 19, khist, khist.threshold(), 'reads', output, checkpoint=path)
+        self.assertTrue(graph.contigs)
+        resumed = DeBruijnGraph.resume(path, 'reads', output)
+        self.assertEqual((resumed.k, resumed.thresh), (graph.k, graph.thresh))
+        self.assertEqual(list(resumed.nodes), list(graph.nodes))
+        for node, saved in zip(graph.nodes.values(), resumed.nodes.values()):
+            for adjacency in ('children', 'parents'):
+                self.assertEqual([(n.km1mer, w) for n, w in getattr(saved, adjacency).items()],
+                                 [(n.km1mer, w) for n, w in getattr(node, adjacency).items()])
+            self.assertEqual((saved.weights, saved.total), (node.weights, node.total))
+        self.assertEqual([c.seq for c in resumed.contigs], [c.seq for c in graph.contigs])
+        with open(output) as f:
+            self.assertEqual(f.read().split()[1::2], [c.seq for c in graph.contigs])
+
+    def test_nodes(self):
+        self.check(DeBruijnGraph)
+
+    def test_csr(self):
+        self.check(CSRGraph)
+
+
+if __name__ == '__main__':
+    unittest.main()
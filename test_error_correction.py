@@ -0,0 +1,43 @@
+from error_correction import kmerHist, neighbors1mm, remove_errors
+from fixtures import random_genome, sample_reads
+import unittest
+import random
+
+
+def correct1mm(read, k, kmerhist, alpha, thresh):
+    """ Correction of one read as it was before reads were corrected in
+        batches, one k-mer string at a time. """
+    for i in range(0, len(read)-(k-1)):
+        kmer = read[i:i+k]
+        if kmerhist.get(kmer, 0) <= thresh:
+            for newkmer in neighbors1mm(kmer, alpha):
+                if kmerhist.get(newkmer, 0) > thresh:
+                    read = read[:i] + newkmer + read[i+k:]
+                    break
+    return read
+
+
+class RemoveErrorsTest(unittest.TestCase):
+    """ Reads corrected in batches must be the reads corrected one by one,
+        also around unknown bases, which are filled in when that makes
+        the k-mer frequent. """
+
+    def check(self, errors, trials=6):
+        for trial in range(trials):
+            rng = random.Random(trial)
+            reads = sample_reads(rng, random_genome(rng, 2000), 600, 100, 0.02, errors)
+            k = (15, 19, 23)[trial % 3]
+            khist, _ = kmerHist(reads, k)
+            expected = [correct1mm(read, k, khist, 'ACGT', 1) for read in reads]
+            self.assertEqual(remove_errors(reads, k, khist, batch_size=100), expected)
+
+    def test_substitutions(self):
+        self.check('ACGT')
+
+    def test_unknown_bases(self):
+        self.check('ACGTN')
+        self.check('ACGTNNNN')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+from evaluate import read_sam, redundant_regions, score
+from math import log
+import unittest
+
+# contigs aligned to a 2000 bases long reference: a deletion, an insertion
+# with a soft clip, a mismatch on both sides of the insertion, an unmapped
+# contig, a secondary alignment and an alignment shorter than minlen
+SAM = '''@HD\tVN:1.0
+@SQ\tSN:ref\tLN:2000
+a\t0\tref\t1\t42\t250M2D248M\t*\t0\t0\t*\t*\tMD:Z:100A149^TT248
+b\t0\tref\t401\t42\t10S300M5I295M\t*\t0\t0\t*\t*\tNM:i:7\tMD:Z:50C300G243
+c\t4\t*\t0\t0\t*\t*\t0\t0\t%s\t*
+d\t256\tref\t1201\t42\t400M\t*\t0\t0\t*\t*\tMD:Z:400
+e\t0\tref\t1701\t42\t200M\t*\t0\t0\t*\t*\tMD:Z:200
+''' % ('A' * 120)
+
+
+class ScoreTest(unittest.TestCase):
+    """ Scores of a small hand-made SAM file, worked out by hand. """
+
+    def test_read_sam(self):
+        reftotlen, rdstotlen, alignments = read_sam(SAM.splitlines(True))
+        self.assertEqual(reftotlen, 2000)
+        # a, b (with the soft clip), c unmapped and e, but not the secondary d
+        self.assertEqual(rdstotlen, 498 + 610 + 120 + 200)
+        self.assertEqual([(a.start, a.end) for a in alignments], [(0, 500), (400, 995), (1200, 1600)])
+        # mismatches of b after the insertion are shifted by the second block
+        self.assertEqual(alignments[1].positions, [450, 751])
+        self.assertEqual(alignments[0].positions, [100])
+
+    def test_score(self):
+        # a is counted up to b, b from the end of a, d whole
+        length = 400 + 495 + 400
+        expected = (length / 2000, length / 1428, 1 - 10 * 2 / length, 1 / log(7, 5))
+        result = score(SAM.splitlines(True))
+        for value, correct in zip(result, expected):
+            self.assertAlmostEqual(value, correct)
+        self.assertAlmostEqual(result[4], expected[0] * expected[1] * expected[2] * expected[3])
+
+    def test_redundant_regions(self):
+        self.assertEqual(redundant_regions([(0, 500), (400, 995), (995, 1200), (300, 450)]), [(300, 500)])
+
+    def test_missing_md(self):
+        with self.assertRaises(ValueError):
+            read_sam(['x\t0\tref\t1\t42\t400M\t*\t0\t0\t*\t*\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+from fasta import ReadStore, fasta_batches, load_reads
+from fixtures import TemporaryDirectoryTest
+import unittest
+import random
+import gzip
+
+
+class FastaTest(TemporaryDirectoryTest):
+    """ Reads of multi-line and gzipped fasta files, read in small chunks
+        and batches, must be the records of the file. """
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(4)
+        self.reads = [''.join(rng.choice('ACGTN') for _ in range(rng.randrange(0, 150))) for _ in range(250)]
+        text = ''.join('>r%d\n%s\n' % (i, '\n'.join(read[j:j + 60] for j in range(0, len(read), 60)))
+                       for i, read in enumerate(self.reads)).encode()
+        self.paths = [self.path('reads.fasta'), self.path('reads.fasta.gz')]
+        with open(self.paths[0], 'wb') as f:
+            f.write(text)
+        with gzip.open(self.paths[1], 'wb') as f:
+            f.write(text)
+
+    def test_batches(self):
+        for path in self.paths:
+            batches = list(fasta_batches(path, batch_size=100, chunk_size=97))
+            self.assertEqual([len(batch) for batch in batches], [100, 100, 50])
+            self.assertEqual([read for batch in batches for read in batch], self.reads)
+            for use_mmap in (False, True):
+                store = load_reads(path, chunk_size=97, use_mmap=use_mmap)
+                expected = ReadStore.from_reads(self.reads)
+                self.assertEqual(store.data, expected.data)
+                self.assertEqual(store.offsets.tolist(), expected.offsets.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from pipeline import assemble
+from csr_graph import CSRGraph
+from partition import PartitionedGraph
+from parallel import start_pool
+from sweep import adaptive_sweep
+from kmers import count_kmers
+from fixtures import TemporaryDirectoryTest, random_genome, sample_reads, substituted_reads
+from unittest import mock
+import unittest
+import random
+
+
+class ShortReadsTest(TemporaryDirectoryTest):
+    """ Reads shorter than the largest k leave graphs of some k values
+        without nodes, which must not stop the assembly. """
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(0)
+        self.reads = sample_reads(rng, random_genome(rng, 300), 400, 20)
+        self.output = self.path('contigs.fasta')
+
+    def check(self, **options):
+        result = assemble(self.reads, range(15, 24), output=self.output, **options)
+        self.assertEqual([s['k'] for s in result.stats], list(range(15, 24)))
+        # no k-mers of reads of 20 bases for k > 20
+        self.assertEqual([s['contigs'] for s in result.stats if s['k'] > 20], [0, 0, 0])
+
+    def test_nodes(self):
+        self.check()
+
+    def test_csr(self):
+        self.check(backend='csr')
+
+    def test_partitioned(self):
+        self.check(backend='partitioned')
+
+    def test_canonical(self):
+        self.check(canonical=True)
+
+
+class PartitionedGraphTest(TemporaryDirectoryTest):
+    """ Graphs built shard by shard must give the contigs of CSRGraph,
+        with one pool of workers for the whole build. """
+
+    def test_contigs(self):
+        rng = random.Random(1)
+        reads = substituted_reads(rng, random_genome(rng, 2000), 600, 50)
+        output = self.path('contigs.fasta')
+        for k in (15, 21):
+            khist = count_kmers(reads, k)
+            thresh = khist.threshold()
+            expected = [c.seq for c in CSRGraph(reads, k, khist, thresh, 'reads', output).contigs]
+            for workers, shards in ((1, None), (2, None), (2, 13)):
+                with mock.patch('partition.start_pool', wraps=start_pool) as pools:
+                    graph = PartitionedGraph(reads, k, khist, thresh, 'reads', output, workers=workers,
+                                             shards=shards)
+                self.assertEqual(pools.call_count, int(workers > 1))
+                self.assertEqual([c.seq for c in graph.contigs], expected)
+
+
+class AdaptiveSweepTest(unittest.TestCase):
+    """ The early stop must wait for a clear drop of the mark below the
+        best one, not stop at the first small dip. """
+
+    def run_sweep(self, marks):
+        results = [(k, [], m, 0.0) for k, m in marks]
+        with mock.patch('sweep.rank_k', lambda khists, krange: list(krange)), \
+                mock.patch('sweep.sweep', lambda reads, khists, krange, *args: iter(results)):
+            return [r[0] for r in adaptive_sweep([], {}, [k for k, m in marks], 1, 'reads', None, candidates=4,
+                                                 early_stop=True)]
+
+    def test_early_stop(self):
+        # marks of k = 15, 16, 17 on reads5: 16 dips by less than a percent
+        self.assertEqual(self.run_sweep([(15, 0.2453), (16, 0.2433), (17, 0.2478), (18, 0.2261)]), [15, 16, 17, 18])
+        self.assertEqual(self.run_sweep([(19, 0.1571), (20, 0.1278), (21, 0.1044)]), [19, 20])
+
+
+if __name__ == '__main__':
+    unittest.main()